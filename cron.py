@@ -8,6 +8,8 @@ from odinfo.config import check_dirs_and_configs, get_config
 from odinfo.facade.cache import FacadeCache
 from odinfo.facade.odinfo import ODInfoFacade
 from odinfo.repositories.game import GameRepository
+from odinfo.repositories.querystats import QueryRecorder
+from odinfo.services.cleanup_service import CleanupService
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("odinfo.cron")
@@ -42,14 +44,33 @@ def initialize_database(config) -> GameRepository:
 
 def update_all(config, repo: GameRepository) -> None:
     """Update all information from the OD into the database."""
-    cache = FacadeCache()
+    recorder = QueryRecorder()
+    recorder.install(repo.session.get_bind())
+    cache = FacadeCache.from_config(config)
     facade = ODInfoFacade(config, repo, cache)
     logging.info("Updating Dominions Index (from search page)...")
-    facade.update_dom_index()
+    with recorder.recording('cron update_dom_index'):
+        facade.update_dom_index()
     logging.info("Updating all Dominions...")
-    facade.update_all()
+    with recorder.recording('cron update_all'):
+        facade.update_all()
     logging.info("Updating realmies...")
-    facade.update_realmies()
+    with recorder.recording('cron update_realmies'):
+        facade.update_realmies()
+    if config.cron_cleanup:
+        logging.info("Cleaning up old ops...")
+        with recorder.recording('cron cleanup_old_ops'):
+            progress = facade.cleanup_old_ops(CleanupService())
+        logging.info("Deleted %d old ops rows, %s", progress.total_deleted, progress.reclaimed)
+    else:
+        logging.info("Not cleaning up old ops, CRON_CLEANUP is off")
+    if config.shared_cache:
+        logging.info("Warming up the cache...")
+        with recorder.recording('cron warm_up_cache'):
+            duration = facade.warm_up_cache()
+        logging.info("Warmed up the cache in %.1f seconds", duration)
+    else:
+        logging.info("Not warming up the cache, SHARED_CACHE is off")
 
 
 if __name__ == '__main__':
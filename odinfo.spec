@@ -36,11 +36,9 @@ a = Analysis(
         'requests',
         'bs4',
         'urllib3',
-        # Image and plotting
+        # Images
         'PIL',
         'PIL.Image',
-        'matplotlib',
-        'matplotlib.pyplot',
         # Data formats
         'yaml',
         'json',
@@ -59,6 +57,7 @@ a = Analysis(
         'odinfo.facade',
         'odinfo.facade.odinfo',
         'odinfo.facade.graphs',
+        'odinfo.facade.svgchart',
         'odinfo.facade.awardstats',
         'odinfo.facade.discord',
         'odinfo.facade.towncrier',
@@ -94,6 +93,8 @@ a = Analysis(
         'pip',
         'wheel',
         'distutils',
+        # Graphs are drawn as SVG, the optional matplotlib renderer (the 'matplotlib' extra) isn't bundled
+        'matplotlib',
     ],
     noarchive=False,
     optimize=0,
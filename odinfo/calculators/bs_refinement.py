@@ -0,0 +1,222 @@
+"""
+Cross-tick BarracksSpy refinement.
+
+MilitaryCalculator.refined_home_units only combines BS ops of the same tick. A BS from a few ticks
+earlier is still an observation of the home units at a later tick, once the units that arrived in
+between are added: the training queue is exact, the returning queue is known within the BS fuzz.
+Units sent out in between show up in the returning queue of the later BS (they return after
+RETURN_TICKS ticks, fewer for units with the faster_return perk), so they are subtracted again.
+
+CrossTickRefinement projects every BS within a window of ticks to a common reference tick (the
+latest BS) and intersects the bounds. BS ops are added one at a time, oldest first as they come in:
+a newer BS moves the reference tick forward and projects the bounds collected so far along with it.
+When the bounds of an older BS don't overlap with the newer ones, the army changed in a way the
+queues don't show (invasion, release, units trained after the older BS) and the older observations
+are dropped.
+
+Draftees change every tick, so only the BS ops of the reference tick itself refine them.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from odinfo.calculators.military import RETURN_TICKS, MilitaryCalculator
+from odinfo.timeutils import truncate_to_tick
+
+logger = logging.getLogger('od-info.bs_refinement')
+
+# Units trained right after a BS arrive 9 ticks later at the earliest, so up to 8 ticks all arrivals
+# since an older BS are in its training queue.
+DEFAULT_WINDOW = 8
+# BS amounts are rounded, so bounds that miss each other by this many units still agree
+INCONSISTENCY_TOLERANCE = 2
+UNIT_KEYS = tuple(f'unit{i}' for i in range(1, 5))
+HOME_ATTRIBUTES = {'draftees': 'draftees', **{key: f'home_{key}' for key in UNIT_KEYS}}
+
+
+@dataclass
+class ProjectedBS:
+    """Bounds of the home units at the reference tick according to one BS."""
+    timestamp: datetime
+    ticks_before: int  # ticks between this BS and the reference tick
+    bounds: dict[str, tuple[float, float]]
+
+
+@dataclass
+class RejectedBS:
+    timestamp: datetime
+    reason: str
+
+
+@dataclass
+class CrossTickRefinement:
+    window: int = DEFAULT_WINDOW
+    # Ticks until sent out units are back, per unit (see MilitaryCalculator.return_ticks)
+    return_ticks: dict[str, int] = field(default_factory=lambda: dict.fromkeys(UNIT_KEYS, RETURN_TICKS))
+    reference_tick: datetime | None = None
+    observations: list[ProjectedBS] = field(default_factory=list)
+    rejected: list[RejectedBS] = field(default_factory=list)
+    # BS ops up to this tick are from before a change in the army
+    cutoff_tick: datetime | None = None
+    # Queues of the reference tick: exact training and refined returning, per unit and tick
+    _training: dict[str, list[int]] = field(default_factory=dict, repr=False)
+    _returning: dict[str, list[tuple[float, float]]] = field(default_factory=dict, repr=False)
+    _reference_spies: list = field(default_factory=list, repr=False)
+
+    @classmethod
+    def from_barracks_spies(cls, barracks_spies: list, window: int = DEFAULT_WINDOW,
+                            return_ticks: dict[str, int] | None = None) -> 'CrossTickRefinement':
+        """Refinement of the given BS ops (in any order), oldest first."""
+        refinement = cls(window)
+        if return_ticks:
+            refinement.return_ticks = {**refinement.return_ticks, **return_ticks}
+        for bs in sorted(barracks_spies, key=lambda bs: bs.timestamp):
+            refinement.add(bs)
+        return refinement
+
+    def add(self, bs) -> bool:
+        """
+        Add a BS op.
+
+        Returns:
+            False if the BS is outside the window or doesn't agree with the newer ones.
+        """
+        tick = truncate_to_tick(bs.timestamp)
+        if self.reference_tick is None or tick > self.reference_tick:
+            self._advance(tick, bs)
+            return True
+
+        ticks_before = int((self.reference_tick - tick).total_seconds() // 3600)
+        if self.cutoff_tick is not None and tick <= self.cutoff_tick:
+            self.rejected.append(RejectedBS(bs.timestamp, "from before a change in the army"))
+            return False
+        if ticks_before == 0:
+            self._reference_spies.append(bs)
+            self._refresh_queues()
+            self.observations.append(ProjectedBS(bs.timestamp, 0, self._observed_bounds(bs, draftees=True)))
+            return True
+        if ticks_before > self.window:
+            return False
+
+        projected = ProjectedBS(bs.timestamp, ticks_before, self._project(bs, ticks_before))
+        conflicts = self._conflicts(projected.bounds, self.bounds())
+        if conflicts:
+            self.rejected.append(RejectedBS(bs.timestamp, f"{', '.join(conflicts)} changed since then"))
+            self.cutoff_tick = max(tick, self.cutoff_tick) if self.cutoff_tick else tick
+            return False
+        self.observations.append(projected)
+        return True
+
+    def _advance(self, tick: datetime, bs):
+        """Make the tick of bs the reference tick, projecting the observations so far to it."""
+        previous_tick = self.reference_tick
+        if self.reference_tick is not None:
+            ticks_later = int((tick - self.reference_tick).total_seconds() // 3600)
+            arrived = self._arrived_bounds(ticks_later)
+            self._reference_spies = [bs]
+            self._refresh_queues()
+            sent = self._sent_bounds(ticks_later)
+            projected = []
+            for observation in self.observations:
+                if observation.ticks_before + ticks_later > self.window:
+                    continue
+                bounds = {key: (lower + arrived[key][0] - sent[key][1], upper + arrived[key][1] - sent[key][0])
+                          for key, (lower, upper) in observation.bounds.items() if key != 'draftees'}
+                projected.append(ProjectedBS(observation.timestamp, observation.ticks_before + ticks_later, bounds))
+            self.observations = projected
+        else:
+            self._reference_spies = [bs]
+            self._refresh_queues()
+        self.reference_tick = tick
+
+        observed = self._observed_bounds(bs, draftees=True)
+        conflicts = self._conflicts(observed, self.bounds())
+        if conflicts:
+            for observation in self.observations:
+                self.rejected.append(RejectedBS(observation.timestamp, f"{', '.join(conflicts)} changed since then"))
+            self.observations = []
+            self.cutoff_tick = previous_tick
+        self.observations.append(ProjectedBS(bs.timestamp, 0, observed))
+
+    def _refresh_queues(self):
+        """Training of the latest BS and refined returning of all BS ops in the reference tick."""
+        latest = max(self._reference_spies, key=lambda bs: bs.timestamp)
+        training = latest.tick_arrays('training')
+        self._training = {key: training[key] for key in UNIT_KEYS if key in training}
+        returning = [bs.tick_arrays('returning') for bs in self._reference_spies]
+        self._returning = {}
+        for key in UNIT_KEYS:
+            queues = [r[key] for r in returning if key in r]
+            if queues:
+                self._returning[key] = [
+                    MilitaryCalculator.refine_unit_estimate([q[tick] for q in queues if tick < len(q) and q[tick] > 0])[:2]
+                    for tick in range(max(len(q) for q in queues))]
+
+    @staticmethod
+    def _observed_bounds(bs, draftees: bool) -> dict[str, tuple[float, float]]:
+        return {key: MilitaryCalculator.refine_unit_estimate([getattr(bs, attribute)])[:2]
+                for key, attribute in HOME_ATTRIBUTES.items() if draftees or key != 'draftees'}
+
+    def _arrived_bounds(self, ticks: int) -> dict[str, tuple[float, float]]:
+        """Units arriving home in the ticks after the reference tick, per the reference queues."""
+        arrived = {}
+        for key in UNIT_KEYS:
+            training = sum(self._training.get(key, [])[1:ticks + 1])
+            returning = self._returning.get(key, [])[1:ticks + 1]
+            arrived[key] = (training + sum(lower for lower, upper in returning),
+                            training + sum(upper for lower, upper in returning))
+        return arrived
+
+    def _sent_bounds(self, ticks: int) -> dict[str, tuple[float, float]]:
+        """Units that left in the last ticks, per the returning queue of the reference tick."""
+        sent = {}
+        for key in UNIT_KEYS:
+            returning = self._returning.get(key, [])[max(1, self.return_ticks[key] - ticks + 1):]
+            sent[key] = (sum(lower for lower, upper in returning), sum(upper for lower, upper in returning))
+        return sent
+
+    def _project(self, bs, ticks_before: int) -> dict[str, tuple[float, float]]:
+        """Bounds of the home units at the reference tick according to a BS ticks_before ticks earlier."""
+        training = bs.tick_arrays('training')
+        returning = bs.tick_arrays('returning')
+        sent = self._sent_bounds(ticks_before)
+        bounds = {}
+        for key, (lower, upper) in self._observed_bounds(bs, draftees=False).items():
+            arrived_training = sum(training.get(key, [])[1:ticks_before + 1])
+            arrived_returning = [MilitaryCalculator.refine_unit_estimate([amount])[:2] if amount > 0 else (0, 0)
+                                 for amount in returning.get(key, [])[1:ticks_before + 1]]
+            bounds[key] = (lower + arrived_training + sum(low for low, high in arrived_returning) - sent[key][1],
+                           upper + arrived_training + sum(high for low, high in arrived_returning) - sent[key][0])
+        return bounds
+
+    @staticmethod
+    def _conflicts(bounds: dict[str, tuple[float, float]], combined: dict[str, tuple[float, float, int]]) -> list[str]:
+        return [key for key, (lower, upper) in bounds.items()
+                if key in combined and (lower > combined[key][1] + INCONSISTENCY_TOLERANCE
+                                        or upper < combined[key][0] - INCONSISTENCY_TOLERANCE)]
+
+    def bounds(self) -> dict[str, tuple[float, float, int]]:
+        """Intersected (lower, upper, number of observations) per unit at the reference tick."""
+        combined = {}
+        for observation in self.observations:
+            for key, (lower, upper) in observation.bounds.items():
+                if key in combined:
+                    combined_lower, combined_upper, count = combined[key]
+                    combined[key] = (max(combined_lower, lower), min(combined_upper, upper), count + 1)
+                else:
+                    combined[key] = (lower, upper, 1)
+        return combined
+
+    def refined_home(self) -> dict:
+        """Refined home units at the reference tick, in the format of MilitaryCalculator.refined_home_units."""
+        result = {}
+        for key, (lower, upper, count) in self.bounds().items():
+            if count == 1:
+                error_pct = MilitaryCalculator.BS_DEFAULT_ERROR
+            elif lower > 0:
+                error_pct = max(0, (upper - lower) / ((lower + upper) / 2) * 100 / 2)
+            else:
+                error_pct = MilitaryCalculator.BS_DEFAULT_ERROR
+            result[key] = (lower, upper, error_pct)
+        return result
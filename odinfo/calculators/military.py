@@ -1,19 +1,30 @@
 import time
 import logging
+from bisect import bisect_left
+from itertools import accumulate
 from math import trunc
+from typing import Iterable
 
 from odinfo.domain.models import Dominion
-from odinfo.domain.refdata import Race
+from odinfo.domain.refdata import Race, snapshot_property
 from odinfo.domain.refdata import GT_DEFENSE_FACTOR, GN_OFFENSE_BONUS, TEMPLE_BONUS_PER_PERC, Unit, Spells, MAX_TEMPLE_BONUS
 from odinfo.domain.refdata import NETWORTH_VALUES, ARES_BONUS
 
 logger = logging.getLogger('od-info.military')
 
+# Ticks until units sent out are home again, less the unit's faster_return perk
+RETURN_TICKS = 12
+
 
 class MilitaryCalculator(object):
-    def __init__(self, dom: Dominion):
+    def __init__(self, dom: Dominion, snapshot=True):
+        """
+        In snapshot mode (the default) bonuses, unit OP/DP and the race's unit orderings are evaluated
+        once and kept for the lifetime of the calculator. Call invalidate() after changing the dominion.
+        """
         self.dom = dom
-        self.race = Race(dom, dom.race)
+        self._snapshot = {} if snapshot else None
+        self.race = Race(dom, dom.race, snapshot)
         self.army = dom.military
         self.navy = dom.navy
         self.spells = None
@@ -21,6 +32,19 @@ class MilitaryCalculator(object):
         self._five_four_dp = None
         self._five_four_breakdown = None
 
+    def invalidate(self):
+        """Re-read the dominion's military and forget all values evaluated in snapshot mode."""
+        if self._snapshot is not None:
+            self._snapshot.clear()
+        self.race.invalidate()
+        self.army = self.dom.military
+        self.navy = self.dom.navy
+        self._five_four_op = None
+        self._five_four_dp = None
+        self._five_four_breakdown = None
+        if hasattr(self, '_flex_unit'):
+            del self._flex_unit
+
     def __str__(self):
         unit_txt = [f"{self.amount(i)} {self.unit_type(i).name} {self.unit_type(i).offense}/{self.unit_type(i).defense}" for i in range(1, 5)]
         return f"Military({'|'.join(unit_txt)}, {self.paid_op}OP, {self.paid_dp}DP)"
@@ -28,6 +52,10 @@ class MilitaryCalculator(object):
     def unit_type(self, unit_nr: int) -> Unit:
         return self.race.unit(unit_nr)
 
+    def return_ticks(self, unit_nr: int) -> int:
+        """Ticks until units of this type that are sent out are home again."""
+        return RETURN_TICKS - int(self.unit_type(unit_nr).get_perk('faster_return', 0))
+
     def amount(self, unit_nr: int) -> int:
         if self.army:
             return trunc(self.army[f'unit{unit_nr}'])
@@ -76,9 +104,14 @@ class MilitaryCalculator(object):
         missing = self.missing_intel_for_stats()
         return len(missing['offense']) > 0 or len(missing['defense']) > 0
 
-    @property
+    @snapshot_property
     def hittable_75_percent(self):
-        return trunc(self.dom.current_land * 3 / 4)
+        return self.hittable_land(self.dom.current_land)
+
+    @staticmethod
+    def hittable_land(land: int) -> int:
+        """The smallest land that is a 75% hit for a dominion of the given land."""
+        return trunc(land * 3 / 4)
 
     def op_of(self, unit_nr: int, with_bonus=False, partial_amount=None):
         assert isinstance(unit_nr, int)
@@ -128,14 +161,14 @@ class MilitaryCalculator(object):
             self.spells = Spells()
         return self.spells.value_for_perk(race.lower(), perk_name)
 
-    @property
+    @snapshot_property
     def temple_bonus(self) -> float:
         if self.dom.buildings:
             return min(MAX_TEMPLE_BONUS, self.dom.buildings.ratio_of('temple') * TEMPLE_BONUS_PER_PERC)
         else:
             return 0
 
-    @property
+    @snapshot_property
     def five_four_op_with_temples(self) -> float:
         """The effective OP that a defender has to compare their DP with to see if they're safe."""
         return round(self.five_over_four[0] / (1 - self.temple_bonus))
@@ -147,46 +180,46 @@ class MilitaryCalculator(object):
         else:
             return round(self.safe_op_versus(versus_op)[0] / (1 - self.temple_bonus))
 
-    @property
+    @snapshot_property
     def gryphon_nest_bonus(self) -> float:
         if self.dom.buildings:
             return self.dom.buildings.ratio_of('gryphon_nest') * GN_OFFENSE_BONUS
         else:
             return 0
 
-    @property
+    @snapshot_property
     def guard_tower_bonus(self) -> float:
         if self.dom.buildings:
             return self.dom.buildings.ratio_of('guard_tower') * GT_DEFENSE_FACTOR
         else:
             return 0
 
-    @property
+    @snapshot_property
     def racial_offense_bonus(self) -> float:
         """Racial offense bonus as a decimal"""
         return self.race.get_perk('offense', 0) / 100
 
-    @property
+    @snapshot_property
     def spell_offense_bonus(self) -> float:
         """Spell offense bonus as a decimal"""
         return self.spell_bonus(self.dom.race, 'offense') / 100
 
-    @property
+    @snapshot_property
     def tech_offense_bonus(self) -> float:
         """Tech offense bonus as a decimal"""
         return float(self.dom.tech.value_for_perk('offense')) / 100
 
-    @property
+    @snapshot_property
     def forges_bonus(self) -> float | None:
         """Forges bonus as a decimal"""
         return self.dom.last_castle.forges_rating if self.dom.last_castle else 0
 
-    @property
+    @snapshot_property
     def prestige_bonus(self) -> float | None:
         """Prestige bonus as a decimal"""
         return (self.dom.last_cs.prestige / 10000) if self.dom.last_cs else 0
 
-    @property
+    @snapshot_property
     def offense_bonus(self) -> float:
         bonus = 0
         bonus += self.racial_offense_bonus
@@ -198,25 +231,25 @@ class MilitaryCalculator(object):
         bonus += self.prestige_bonus
         return bonus
 
-    @property
+    @snapshot_property
     def racial_defense_bonus(self):
         return self.race.get_perk('defense', 0) / 100
 
-    @property
+    @snapshot_property
     def spell_defense_bonus(self):
         """Spell defense bonus as a decimal, assuming Ares is up as well."""
         return (self.spell_bonus(self.race.name, 'defense') / 100) + ARES_BONUS
 
-    @property
+    @snapshot_property
     def tech_defense_bonus(self):
         return float(self.dom.tech.value_for_perk('defense')) / 100
 
-    @property
+    @snapshot_property
     def walls_bonus(self) -> float | None:
         """Walls bonus as a decimal"""
         return self.dom.last_castle.walls_rating if self.dom.last_castle else 0
 
-    @property
+    @snapshot_property
     def defense_bonus(self) -> float:
         """Defense bonus as a decimal"""
         bonus = 0
@@ -227,30 +260,30 @@ class MilitaryCalculator(object):
         bonus += self.guard_tower_bonus
         return bonus
 
-    @property
+    @snapshot_property
     def raw_op(self) -> int:
         return sum([self.op_of(i) for i in range(1, 5)])
 
-    @property
+    @snapshot_property
     def paid_op(self) -> int:
         return round(self.raw_op * (1 + self.offense_bonus))
 
-    @property
+    @snapshot_property
     def draftees(self) -> int:
         return self.dom.last_cs.military_draftees if self.dom.last_cs else 0
 
-    @property
+    @snapshot_property
     def total_units(self) -> int:
         return sum([self.amount(i) for i in range(1, 5)]) + self.draftees
 
-    @property
+    @snapshot_property
     def raw_dp(self) -> int:
         defense = 0
         defense += sum([self.dp_of(i) for i in range(1, 5)])
         defense += self.draftees
         return defense
 
-    @property
+    @snapshot_property
     def paid_dp(self) -> int:
         return round(self.raw_dp * (1 + self.defense_bonus))
 
@@ -335,30 +368,22 @@ class MilitaryCalculator(object):
             return {}
 
         result = {}
+        returning = [bs.tick_arrays('returning') for bs in barracks_spies]
 
         for i in range(1, 5):
             unit_key = f'unit{i}'
+            queues = [r[unit_key] for r in returning if unit_key in r]
+            if not queues:
+                continue
 
-            # Collect all ticks that have arrived (tick <= age)
-            arrived_ticks = set()
-            for bs in barracks_spies:
-                if bs.returning and unit_key in bs.returning:
-                    for tick in bs.returning[unit_key].keys():
-                        if int(tick) <= ticks_since_bs:
-                            arrived_ticks.add(tick)
-
-            # Sum up refined values for all arrived ticks
+            # Sum up refined values for all ticks that have arrived (tick <= age)
             total_lower = 0
             total_upper = 0
             max_error = 0
 
-            for tick in arrived_ticks:
-                observations = []
-                for bs in barracks_spies:
-                    if bs.returning and unit_key in bs.returning:
-                        val = bs.returning[unit_key].get(tick, 0)
-                        if val > 0:
-                            observations.append(val)
+            last_tick = min(ticks_since_bs, max(len(q) for q in queues) - 1)
+            for tick in range(last_tick + 1):
+                observations = [q[tick] for q in queues if tick < len(q) and q[tick] > 0]
                 if observations:
                     lower, upper, error = self.refine_unit_estimate(observations)
                     total_lower += lower
@@ -384,18 +409,24 @@ class MilitaryCalculator(object):
             return {}
 
         result = {}
+        training = latest_bs.tick_arrays('training')
         for i in range(1, 5):
             unit_key = f'unit{i}'
-            key = f'unit{i}'
-            if latest_bs.training and key in latest_bs.training:
-                arrived = sum(
-                    amount for tick, amount in latest_bs.training[key].items()
-                    if int(tick) <= ticks_since_bs
-                )
+            if unit_key in training and ticks_since_bs >= 0:
+                arrived = sum(training[unit_key][:ticks_since_bs + 1])
                 if arrived > 0:
                     result[unit_key] = arrived
         return result
 
+    def arrival_timeline(self, barracks_spies: list, latest_bs, refined_home: dict | None = None) -> 'ArrivalTimeline':
+        """
+        Refined home units and arrivals for any number of ticks after the BS, see ArrivalTimeline.
+        The home units are refined from barracks_spies unless refined_home is given.
+        """
+        if refined_home is None:
+            refined_home = self.refined_home_units(barracks_spies)
+        return ArrivalTimeline(refined_home, barracks_spies, latest_bs)
+
     def current_raw_op(self, refined_home: dict, arrived_returning: dict, arrived_training: dict) -> int:
         """Calculate raw OP from refined home + arrived training + arrived returning.
 
@@ -486,11 +517,11 @@ class MilitaryCalculator(object):
         """Calculate DP with bonuses from current strength."""
         return round(self.current_raw_dp(refined_home, arrived_returning, arrived_training) * (1 + self.defense_bonus))
 
-    @property
+    @snapshot_property
     def max_sendable_op(self) -> int:
         return min((self.safe_op, self.five_over_four[0]))
 
-    @property
+    @snapshot_property
     def safe_op(self) -> int:
         """Only calc based on attack units (types 1 & 4)"""
         # Correct for weird races like Troll
@@ -502,7 +533,7 @@ class MilitaryCalculator(object):
         offense *= 1 + self.offense_bonus
         return round(offense)
 
-    @property
+    @snapshot_property
     def safe_dp(self) -> int:
         """Only calc based on defense units (types 2 & 3)"""
         # Correct for weird races like Troll
@@ -552,6 +583,11 @@ class MilitaryCalculator(object):
         logger.debug(f"Execution time of safe_op_versus: {end - start} for dom {self.dom.code}")
         return trunc(safe_op), round(dp_at_home)
 
+    @snapshot_property
+    def safe_op_curve(self) -> 'SafeOpCurve':
+        """safe_op_versus() for any enemy OP, without going through the calculator again."""
+        return SafeOpCurve(self)
+
     @property
     def flex_unit(self) -> Unit | None:
         if not hasattr(self, '_flex_unit'):
@@ -704,6 +740,185 @@ class MilitaryCalculator(object):
         }
 
 
+class ArrivalTimeline(object):
+    """
+    MilitaryCalculator.arrived_returning_units() and arrived_training_units() for every tick at once.
+
+    The refined returning bounds and the training queue are accumulated per unit and tick when the
+    timeline is built, so current strength, paid strength and a forecast all look up the same arrays
+    instead of refining the BS queues again for each tick.
+    """
+    __slots__ = ('refined_home', 'returning', 'training')
+
+    def __init__(self, refined_home: dict, barracks_spies: list, latest_bs):
+        self.refined_home = refined_home
+        # unit -> [(total lower, total upper, max error) of the ticks up to and including tick t]
+        self.returning = {}
+        # unit -> [total arrived up to and including tick t]
+        self.training = {}
+
+        returning = [bs.tick_arrays('returning') for bs in barracks_spies]
+        for i in range(1, 5):
+            unit_key = f'unit{i}'
+            queues = [r[unit_key] for r in returning if unit_key in r]
+            if not queues:
+                continue
+            total_lower = 0
+            total_upper = 0
+            max_error = 0
+            cumulative = []
+            for tick in range(max(len(q) for q in queues)):
+                observations = [q[tick] for q in queues if tick < len(q) and q[tick] > 0]
+                if observations:
+                    lower, upper, error = MilitaryCalculator.refine_unit_estimate(observations)
+                    total_lower += lower
+                    total_upper += upper
+                    max_error = max(max_error, error)
+                cumulative.append((total_lower, total_upper, max_error))
+            self.returning[unit_key] = cumulative
+
+        if latest_bs:
+            training = latest_bs.tick_arrays('training')
+            for i in range(1, 5):
+                if f'unit{i}' in training:
+                    self.training[f'unit{i}'] = list(accumulate(training[f'unit{i}']))
+
+    def arrived_returning(self, ticks_since_bs: int) -> dict:
+        """Same as MilitaryCalculator.arrived_returning_units(barracks_spies, ticks_since_bs)."""
+        result = {}
+        if ticks_since_bs < 0:
+            return result
+        for unit_key, cumulative in self.returning.items():
+            if cumulative:
+                total_lower, total_upper, max_error = cumulative[min(ticks_since_bs, len(cumulative) - 1)]
+                if total_lower > 0 or total_upper > 0:
+                    result[unit_key] = (total_lower, total_upper, max_error)
+        return result
+
+    def arrived_training(self, ticks_since_bs: int) -> dict:
+        """Same as MilitaryCalculator.arrived_training_units(latest_bs, ticks_since_bs)."""
+        result = {}
+        if ticks_since_bs < 0:
+            return result
+        for unit_key, cumulative in self.training.items():
+            arrived = cumulative[min(ticks_since_bs, len(cumulative) - 1)]
+            if arrived > 0:
+                result[unit_key] = arrived
+        return result
+
+    def strength(self, mc: MilitaryCalculator, ticks_since_bs: int) -> tuple[int, int]:
+        """OP and DP (with bonuses) with everything home that has arrived ticks_since_bs after the BS."""
+        arrived_returning = self.arrived_returning(ticks_since_bs)
+        arrived_training = self.arrived_training(ticks_since_bs)
+        return (mc.current_op(self.refined_home, arrived_returning, arrived_training),
+                mc.current_dp(self.refined_home, arrived_returning, arrived_training))
+
+
+class _HybridTerms(object):
+    """The inputs of MilitaryCalculator.op_of/dp_of for one hybrid unit, to evaluate partial amounts."""
+    __slots__ = ('amount', 'offense', 'offense_spell', 'offense_pair_cap', 'offense_pair_bonus', 'offense_factor',
+                 'defense', 'defense_pair_cap', 'defense_pair_bonus', 'defense_factor',
+                 'dp_per_unit', 'full_op', 'full_dp')
+
+    def __init__(self, mc: MilitaryCalculator, unit: Unit):
+        unit_nr = mc.race.nr_of_unit(unit)
+        self.amount = mc.amount(unit_nr)
+        self.offense = unit.offense
+        self.offense_spell = mc.spell_bonus(mc.dom.race, f'offense_unit{unit_nr}')
+        self.offense_pair_cap, self.offense_pair_bonus = self._pairing(mc, unit, 'offense_from_pairing')
+        self.offense_factor = 1 + mc.offense_bonus
+        self.defense = unit.defense
+        self.defense_pair_cap, self.defense_pair_bonus = self._pairing(mc, unit, 'defense_from_pairing')
+        self.defense_factor = 1 + mc.defense_bonus
+        # What safe_op_versus divides the OP to defend by to get the number of units needed
+        self.dp_per_unit = unit.defense * (1 + mc.defense_bonus)
+        self.full_op = mc.op_of(unit_nr, with_bonus=True)
+        self.full_dp = mc.dp_of(unit_nr, with_bonus=True)
+
+    @staticmethod
+    def _pairing(mc: MilitaryCalculator, unit: Unit, perk: str) -> tuple[int, int] | tuple[None, None]:
+        if not unit.has_perk(perk):
+            return None, None
+        slot, num_required, buff = unit.get_perk(perk)
+        return mc.amount(int(slot)) // int(num_required), int(buff)
+
+    def op_of(self, amount) -> float:
+        op = amount * self.offense
+        if self.offense_spell:
+            op += amount * self.offense_spell
+        if self.offense_pair_cap is not None:
+            op += min(self.offense_pair_cap, amount) * self.offense_pair_bonus
+        return op * self.offense_factor
+
+    def dp_of(self, amount) -> float:
+        dp = amount * self.defense
+        if self.defense_pair_cap is not None:
+            dp += min(self.defense_pair_cap, amount) * self.defense_pair_bonus
+        return dp * self.defense_factor
+
+
+class SafeOpCurve(object):
+    """
+    MilitaryCalculator.safe_op_versus() as a function of the enemy OP.
+
+    Pure defense units and draftees always stay home, hybrids stay home most defensive first and
+    each hybrid is only needed once the DP of everything before it has run out. The breakpoints
+    are the enemy OPs at which that happens. Below its breakpoint a hybrid is sent entirely, above
+    the next one it stays home entirely, in between it is split.
+
+    at() finds the hybrid that is split with a bisection over the breakpoints and adds up the result
+    in the order safe_op_versus() does, so the military list can be evaluated against another enemy
+    OP without building calculators again.
+    """
+    __slots__ = ('pure_op', 'breakpoints', 'hybrids', 'temple_bonus')
+
+    def __init__(self, mc: MilitaryCalculator):
+        home_dp = sum([mc.dp_of(mc.race.nr_of_unit(u), with_bonus=True) for u in mc.race.pure_defense_units])
+        home_dp += mc.army['draftees'] * (1 + mc.defense_bonus)
+        self.pure_op = sum([mc.op_of(mc.race.nr_of_unit(u), with_bonus=True) for u in mc.race.pure_offense_units])
+        self.hybrids = tuple(_HybridTerms(mc, unit) for unit in mc.race.hybrids_by_dp)
+        # Home DP before each hybrid, and the enemy OP above which that hybrid is needed at home
+        breakpoints = []
+        for hybrid in self.hybrids:
+            breakpoints.append(home_dp)
+            home_dp += hybrid.full_dp
+        self.breakpoints = tuple(breakpoints)
+        self.temple_bonus = mc.temple_bonus
+        if not self.hybrids:
+            self.breakpoints = (home_dp, )
+
+    def at(self, enemy_op: int) -> tuple[int, int]:
+        """Same as MilitaryCalculator.safe_op_versus(enemy_op)."""
+        enemy_op = int(enemy_op)
+        if not self.hybrids:
+            return trunc(self.pure_op), round(self.breakpoints[0])
+
+        needed = bisect_left(self.breakpoints, enemy_op)
+        safe_op = self.pure_op
+        if needed == 0:
+            dp_at_home = self.breakpoints[0]
+        else:
+            # The hybrids before the split one stay home entirely
+            split = self.hybrids[needed - 1]
+            units_needed = ((enemy_op - self.breakpoints[needed - 1]) // split.dp_per_unit) + 1
+            if units_needed < split.amount:
+                dp_at_home = self.breakpoints[needed - 1] + split.dp_of(units_needed)
+                safe_op += split.op_of(split.amount - units_needed)
+            else:
+                dp_at_home = self.breakpoints[needed - 1] + split.full_dp
+        for hybrid in self.hybrids[needed:]:
+            safe_op += hybrid.full_op
+        return trunc(safe_op), round(dp_at_home)
+
+    def op_with_temples(self, enemy_op: int) -> int:
+        """Same as MilitaryCalculator.safe_op_with_temples(enemy_op) for a non-zero enemy OP."""
+        return round(self.at(enemy_op)[0] / (1 - self.temple_bonus))
+
+    def sweep(self, enemy_ops: Iterable[int]) -> list[tuple[int, int]]:
+        """Safe OP and home DP for each of the given enemy OPs."""
+        return [self.at(enemy_op) for enemy_op in enemy_ops]
+
+
 class RatioCalculator(object):
     def __init__(self, dom: Dominion):
         self.dom = dom
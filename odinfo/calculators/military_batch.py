@@ -0,0 +1,301 @@
+"""
+Military strength of a whole round at once.
+
+MilitaryCalculator works on one dominion and re-derives its bonuses through chains of properties
+for every op_of/dp_of call. BatchMilitaryCalculator takes the inputs of many calculators once,
+packs them into NumPy arrays (one row per dominion, one column per unit slot) and computes
+raw/paid/safe/5-4 OP and DP for all rows with a handful of array operations.
+
+The array expressions add and multiply in exactly the same order as the scalar calculator,
+so the results are identical, not just close.
+"""
+
+import logging
+from typing import Sequence
+
+import numpy as np
+
+from odinfo.calculators.military import MilitaryCalculator
+from odinfo.domain.models import BarracksSpy, Dominion
+from odinfo.domain.refdata import SendableType
+
+logger = logging.getLogger('od-info.military_batch')
+
+UNIT_SLOTS = 4
+UNIT_KEYS = tuple(f'unit{slot + 1}' for slot in range(UNIT_SLOTS))
+# Results that MilitaryCalculator rounds to whole numbers
+ROUNDED_RESULTS = ('paid_op', 'paid_dp', 'safe_op', 'safe_dp', 'five_four_op', 'five_four_dp',
+                   'five_four_op_with_temples', 'safe_op_with_temples')
+
+
+class BatchMilitaryCalculator(object):
+    def __init__(self, calculators: Sequence[MilitaryCalculator]):
+        self.calculators = list(calculators)
+        self.index = {mc.dom.code: row for row, mc in enumerate(self.calculators)}
+        self._pack()
+        self._compute()
+
+    @classmethod
+    def for_dominions(cls, doms: Sequence[Dominion]) -> 'BatchMilitaryCalculator':
+        return cls([MilitaryCalculator(dom) for dom in doms])
+
+    def __len__(self):
+        return len(self.calculators)
+
+    def _pack(self):
+        rows = len(self.calculators)
+        shape = (rows, UNIT_SLOTS)
+        self.amount = np.zeros(shape)
+        self.offense = np.zeros(shape)
+        self.defense = np.zeros(shape)
+        self.offense_spell = np.zeros(shape)
+        # Pairing perks: max number of paired units (from the other slot) and the bonus per paired unit
+        self.offense_pair_cap = np.zeros(shape)
+        self.offense_pair_bonus = np.zeros(shape)
+        self.defense_pair_cap = np.zeros(shape)
+        self.defense_pair_bonus = np.zeros(shape)
+        self.pure_offense = np.zeros(shape, dtype=bool)
+        # Unit slots (0-based) of the hybrid units in 5/4 sending order, -1 for unused positions
+        self.hybrid_order = np.full(shape, -1, dtype=int)
+        offense_components = np.zeros((rows, 6))
+        defense_components = np.zeros((rows, 5))
+        self.draftees = np.zeros(rows)
+        self.temple_bonus = np.zeros(rows)
+        self.is_troll = np.zeros(rows, dtype=bool)
+
+        for row, mc in enumerate(self.calculators):
+            amounts = [mc.amount(nr) for nr in range(1, UNIT_SLOTS + 1)]
+            self.amount[row] = amounts
+            for slot in range(UNIT_SLOTS):
+                unit = mc.unit_type(slot + 1)
+                self.offense[row, slot] = unit.offense
+                self.defense[row, slot] = unit.defense
+                self.offense_spell[row, slot] = mc.spell_bonus(mc.dom.race, f'offense_unit{slot + 1}') or 0
+                self.pure_offense[row, slot] = unit.sendable_type == SendableType.PURE_OFFENSE
+                if unit.has_perk('offense_from_pairing'):
+                    other, num_required, bonus = unit.get_perk('offense_from_pairing')
+                    self.offense_pair_cap[row, slot] = amounts[int(other) - 1] // int(num_required)
+                    self.offense_pair_bonus[row, slot] = int(bonus)
+                if unit.has_perk('defense_from_pairing'):
+                    other, num_required, bonus = unit.get_perk('defense_from_pairing')
+                    self.defense_pair_cap[row, slot] = amounts[int(other) - 1] // int(num_required)
+                    self.defense_pair_bonus[row, slot] = int(bonus)
+            hybrids = [mc.race.nr_of_unit(u) - 1 for u in mc.race.hybrid_units]
+            self.hybrid_order[row, :len(hybrids)] = hybrids
+
+            offense_components[row] = (mc.racial_offense_bonus, mc.spell_offense_bonus, mc.tech_offense_bonus,
+                                       mc.forges_bonus, mc.gryphon_nest_bonus, mc.prestige_bonus)
+            defense_components[row] = (mc.racial_defense_bonus, mc.spell_defense_bonus, mc.tech_defense_bonus,
+                                       mc.walls_bonus, mc.guard_tower_bonus)
+            self.draftees[row] = mc.draftees
+            self.temple_bonus[row] = mc.temple_bonus
+            self.is_troll[row] = mc.race.name in ('Troll', )
+
+        # Summed column by column, in the order MilitaryCalculator.offense_bonus/defense_bonus add them up
+        self.offense_bonus = np.zeros(rows)
+        for column in offense_components.T:
+            self.offense_bonus = self.offense_bonus + column
+        self.defense_bonus = np.zeros(rows)
+        for column in defense_components.T:
+            self.defense_bonus = self.defense_bonus + column
+
+    def op_of(self, amount: np.ndarray, with_bonus=False) -> np.ndarray:
+        """OP of the given amounts (rows x unit slots), as MilitaryCalculator.op_of."""
+        op = amount * self.offense + amount * self.offense_spell
+        op = op + np.minimum(self.offense_pair_cap, amount) * self.offense_pair_bonus
+        return op * (1 + self.offense_bonus)[:, None] if with_bonus else op
+
+    def dp_of(self, amount: np.ndarray, with_bonus=False) -> np.ndarray:
+        """DP of the given amounts (rows x unit slots), as MilitaryCalculator.dp_of."""
+        dp = amount * self.defense + np.minimum(self.defense_pair_cap, amount) * self.defense_pair_bonus
+        return dp * (1 + self.defense_bonus)[:, None] if with_bonus else dp
+
+    def _compute(self):
+        op = self.op_of(self.amount)
+        dp = self.dp_of(self.amount)
+
+        self.raw_op = op[:, 0] + op[:, 1] + op[:, 2] + op[:, 3]
+        self.raw_dp = (dp[:, 0] + dp[:, 1] + dp[:, 2] + dp[:, 3]) + self.draftees
+        self.paid_op = np.round(self.raw_op * (1 + self.offense_bonus))
+        self.paid_dp = np.round(self.raw_dp * (1 + self.defense_bonus))
+
+        self.five_four_op, self.five_four_dp = self._five_over_four()
+
+        safe_op = np.round((op[:, 0] + op[:, 3]) * (1 + self.offense_bonus))
+        safe_dp = np.round((dp[:, 1] + dp[:, 2]) * (1 + self.defense_bonus))
+        self.safe_op = np.where(self.is_troll, self.five_four_op, safe_op)
+        self.safe_dp = np.where(self.is_troll, self.five_four_dp, safe_dp)
+
+        self.five_four_op_with_temples = np.round(self.five_four_op / (1 - self.temple_bonus))
+        self.safe_op_with_temples = np.round(self.safe_op / (1 - self.temple_bonus))
+
+        for name in ROUNDED_RESULTS:
+            setattr(self, name, getattr(self, name).astype(np.int64))
+
+    def five_over_four(self, row: int) -> tuple[int, int]:
+        return int(self.five_four_op[row]), int(self.five_four_dp[row])
+
+    def _five_over_four(self) -> tuple[np.ndarray, np.ndarray]:
+        """MilitaryCalculator.five_over_four, one unit slot at a time for all dominions at once."""
+        rows = np.arange(len(self))
+        remaining_dp = self.paid_dp.copy()
+        sendable_op = np.zeros(len(self))
+
+        # Pure offense units are always sent
+        full_op = self.op_of(self.amount, with_bonus=True)
+        for slot in range(UNIT_SLOTS):
+            send = self.pure_offense[:, slot] & (self.amount[:, slot] > 0)
+            sendable_op = sendable_op + np.where(send, full_op[:, slot], 0)
+
+        # Hybrids in order of OP/DP ratio, as many as the 5/4 rule allows
+        ones = np.ones_like(self.amount)
+        op_per_unit = self.op_of(ones, with_bonus=True)
+        dp_per_unit = self.dp_of(ones, with_bonus=True)
+        for position in range(UNIT_SLOTS):
+            slot = self.hybrid_order[:, position]
+            has_unit = slot >= 0
+            slot = np.where(has_unit, slot, 0)
+            available = self.amount[rows, slot]
+
+            numerator = 5/4 * remaining_dp - sendable_op
+            denominator = op_per_unit[rows, slot] + 5/4 * dp_per_unit[rows, slot]
+            can_send = has_unit & (available > 0) & (denominator > 0) & (numerator > 0)
+            max_sendable = np.divide(numerator, denominator, out=np.zeros(len(self)), where=can_send)
+            to_send = np.where(can_send, np.minimum(available, np.maximum(0, np.trunc(max_sendable))), 0)
+
+            sent = np.zeros_like(self.amount)
+            sent[rows, slot] = to_send
+            sent_op = self.op_of(sent, with_bonus=True)[rows, slot]
+            sent_dp = self.dp_of(sent, with_bonus=True)[rows, slot]
+            sendable_op = sendable_op + np.where(to_send > 0, sent_op, 0)
+            remaining_dp = remaining_dp - np.where(to_send > 0, sent_dp, 0)
+
+        five_four_op = np.round(sendable_op)
+        five_four_dp = np.round(remaining_dp)
+        constraint_limit = np.round(five_four_dp * 5 / 4)
+        return np.minimum(five_four_op, constraint_limit), five_four_dp
+
+
+def _refine(min_obs: np.ndarray, max_obs: np.ndarray, count: np.ndarray) -> tuple[np.ndarray, ...]:
+    """MilitaryCalculator.refine_unit_estimate for arrays of observation minima, maxima and counts."""
+    lower = np.where(count > 0, max_obs / MilitaryCalculator.BS_FUZZ_HIGH, 0)
+    upper = np.where(count > 0, min_obs / MilitaryCalculator.BS_FUZZ_LOW, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        midpoint = (lower + upper) / 2
+        error = np.maximum(0, (upper - lower) / midpoint * 100 / 2)
+    error = np.where((count > 1) & (lower > 0), error, MilitaryCalculator.BS_DEFAULT_ERROR)
+    return lower, upper, np.where(count > 0, error, 0)
+
+
+class BatchRefinedStrength(object):
+    """
+    MilitaryService's refined BS strength (refined home units plus arrived returning and training
+    units) for all rows of a BatchMilitaryCalculator at once.
+
+    The BS ops of each dominion's latest tick are stacked into arrays and grouped per dominion with
+    reduceat, so refining all of them is a few array operations. The returning bounds and training
+    queues are accumulated per tick, any elapsed time is then a lookup. Like the batch calculator,
+    the results are identical to the scalar ones.
+    """
+
+    def __init__(self, batch: BatchMilitaryCalculator, barracks_spies: dict[int, list[BarracksSpy]],
+                 refined_home: dict[int, dict] | None = None):
+        """
+        Args:
+            batch: Calculator with the dominions to refine.
+            barracks_spies: Dominion code -> BS ops in its latest tick, newest first.
+            refined_home: Dominion code -> home units refined elsewhere (as refined_home_units),
+                instead of from the BS ops of the latest tick.
+        """
+        self.batch = batch
+        spies = [barracks_spies.get(mc.dom.code) or [] for mc in batch.calculators]
+        self.refined = np.array([bool(bs_list) for bs_list in spies], dtype=bool)
+        self.latest = [bs_list[0] if bs_list else None for bs_list in spies]
+        self._refine(spies)
+        for code, home in (refined_home or {}).items():
+            row = batch.index[code]
+            for column, key in enumerate(('draftees', ) + UNIT_KEYS):
+                self.home_lower[row, column], self.home_upper[row, column], self.home_error[row, column] = home[key]
+
+    def _refine(self, spies: list[list[BarracksSpy]]):
+        rows = len(spies)
+        refined_rows = np.flatnonzero(self.refined)
+        counts = np.array([len(spies[row]) for row in refined_rows], dtype=int)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(int)
+        all_spies = [bs for row in refined_rows for bs in spies[row]]
+        returning = [bs.tick_arrays('returning') for bs in all_spies]
+        training = [self.latest[row].tick_arrays('training') for row in refined_rows]
+        ticks = max([len(amounts) for queues in returning + training
+                     for unit, amounts in queues.items() if unit in UNIT_KEYS], default=0)
+        ticks = max(1, ticks)
+
+        # Home units: draftees and unit1-4
+        self.home_lower = np.zeros((rows, UNIT_SLOTS + 1))
+        self.home_upper = np.zeros((rows, UNIT_SLOTS + 1))
+        self.home_error = np.zeros((rows, UNIT_SLOTS + 1))
+        # Returning and training units that have arrived up to and including each tick
+        self.returning_lower = np.zeros((rows, UNIT_SLOTS, ticks))
+        self.returning_upper = np.zeros((rows, UNIT_SLOTS, ticks))
+        self.returning_error = np.zeros((rows, UNIT_SLOTS, ticks))
+        self.training = np.zeros((rows, UNIT_SLOTS, ticks), dtype=np.int64)
+        if not all_spies:
+            return
+
+        home = np.array([[bs.draftees] + [getattr(bs, f'home_unit{i}') for i in range(1, UNIT_SLOTS + 1)]
+                         for bs in all_spies], dtype=float)
+        lower, upper, error = _refine(np.minimum.reduceat(home, starts), np.maximum.reduceat(home, starts),
+                                      counts[:, None])
+        self.home_lower[refined_rows], self.home_upper[refined_rows], self.home_error[refined_rows] = lower, upper, error
+
+        # Only the positive amounts of a tick are observations of it
+        queue = self._queue_array(returning, ticks).astype(float)
+        observed = queue > 0
+        lower, upper, error = _refine(np.minimum.reduceat(np.where(observed, queue, np.inf), starts),
+                                      np.maximum.reduceat(queue, starts),
+                                      np.add.reduceat(observed, starts))
+        self.returning_lower[refined_rows] = np.cumsum(lower, axis=2)
+        self.returning_upper[refined_rows] = np.cumsum(upper, axis=2)
+        self.returning_error[refined_rows] = np.maximum.accumulate(error, axis=2)
+        self.training[refined_rows] = np.cumsum(self._queue_array(training, ticks), axis=2)
+
+    @staticmethod
+    def _queue_array(queues: list[dict[str, list[int]]], ticks: int) -> np.ndarray:
+        array = np.zeros((len(queues), UNIT_SLOTS, ticks), dtype=np.int64)
+        for nr, queue in enumerate(queues):
+            for slot, unit in enumerate(UNIT_KEYS):
+                if unit in queue:
+                    array[nr, slot, :len(queue[unit])] = queue[unit]
+        return array
+
+    def strength(self, ticks_since_bs: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        OP and DP (with bonuses) with everything home that has arrived ticks_since_bs after each row's BS.
+
+        Args:
+            ticks_since_bs: Elapsed ticks per row.
+
+        Returns:
+            Tuple of (op, dp, max error percentage) arrays. Only the rows in self.refined are meaningful.
+        """
+        rows = np.arange(len(self.batch))
+        ticks_since_bs = np.asarray(ticks_since_bs)
+        tick = np.clip(ticks_since_bs, 0, self.training.shape[2] - 1)
+        arrived = (ticks_since_bs >= 0)[:, None]
+        returning_lower = np.where(arrived, self.returning_lower[rows, :, tick], 0)
+        returning_upper = np.where(arrived, self.returning_upper[rows, :, tick], 0)
+        returning_error = np.where(arrived, self.returning_error[rows, :, tick], 0)
+        training = np.where(arrived, self.training[rows, :, tick], 0)
+
+        home = (self.home_lower + self.home_upper) / 2
+        amount = home[:, 1:] + training + (returning_lower + returning_upper) / 2
+
+        # Added up unit by unit, as MilitaryCalculator.current_raw_op/current_raw_dp do
+        op = np.zeros(len(rows))
+        dp = home[:, 0]
+        for slot in range(UNIT_SLOTS):
+            op = op + amount[:, slot] * self.batch.offense[:, slot]
+            dp = dp + amount[:, slot] * self.batch.defense[:, slot]
+        current_op = np.round(np.round(op) * (1 + self.batch.offense_bonus)).astype(np.int64)
+        current_dp = np.round(np.round(dp) * (1 + self.batch.defense_bonus)).astype(np.int64)
+        max_error = np.maximum(self.home_error.max(axis=1), returning_error.max(axis=1))
+        return current_op, current_dp, max_error
@@ -1,7 +1,7 @@
 import logging
 from datetime import timedelta
 
-from sqlalchemy import func, select, and_
+from sqlalchemy import func, select, and_, or_
 
 from odinfo.domain.models import DominionHistory
 from odinfo.repositories.game import GameRepository
@@ -10,18 +10,23 @@ from odinfo.timeutils import current_od_time
 logger = logging.getLogger('od-info.calculators')
 
 
+def _seen_since(since_timestamp):
+    """History rows with a sample at or after since_timestamp, including compressed runs reaching into it."""
+    return or_(DominionHistory.timestamp >= since_timestamp, DominionHistory.last_seen >= since_timestamp)
+
+
 def get_latest_and_oldest_nw(repo: GameRepository, since=12):
     since_timestamp = current_od_time() + timedelta(hours=-since)
     logger.debug(f"Getting networth values since {since_timestamp}")
     session = repo.session
     latest_nws = session.execute(
         select(DominionHistory, func.max(DominionHistory.timestamp))
-        .filter(DominionHistory.timestamp >= since_timestamp)
+        .filter(_seen_since(since_timestamp))
         .group_by(DominionHistory.dominion_id)
     ).scalars()
     oldest_nws = session.execute(
         select(DominionHistory, func.min(DominionHistory.timestamp))
-        .filter(DominionHistory.timestamp >= since_timestamp)
+        .filter(_seen_since(since_timestamp))
         .group_by(DominionHistory.dominion_id)
     ).scalars()
     return latest_nws, oldest_nws
@@ -37,7 +42,7 @@ def get_networth_deltas(repo: GameRepository, since=12):
         DominionHistory.dominion_id,
         func.max(DominionHistory.timestamp).label('max_timestamp')
     ).filter(
-        DominionHistory.timestamp >= since_timestamp
+        _seen_since(since_timestamp)
     ).group_by(
         DominionHistory.dominion_id
     ).subquery()
@@ -57,7 +62,7 @@ def get_networth_deltas(repo: GameRepository, since=12):
         DominionHistory.dominion_id,
         func.min(DominionHistory.timestamp).label('min_timestamp')
     ).filter(
-        DominionHistory.timestamp >= since_timestamp
+        _seen_since(since_timestamp)
     ).group_by(
         DominionHistory.dominion_id
     ).subquery()
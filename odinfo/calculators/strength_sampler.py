@@ -0,0 +1,136 @@
+"""
+Strength distributions from BarracksSpy fuzz.
+
+A BS shows every amount multiplied by a random factor in [0.85, 1/0.85], so each observation O of a
+true amount T lies in [0.85 * T, T / 0.85]. MilitaryCalculator.refine_unit_estimate intersects
+those ranges into bounds for T. This module goes one step further: it draws true amounts that are
+consistent with all observations and pushes them through the OP/DP formulas of
+MilitaryCalculator.current_raw_op/current_raw_dp. The result is a distribution of the current OP
+and DP instead of a midpoint and a "±X%".
+
+With a uniform fuzz factor and a flat prior, n observations of T have a likelihood proportional to
+T^-n within the intersected bounds, which is sampled exactly by inverting its CDF. Every amount
+(home units, draftees and each tick of returning units) is sampled for all samples at once.
+"""
+
+import logging
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from odinfo.calculators.military import MilitaryCalculator
+
+logger = logging.getLogger('od-info.strength_sampler')
+
+DEFAULT_SAMPLES = 20000
+PERCENTILES = (10, 50, 90)
+
+
+@dataclass
+class StrengthDistribution:
+    """Sampled OP and DP (with bonuses) of a dominion."""
+    op_percentiles: tuple[int, int, int]  # P10, P50, P90
+    dp_percentiles: tuple[int, int, int]
+    op_samples: np.ndarray = field(repr=False)
+    dp_samples: np.ndarray = field(repr=False)
+
+    @property
+    def samples(self) -> int:
+        return len(self.dp_samples)
+
+    def break_probability(self, op: float) -> float:
+        """Probability that an attack with the given OP is larger than the dominion's DP."""
+        return float(np.count_nonzero(self.dp_samples < op)) / self.samples
+
+
+def sample_true_amounts(lower: np.ndarray, upper: np.ndarray, observations: np.ndarray,
+                        uniform: np.ndarray) -> np.ndarray:
+    """
+    Draw true amounts with density proportional to T^-n on [lower, upper] by inverting the CDF.
+
+    Args:
+        lower, upper: Bounds per amount (as refine_unit_estimate), shape (amounts,).
+        observations: Number of observations n >= 1 per amount, shape (amounts,).
+        uniform: Uniform [0, 1) draws, shape (samples, amounts).
+
+    Returns:
+        Sampled amounts, shape (samples, amounts). Amounts with inconsistent bounds (lower > upper)
+        get their midpoint, amounts with a zero lower bound (observed as 0) are 0.
+    """
+    valid = (lower > 0) & (upper > lower)
+    safe_lower = np.where(valid, lower, 1)
+    ratio = np.where(valid, upper / safe_lower, 1)
+    # Sample T / lower in [1, ratio]: log-uniform for one observation, a power law for more
+    exponent = 1 - observations
+    with np.errstate(divide='ignore', invalid='ignore'):
+        power = np.where(observations > 1, ratio ** np.where(observations > 1, exponent, 1), 1)
+        power_law = (1 - uniform * (1 - power)) ** (1 / np.where(observations > 1, exponent, 1))
+    log_uniform = ratio ** uniform
+    scaled = np.where(observations > 1, power_law, log_uniform)
+    fixed = np.where(lower > 0, (lower + upper) / 2, 0)
+    return np.where(valid, safe_lower * scaled, fixed)
+
+
+def sample_strength(mc: MilitaryCalculator, barracks_spies: list, latest_bs, ticks_since_bs: int,
+                    samples: int = DEFAULT_SAMPLES, seed: int | None = None,
+                    home_bounds: dict[str, tuple[float, float, int]] | None = None) -> StrengthDistribution | None:
+    """
+    Distribution of the current OP and DP from the BS ops of one tick.
+
+    Args:
+        mc: Calculator of the dominion, for unit OP/DP and bonuses.
+        barracks_spies: BarracksSpy ops from the same tick.
+        latest_bs: The latest of them, for the (exact) training queue.
+        ticks_since_bs: Hours elapsed since the BS was taken.
+        samples: Number of samples.
+        seed: Seed for the random generator, for reproducible results.
+        home_bounds: (lower, upper, number of observations) of the draftees and home units, such as
+            CrossTickRefinement.bounds(), instead of those of barracks_spies alone.
+
+    Returns:
+        StrengthDistribution, or None without BS ops.
+    """
+    if not barracks_spies:
+        return None
+
+    def observed(observations: list) -> tuple[float, float, int]:
+        return *MilitaryCalculator.refine_unit_estimate(observations)[:2], len(observations)
+
+    home_bounds = home_bounds or {}
+    # One column per sampled amount: (lower, upper, observations), and its offense and defense per unit
+    columns = []
+    weights_op, weights_dp = [], []
+    columns.append(home_bounds.get('draftees') or observed([bs.draftees for bs in barracks_spies]))
+    weights_op.append(0)
+    weights_dp.append(1)
+    returning = [bs.tick_arrays('returning') for bs in barracks_spies]
+    for i in range(1, 5):
+        unit = mc.unit_type(i)
+        columns.append(home_bounds.get(f'unit{i}') or observed([getattr(bs, f'home_unit{i}') for bs in barracks_spies]))
+        weights_op.append(unit.offense)
+        weights_dp.append(unit.defense)
+        queues = [r[f'unit{i}'] for r in returning if f'unit{i}' in r]
+        for tick in range(min(ticks_since_bs, max([len(q) for q in queues], default=0) - 1) + 1):
+            observations = [q[tick] for q in queues if tick < len(q) and q[tick] > 0]
+            if observations:
+                columns.append(observed(observations))
+                weights_op.append(unit.offense)
+                weights_dp.append(unit.defense)
+
+    bounds = np.array(columns, dtype=float)
+    rng = np.random.default_rng(seed)
+    amounts = sample_true_amounts(bounds[:, 0], bounds[:, 1], bounds[:, 2], rng.random((samples, len(columns))))
+
+    # Training is exact
+    arrived_training = mc.arrived_training_units(latest_bs, ticks_since_bs)
+    training_op = sum(amount * mc.unit_type(int(key[-1])).offense for key, amount in arrived_training.items())
+    training_dp = sum(amount * mc.unit_type(int(key[-1])).defense for key, amount in arrived_training.items())
+
+    op = (amounts @ np.array(weights_op, dtype=float) + training_op) * (1 + mc.offense_bonus)
+    dp = (amounts @ np.array(weights_dp, dtype=float) + training_dp) * (1 + mc.defense_bonus)
+    return StrengthDistribution(
+        op_percentiles=tuple(int(value) for value in np.round(np.percentile(op, PERCENTILES))),
+        dp_percentiles=tuple(int(value) for value in np.round(np.percentile(dp, PERCENTILES))),
+        op_samples=op,
+        dp_samples=dp,
+    )
@@ -72,7 +72,30 @@ current_player_id = EDIT_THIS
 LOCAL_TIME_SHIFT = 0
 
 # Optional: feature toggles for experimental features (comma-separated list)
-#feature_toggles = economy
+# compress_history only stores land/networth history when it changes
+#feature_toggles = economy,compress_history
+
+# Optional: number of ticks before the latest BarracksSpy whose BS ops still refine the home units
+# (0 only uses the BS ops of the latest tick)
+#BS_REFINEMENT_WINDOW = 8
+
+# Optional: size of the cache of computed lists (entries), and seconds after which they are
+# recomputed (0 keeps them until new ops come in)
+#CACHE_MAX_ENTRIES = 64
+#CACHE_TTL = 0
+# Optional: share the cached lists between web worker processes through a file in the instance dir;
+# the cron job then computes the main lists into it after every update
+#SHARED_CACHE = false
+# Optional: seconds that a request waits for a list that another request is already computing,
+# before computing it as well
+#CACHE_COMPUTE_TIMEOUT = 120
+
+# Optional: let the cron job delete ops older than 48 hours after every update
+# (the space is only reclaimed if incremental vacuum was enabled through the cleanup page)
+#CRON_CLEANUP = false
+
+# Optional: how land/networth graphs are drawn, svg (built in) or matplotlib (if installed)
+#GRAPH_RENDERER = svg
 
 # Random secret key for web sessions (REQUIRED)
 secret_key = EDIT_THIS
@@ -169,6 +192,13 @@ class Config:
     discord_webhook: str | None = None
     feature_toggles: list[str] = field(default_factory=list)
     secret_key: str = ''
+    bs_refinement_window: int = 8
+    cache_max_entries: int = 64
+    cache_ttl: int = 0
+    shared_cache: bool = False
+    cache_compute_timeout: int = 120
+    graph_renderer: str = 'svg'
+    cron_cleanup: bool = False
 
     @classmethod
     def from_secrets_file(cls) -> 'Config':
@@ -188,6 +218,13 @@ class Config:
             discord_webhook=secrets.get('discord_webhook'),
             feature_toggles=toggles,
             secret_key=secrets.get('secret_key', ''),
+            bs_refinement_window=int(secrets.get('BS_REFINEMENT_WINDOW', '8')),
+            cache_max_entries=int(secrets.get('CACHE_MAX_ENTRIES', '64')),
+            cache_ttl=int(secrets.get('CACHE_TTL', '0')),
+            shared_cache=secrets.get('SHARED_CACHE', 'false').lower() in ('true', '1', 'yes'),
+            cache_compute_timeout=int(secrets.get('CACHE_COMPUTE_TIMEOUT', '120')),
+            graph_renderer=secrets.get('GRAPH_RENDERER', 'svg').lower(),
+            cron_cleanup=secrets.get('CRON_CLEANUP', 'false').lower() in ('true', '1', 'yes'),
         )
 
 
@@ -1,7 +1,8 @@
 from datetime import datetime, timedelta
+from math import floor
 from typing import List, Optional
 
-from sqlalchemy import Integer, String, DateTime, ForeignKey, Float, func, JSON, Index
+from sqlalchemy import Integer, String, DateTime, ForeignKey, Float, func, JSON, Index, PickleType, text
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
@@ -167,9 +168,71 @@ class DominionHistory(TimestampedOpsMixin, Base):
     dom: Mapped['Dominion'] = relationship(back_populates='history')
     land: Mapped[int] = mapped_column(Integer)
     networth: Mapped[int] = mapped_column(Integer)
+    # Set when history is stored run-length compressed: the last sample that still had this land and networth.
+    last_seen: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None)
+
+    @property
+    def seen_until(self) -> datetime:
+        return self.last_seen or self.timestamp
 
     def __repr__(self):
-        return f'DominionHistory({self.dominion_id}, {self.timestamp}, {self.land}, {self.networth})'
+        return f'DominionHistory({self.dominion_id}, {self.timestamp}, {self.land}, {self.networth}, {self.last_seen})'
+
+
+class DominionHistoryRollup(Base):
+    """Downsampled DominionHistory: one row per dominion per bucket of `resolution` hours.
+
+    `land` and `networth` hold the last sample in the bucket, so a rollup row can stand in for a
+    DominionHistory row in graphs. Maintained incrementally by GameRepository.add_history().
+    """
+    __tablename__ = 'DominionHistoryRollup'
+    __table_args__ = (Index('idx_DominionHistoryRollup_dom_res_ts', 'dominion', 'resolution', 'timestamp'),)
+
+    dominion_id = mapped_column('dominion', ForeignKey('Dominions.code'))
+    resolution: Mapped[int] = mapped_column(Integer)
+    timestamp: Mapped[datetime] = mapped_column(DateTime)
+    last_timestamp: Mapped[datetime] = mapped_column(DateTime)
+    land_min: Mapped[int] = mapped_column(Integer)
+    land_max: Mapped[int] = mapped_column(Integer)
+    land: Mapped[int] = mapped_column(Integer)
+    networth_min: Mapped[int] = mapped_column(Integer)
+    networth_max: Mapped[int] = mapped_column(Integer)
+    networth: Mapped[int] = mapped_column(Integer)
+    samples: Mapped[int] = mapped_column(Integer, default=0)
+    __mapper_args__ = {'primary_key': [dominion_id, resolution, timestamp]}
+
+    def add_sample(self, timestamp: datetime, land: int, networth: int):
+        if not self.samples:
+            self.land_min = self.land_max = self.land = land
+            self.networth_min = self.networth_max = self.networth = networth
+            self.last_timestamp = timestamp
+        else:
+            self.land_min = min(self.land_min, land)
+            self.land_max = max(self.land_max, land)
+            self.networth_min = min(self.networth_min, networth)
+            self.networth_max = max(self.networth_max, networth)
+            if timestamp >= self.last_timestamp:
+                self.land = land
+                self.networth = networth
+                self.last_timestamp = timestamp
+        self.samples = (self.samples or 0) + 1
+
+    def __repr__(self):
+        return (f'DominionHistoryRollup({self.dominion_id}, {self.resolution}h, {self.timestamp}, '
+                f'{self.land_min}-{self.land_max}/{self.land}, {self.networth_min}-{self.networth_max}/{self.networth})')
+
+
+def queue_arrays(queue: dict | None) -> dict[str, list[int]]:
+    """Turn a {name: {tick: amount}} queue blob into {name: [amount at tick 0, 1, 2, ...]}."""
+    result = {}
+    if isinstance(queue, dict):
+        for name, ticks in queue.items():
+            if isinstance(ticks, dict) and ticks:
+                amounts = [0] * (max(int(t) for t in ticks) + 1)
+                for tick, amount in ticks.items():
+                    amounts[int(tick)] += amount
+                result[name] = amounts
+    return result
 
 
 class BarracksSpy(TimestampedOpsMixin, Base):
@@ -187,43 +250,38 @@ class BarracksSpy(TimestampedOpsMixin, Base):
     training: Mapped[dict] = mapped_column(JSON, default=JSON.NULL)
     returning: Mapped[dict] = mapped_column('return', JSON, default=JSON.NULL)
 
+    def tick_arrays(self, queue: str) -> dict[str, list[int]]:
+        """The 'training' or 'returning' queue as {unit: [amount per tick]}, decoded once per queue value."""
+        data = getattr(self, queue)
+        cache = getattr(self, '_tick_array_cache', None)
+        if cache is None:
+            cache = self._tick_array_cache = {}
+        if queue not in cache or cache[queue][0] is not data:
+            cache[queue] = (data, queue_arrays(data))
+        return cache[queue][1]
+
     def amount_training(self, unit_type_nr: int) -> int:
-        if self.training:
-            key = f'unit{unit_type_nr}'
-            return sum(self.training[key].values()) if key in self.training else 0
-        else:
-            return 0
+        return sum(self.tick_arrays('training').get(f'unit{unit_type_nr}', ()))
 
     def aged_amount_training_for_unit(self, unit_type_nr: int) -> int:
-        key = f'unit{unit_type_nr}'
         age = hours_since(self.timestamp)
-        if self.training and key in self.training:
-            return sum([amount for tick, amount in self.training[key].items() if int(tick) - age > 0])
-        else:
-            return 0
+        amounts = self.tick_arrays('training').get(f'unit{unit_type_nr}', ())
+        return sum(amounts[max(0, age + 1):])
     
     def aged_amount_training_for_unit_at_time(self, unit_type_nr: int, reference_time) -> int:
         """Calculate training units that hadn't completed by reference_time."""
-        key = f'unit{unit_type_nr}'
-        if self.training and key in self.training:
-            # Calculate hours between BarracksSpy and reference time (e.g., ClearSight)
-            time_diff = (reference_time - self.timestamp).total_seconds() / 3600
-            # Include units whose training tick is greater than the time difference
-            # i.e., units that hadn't completed by reference_time
-            return sum([amount for tick, amount in self.training[key].items() if int(tick) > time_diff])
-        else:
-            return 0
+        # Hours between BarracksSpy and reference time (e.g., ClearSight)
+        time_diff = (reference_time - self.timestamp).total_seconds() / 3600
+        # Units whose training tick is greater than the time difference hadn't completed by reference_time
+        amounts = self.tick_arrays('training').get(f'unit{unit_type_nr}', ())
+        return sum(amounts[max(0, floor(time_diff) + 1):])
 
     @property
     def aged_amount_training(self) -> int:
         return sum([self.aged_amount_training_for_unit(i) for i in range(1, 5)])
 
     def amount_returning(self, unit_type_nr: int) -> int:
-        if self.returning:
-            key = f'unit{unit_type_nr}'
-            return sum(self.returning[key].values()) if key in self.returning else 0
-        else:
-            return 0
+        return sum(self.tick_arrays('returning').get(f'unit{unit_type_nr}', ()))
 
     def arrived_training_for_unit(self, unit_type_nr: int) -> int:
         """Training units that have arrived home since this BS was taken."""
@@ -247,13 +305,12 @@ class BarracksSpy(TimestampedOpsMixin, Base):
             'paid_until': self.paid_until
         }
 
+    def max_training_tick(self, nr: int) -> int:
+        amounts = self.tick_arrays('training').get(f'unit{nr}')
+        return len(amounts) - 1 if amounts else 0
+
     def paid_until_for_unit(self, nr):
-        age = hours_since(self.timestamp)
-        max_ticks = 0
-        key = f'unit{nr}'
-        if key in self.training:
-            max_ticks = max(max_ticks, max([int(t) for t in self.training[key]]))
-        return max(0, max_ticks - age)
+        return max(0, self.max_training_tick(nr) - hours_since(self.timestamp))
 
     @property
     def paid_until(self) -> int:
@@ -261,13 +318,8 @@ class BarracksSpy(TimestampedOpsMixin, Base):
 
     def paid_until_for_unit_at_time(self, nr: int, target_time) -> int:
         """Calculate paid_until for a unit as it was at a specific time."""
-        from odinfo.timeutils import hours_since
         age_at_time = hours_since(self.timestamp, target_time)
-        max_ticks = 0
-        key = f'unit{nr}'
-        if key in self.training:
-            max_ticks = max(max_ticks, max([int(t) for t in self.training[key]]))
-        return max(0, max_ticks - age_at_time)
+        return max(0, self.max_training_tick(nr) - age_at_time)
 
     def paid_until_at_time(self, target_time) -> int:
         """Calculate paid_until as it was at a specific time."""
@@ -418,6 +470,85 @@ class Vision(TimestampedOpsMixin, Base):
     techs: Mapped[Optional[dict]] = mapped_column(JSON, default=JSON.NULL)
 
 
+class QueueTick(Base):
+    """
+    One (unit, tick, amount) entry of a queue in an op, normalized out of the JSON blobs.
+
+    Queues: 'training' and 'returning' (BarracksSpy, units), 'incoming' (LandSpy, land types)
+    and 'constructing' (SurveyDominion, buildings). Tick is the number of hours after the op's
+    timestamp at which the amount arrives. Every tick of the blob is kept, also those with a zero
+    amount: the last tick of the training queue is what paid_until counts down to.
+    """
+    __tablename__ = 'QueueTick'
+    __table_args__ = (Index('idx_QueueTick_dom_queue_ts', 'dominion', 'queue', 'timestamp'),)
+
+    # Op type and attribute each queue is taken from
+    SOURCES = {
+        'training': ('BarracksSpy', 'training'),
+        'returning': ('BarracksSpy', 'returning'),
+        'incoming': ('LandSpy', 'incoming'),
+        'constructing': ('SurveyDominion', 'constructing'),
+    }
+
+    dominion_id = mapped_column('dominion', ForeignKey('Dominions.code'))
+    timestamp: Mapped[datetime] = mapped_column(DateTime)
+    queue: Mapped[str] = mapped_column(String(20))
+    unit: Mapped[str] = mapped_column(String(40))
+    tick: Mapped[int] = mapped_column(Integer)
+    amount: Mapped[int] = mapped_column(Integer)
+    __mapper_args__ = {'primary_key': [dominion_id, timestamp, queue, unit, tick]}
+
+    @classmethod
+    def from_op(cls, op) -> list['QueueTick']:
+        """Normalized queue rows for a BarracksSpy, LandSpy or SurveyDominion."""
+        rows = []
+        for queue, (op_type, attr) in cls.SOURCES.items():
+            if type(op).__name__ == op_type and isinstance(getattr(op, attr), dict):
+                for unit, ticks in getattr(op, attr).items():
+                    if not isinstance(ticks, dict):
+                        continue
+                    amounts = {}
+                    for tick, amount in ticks.items():
+                        amounts[int(tick)] = amounts.get(int(tick), 0) + amount
+                    rows.extend(cls(dominion_id=op.dominion_id, timestamp=op.timestamp,
+                                    queue=queue, unit=unit, tick=tick, amount=amount)
+                                for tick, amount in amounts.items())
+        return rows
+
+    def __repr__(self):
+        return f'QueueTick({self.dominion_id}, {self.timestamp}, {self.queue}, {self.unit}, {self.tick}, {self.amount})'
+
+
+class MilitaryResult(Base):
+    """
+    The computed military figures of one dominion, shared by all web workers and cron.
+
+    The figures depend on the dominion's ops, the day (boat protection) and the calculations (version),
+    so a row stays valid until a newer op comes in or the day or version changes. What counts down with
+    the clock is not stored but derived when the row is read: paid_until, and the refined paid and current
+    strength, which are looked up in the strength (OP, DP and error) per tick since `bs_timestamp`.
+    `figures` holds the other MilitaryRowVM fields and that strength, or is None for a dominion
+    without military intel. `curve` is the pickled SafeOpCurve.
+    """
+    __tablename__ = 'MilitaryResult'
+
+    dominion_id = mapped_column('dominion', ForeignKey('Dominions.code'), primary_key=True)
+    last_op: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    version: Mapped[str] = mapped_column(String(30))
+    current_day: Mapped[int] = mapped_column(Integer)
+    bs_timestamp: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    figures: Mapped[Optional[dict]] = mapped_column(JSON)
+    curve = mapped_column(PickleType)
+    computed_at: Mapped[datetime] = mapped_column(DateTime)
+
+    def is_valid_for(self, last_op: datetime | None, version: str, current_day: int) -> bool:
+        """Whether the figures hold for the dominion with the given last op."""
+        return (self.last_op, self.version, self.current_day) == (last_op, version, current_day)
+
+    def __repr__(self):
+        return f'MilitaryResult({self.dominion_id}, {self.last_op}, {self.version}, day {self.current_day})'
+
+
 class TownCrier(Base):
     __tablename__ = 'TownCrier'
 
@@ -433,6 +564,34 @@ class TownCrier(Base):
     __mapper_args__ = {'primary_key': [timestamp, origin, event_type, target]}
 
 
+class Job(Base):
+    """
+    A background job, such as an update from OpenDominion that a page asked for.
+
+    The records are shared by all web workers, each of which runs the queued jobs it can claim.
+    Only one job per (kind, argument) can be queued or running at a time: enqueueing it again
+    returns the job that is already there. `argument` is '' for jobs without one, as NULLs are
+    never equal in a unique index.
+    """
+    __tablename__ = 'Job'
+    __table_args__ = (Index('idx_Job_pending', 'kind', 'argument', unique=True,
+                            sqlite_where=text("status IN ('queued', 'running')")),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(40))
+    argument: Mapped[str] = mapped_column(String(40), default='')
+    status: Mapped[str] = mapped_column(String(10), default='queued')  # queued, running, done or failed
+    progress: Mapped[Optional[str]] = mapped_column(String(200))
+    error: Mapped[Optional[str]] = mapped_column(String(500))
+    worker: Mapped[Optional[str]] = mapped_column(String(60))
+    enqueued_at: Mapped[datetime] = mapped_column(DateTime)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+    def __repr__(self):
+        return f'Job({self.id}, {self.kind}, {self.argument!r}, {self.status})'
+
+
 class SchemaVersion(Base):
     __tablename__ = 'SchemaVersion'
 
@@ -0,0 +1,148 @@
+"""
+Compiled reference data.
+
+Parsing the YAML files in ref-data/ (30+ races, spells, techs) with the pure-Python YAML parser
+is a noticeable part of the start-up time of the web app, cron and the PyInstaller binary.
+This module compiles all of ref-data/ once into a pickled RefDataBundle in the instance
+directory, with the spells and techs already indexed by perk. The bundle carries a hash of the
+source files and is rebuilt when any of them changes.
+
+Build (or rebuild) the bundle explicitly with: python -m odinfo.domain.refbundle
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+from odinfo.config import REF_DATA_DIR, INSTANCE_DIR, executable_path
+
+logger = logging.getLogger('od-info.refbundle')
+
+BUNDLE_FILE = Path(executable_path(INSTANCE_DIR)) / 'ref-data.pickle'
+# Bump when the layout of RefDataBundle changes, so that old bundles get rebuilt.
+BUNDLE_FORMAT = 1
+TECHS_FILE = 'techs/v2.yml'
+
+
+@dataclass
+class RefDataBundle:
+    signature: str
+    files: dict[str, object]  # parsed contents by path relative to ref-data/
+    config: dict
+    spells: dict[str, dict[str, float]]  # perk -> race (or 'all') -> value, active spells only
+    techs: dict[str, dict[str, float]]  # perk -> tech -> value
+    races: dict[str, dict]  # race data by file name without extension
+
+
+def source_files(ref_data_dir: str = REF_DATA_DIR) -> list[Path]:
+    root = Path(ref_data_dir)
+    return sorted(path for path in root.rglob('*') if path.suffix in ('.yml', '.json'))
+
+
+def source_signature(ref_data_dir: str = REF_DATA_DIR) -> str:
+    """Hash of the names and contents of all ref-data files (mtimes don't survive PyInstaller extraction)."""
+    digest = hashlib.sha1(str(BUNDLE_FORMAT).encode())
+    root = Path(ref_data_dir)
+    for path in source_files(ref_data_dir):
+        digest.update(path.relative_to(root).as_posix().encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _index_spells(spell_yaml: dict) -> dict:
+    spells = defaultdict(dict)
+    for spell_name, spell in spell_yaml.items():
+        if spell.get('active', True):
+            for perk, value in spell['perks'].items():
+                for race in spell.get('races', ['all']):
+                    spells[perk][race] = spells[perk].get(race, 0) + value
+    return spells
+
+
+def _index_techs(tech_yaml: dict) -> dict:
+    techs = defaultdict(dict)
+    for tech_name, tech in tech_yaml['techs'].items():
+        for perk, value in tech['perks'].items():
+            techs[perk][tech_name] = value
+    return techs
+
+
+def compile_ref_data(ref_data_dir: str = REF_DATA_DIR) -> RefDataBundle:
+    """Parse and index all ref-data files."""
+    # Only needed when the bundle is (re)built, so a fresh bundle also saves importing the YAML parser.
+    import yaml
+
+    root = Path(ref_data_dir)
+    files = {}
+    for path in source_files(ref_data_dir):
+        with open(path, 'r') as f:
+            files[path.relative_to(root).as_posix()] = json.load(f) if path.suffix == '.json' else yaml.safe_load(f)
+    return RefDataBundle(
+        signature=source_signature(ref_data_dir),
+        files=files,
+        config=files['config.json'],
+        spells=_index_spells(files['spells.yml']),
+        techs=_index_techs(files[TECHS_FILE]),
+        races={name.removeprefix('races/').removesuffix('.yml'): data
+               for name, data in files.items() if name.startswith('races/')},
+    )
+
+
+def _read_bundle(bundle_file: Path) -> RefDataBundle | None:
+    try:
+        with open(bundle_file, 'rb') as f:
+            bundle = pickle.load(f)
+        return bundle if isinstance(bundle, RefDataBundle) else None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        logger.debug("No usable ref-data bundle at %s: %s", bundle_file, e)
+        return None
+
+
+def _write_bundle(bundle: RefDataBundle, bundle_file: Path):
+    try:
+        bundle_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = bundle_file.with_name(f'{bundle_file.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, bundle_file)
+    except OSError as e:
+        logger.warning("Could not write ref-data bundle to %s: %s", bundle_file, e)
+
+
+def load_bundle(ref_data_dir: str = REF_DATA_DIR, bundle_file: Path = BUNDLE_FILE) -> RefDataBundle:
+    """The compiled ref-data, rebuilt (and stored) when the bundle is missing or stale."""
+    signature = source_signature(ref_data_dir)
+    bundle = _read_bundle(bundle_file)
+    if bundle is None or bundle.signature != signature:
+        logger.info("Compiling ref-data bundle %s", bundle_file)
+        bundle = compile_ref_data(ref_data_dir)
+        _write_bundle(bundle, bundle_file)
+    return bundle
+
+
+@lru_cache(maxsize=None)
+def ref_data() -> RefDataBundle:
+    """The ref-data of this process, loaded once."""
+    return load_bundle()
+
+
+if __name__ == '__main__':
+    # Use the importable module, a bundle pickled from __main__ can't be loaded by the app.
+    from odinfo.domain import refbundle
+
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+    compiled = refbundle.compile_ref_data()
+    compiled_at = time.perf_counter()
+    refbundle._write_bundle(compiled, BUNDLE_FILE)
+    print(f"Compiled {len(compiled.files)} files in {(compiled_at - start) * 1000:.1f} ms to {BUNDLE_FILE}")
+    start = time.perf_counter()
+    refbundle.load_bundle()
+    print(f"Loading the bundle takes {(time.perf_counter() - start) * 1000:.1f} ms")
@@ -1,20 +1,18 @@
 import math
 import logging
-import os
+from functools import wraps
 from operator import attrgetter
 
-import yaml
-import json
 from math import erf
 from enum import Enum
-from collections import defaultdict, namedtuple
-from odinfo.config import REF_DATA_DIR
+from collections import namedtuple
+from odinfo.domain.refbundle import ref_data
 from functools import lru_cache
 
 
 logger = logging.getLogger('od-info.refdata')
 
-config_json = json.load(open(os.path.join(REF_DATA_DIR, 'config.json')))
+config_json = ref_data().config
 
 NON_HOME_CAPACITY = config_json['NON_HOME_CAPACITY']
 BUILD_TICKS = config_json['BUILD_TICKS']
@@ -45,6 +43,27 @@ NETWORTH_VALUES = {
 }
 
 
+def snapshot_property(func):
+    """
+    Read-only property that is evaluated once while its object is in snapshot mode.
+
+    The object keeps the values in its _snapshot dict, which is None when snapshot mode is off.
+    Clearing the dict invalidates all values.
+    """
+    name = func.__name__
+
+    @wraps(func)
+    def getter(self):
+        if self._snapshot is None:
+            return func(self)
+        try:
+            return self._snapshot[name]
+        except KeyError:
+            value = self._snapshot[name] = func(self)
+            return value
+    return property(getter)
+
+
 class SendableType(Enum):
     PURE_DEFENSE = 1
     PURE_OFFENSE = 2
@@ -57,8 +76,6 @@ def infamy_bonus(infamy, maxbonus) -> float:
 
 
 class Spells(object):
-    SPELL_REGISTRY: dict | None = None
-
     """Loads the offense and defense perks only."""
     def __init__(self):
         self.spells = self._load_spells()
@@ -67,24 +84,11 @@ class Spells(object):
         return self.spells[perk_name].get(race, 0)
 
     @staticmethod
-    @lru_cache(maxsize=None)
     def _load_spells() -> dict:
-        if not Spells.SPELL_REGISTRY:
-            with open(f'{REF_DATA_DIR}/spells.yml', 'r') as f:
-                spell_yaml = yaml.safe_load(f)
-                spells = defaultdict(dict)
-                for spell_name, spell in spell_yaml.items():
-                    if spell.get('active', True):
-                        for perk, value in spell['perks'].items():
-                            for race in spell.get('races', ['all']):
-                                spells[perk][race] = spells[perk].get(race, 0) + value
-            Spells.SPELL_REGISTRY = spells
-        return Spells.SPELL_REGISTRY
+        return ref_data().spells
 
 
 class TechTree(object):
-    TECHS_REGISTRY: dict | None = None
-
     def __init__(self):
         self.techs = self._load_techs()
 
@@ -93,23 +97,89 @@ class TechTree(object):
         return sum([perk_techs[tech] for tech in techs if tech in perk_techs.keys()])
 
     @staticmethod
-    @lru_cache(maxsize=None)
     def _load_techs() -> dict:
-        if not TechTree.TECHS_REGISTRY:
-            with open(f'{REF_DATA_DIR}/techs/v2.yml', 'r') as f:
-                tech_yaml = yaml.safe_load(f)
-                techs = defaultdict(dict)
-                for tech_name, tech in tech_yaml['techs'].items():
-                    for perk, value in tech['perks'].items():
-                        techs[perk][tech_name] = value
-            TechTree.TECHS_REGISTRY = techs
-        return TechTree.TECHS_REGISTRY
+        return ref_data().techs
+
+
+# Unit perks that make a unit's OP or DP depend on the dominion
+DYNAMIC_OFFENSE_PERKS = ('offense_from_land', 'offense_raw_wizard_ratio', 'offense_from_prestige')
+DYNAMIC_DEFENSE_PERKS = ('defense_from_land', )
+
+
+def parse_perk(value):
+    """Perk values like 'forest,20,2' become a tuple of strings, other values are kept as they are."""
+    if isinstance(value, str) and (',' in value):
+        return tuple(value.split(','))
+    else:
+        return value
+
+
+def sendable_type_of(offense: float, defense: float) -> SendableType:
+    if (offense != 0) and (defense != 0):
+        return SendableType.HYBRID
+    elif offense == 0:
+        return SendableType.PURE_DEFENSE
+    elif defense == 0:
+        return SendableType.PURE_OFFENSE
+
+
+def op_over_dp_of(offense: float, defense: float) -> float:
+    if offense == 0:
+        return 0
+    elif defense == 0:
+        return math.inf
+    else:
+        return offense / defense
+
+
+class UnitProfile(object):
+    """The static data of one unit type, parsed once and shared by every dominion of the race."""
+    __slots__ = ('name', 'base_offense', 'base_defense', 'perks', 'need_boat', 'cost',
+                 'dynamic_offense', 'dynamic_defense', 'required_intel')
+
+    def __init__(self, yaml_src: dict):
+        self.name = yaml_src['name']
+        self.base_offense = yaml_src['power']['offense']
+        self.base_defense = yaml_src['power']['defense']
+        self.perks = {name: parse_perk(value) for name, value in yaml_src.get('perks', {}).items()}
+        self.need_boat = yaml_src.get('need_boat', True)
+        self.cost = yaml_src['cost']
+        self.dynamic_offense = any(perk in self.perks for perk in DYNAMIC_OFFENSE_PERKS)
+        self.dynamic_defense = any(perk in self.perks for perk in DYNAMIC_DEFENSE_PERKS)
+        self.required_intel = {'offense': set(), 'defense': set()}
+        for perk_name in self.perks:
+            if 'offense_from_land' in perk_name:
+                self.required_intel['offense'].add('land_spy')
+            elif 'defense_from_land' in perk_name:
+                self.required_intel['defense'].add('land_spy')
+            elif '_wizard_ratio' in perk_name:
+                self.required_intel['offense'].add('clear_sight')
+            elif '_from_prestige' in perk_name:
+                self.required_intel['offense'].add('clear_sight')
+
+    @property
+    def dynamic(self) -> bool:
+        return self.dynamic_offense or self.dynamic_defense
 
 
 class Unit(object):
-    def __init__(self, yaml_src: dict, dom):
-        self._data = yaml_src
+    """
+    A unit type as seen in one dominion: the UnitProfile plus the dominion dependent perks.
+
+    Units without such perks are the same for every dominion, RaceProfile keeps one shared
+    instance of those (with dom None).
+    """
+    __slots__ = ('profile', 'dom', '_snapshot')
+
+    def __init__(self, profile: UnitProfile, dom, snapshot=False):
+        self.profile = profile
         self.dom = dom
+        self._snapshot = {} if snapshot else None
+
+    def invalidate(self):
+        """Forget the values evaluated in snapshot mode."""
+        if self._snapshot is not None:
+            self._snapshot.clear()
 
     def __str__(self):
         return f"Unit({self.name}, {self.offense}OP, {self.defense}DP)"
@@ -125,68 +195,39 @@ class Unit(object):
         """Returns dict of {stat_type: set of required intel types} based on perks.
         Example: {'offense': {'clear_sight'}, 'defense': {'land_spy'}}
         """
-        required = {'offense': set(), 'defense': set()}
-        if 'perks' not in self._data:
-            return required
-
-        for perk_name in self._data['perks'].keys():
-            if 'offense_from_land' in perk_name:
-                required['offense'].add('land_spy')
-            elif 'defense_from_land' in perk_name:
-                required['defense'].add('land_spy')
-            elif '_wizard_ratio' in perk_name:
-                required['offense'].add('clear_sight')
-            elif '_from_prestige' in perk_name:
-                required['offense'].add('clear_sight')
-
-        return required
+        return self.profile.required_intel
 
     @property
     def name(self) -> str:
-        return self._data['name']
+        return self.profile.name
 
     def has_perk(self, name) -> bool:
-        return 'perks' in self._data and name in self._data['perks']
+        return name in self.profile.perks
 
     def get_perk(self, name, default=None):
-        if self.has_perk(name):
-            perk_value = self._data['perks'][name]
-            if isinstance(perk_value, str) and (',' in perk_value):
-                return perk_value.split(',')
-            else:
-                return perk_value
-        else:
-            return default
+        return self.profile.perks.get(name, default)
 
     @property
     def need_boat(self):
-        return self._data.get('need_boat', True)
+        return self.profile.need_boat
 
-    @property
+    @snapshot_property
     def sendable_type(self) -> SendableType:
-        if (self.offense != 0) and (self.defense != 0):
-            return SendableType.HYBRID
-        elif self.offense == 0:
-            return SendableType.PURE_DEFENSE
-        elif self.defense == 0:
-            return SendableType.PURE_OFFENSE
+        return sendable_type_of(self.offense, self.defense)
 
-    @property
+    @snapshot_property
     def op_over_dp(self) -> float:
-        if self.offense == 0:
-            return 0
-        elif self.defense == 0:
-            return math.inf
-        else:
-            return self.offense / self.defense
+        return op_over_dp_of(self.offense, self.defense)
 
     @property
     def cost(self) -> dict:
-        return self._data['cost']
+        return self.profile.cost
 
-    @property
+    @snapshot_property
     def offense(self) -> float:
-        op = self._data['power']['offense']
+        op = self.profile.base_offense
+        if not self.profile.dynamic_offense:
+            return op
         op += self.land_bonus('offense_from_land')
         if self.has_perk('offense_raw_wizard_ratio'):
             per_percent, max_bonus = self.get_perk('offense_raw_wizard_ratio')
@@ -205,9 +246,11 @@ class Unit(object):
                 op += prestige_bonus
         return op
 
-    @property
+    @snapshot_property
     def defense(self) -> float:
-        dp = self._data['power']['defense']
+        dp = self.profile.base_defense
+        if not self.profile.dynamic_defense:
+            return dp
         dp += self.land_bonus('defense_from_land')
         return dp
 
@@ -227,30 +270,85 @@ class Unit(object):
         }
 
 
+class RaceProfile(object):
+    """
+    The static data of a race, compiled once per race.
+
+    Holds the unit profiles, the shared Unit instances of the units without dominion dependent
+    perks and, when none of the units has such perks, the unit orderings used by the military
+    calculations. Those orderings are then the same for every dominion of the race.
+    """
+    __slots__ = ('name', 'perks', 'unit_profiles', 'reverse_units', 'shared_units', 'dynamic',
+                 'hybrid_units', 'hybrids_by_dp', 'pure_offense_units', 'pure_defense_units', 'sendable_units')
+
+    def __init__(self, name: str, yaml_src: dict):
+        self.name = name
+        self.perks = dict(yaml_src.get('perks', {}))
+        self.unit_profiles = {nr: UnitProfile(yaml_src['units'][nr - 1]) for nr in range(1, 5)}
+        self.reverse_units = {profile.name: nr for nr, profile in self.unit_profiles.items()}
+        self.shared_units = {nr: Unit(profile, None, snapshot=True)
+                             for nr, profile in self.unit_profiles.items() if not profile.dynamic}
+        self.dynamic = len(self.shared_units) < len(self.unit_profiles)
+        if self.dynamic:
+            self.hybrid_units = self.hybrids_by_dp = self.pure_offense_units = None
+            self.pure_defense_units = self.sendable_units = None
+        else:
+            self.hybrid_units, self.hybrids_by_dp, self.pure_offense_units, self.pure_defense_units = \
+                unit_orderings(self.shared_units)
+            self.sendable_units = self.pure_offense_units + self.hybrids_by_dp
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get(name: str) -> 'RaceProfile':
+        return RaceProfile(name, Race._load_race_data(name))
+
+
+def unit_orderings(units: dict) -> tuple[tuple, tuple, tuple, tuple]:
+    """Hybrid units by OP/DP ratio and by DP, pure offense and pure defense units (in unit order)."""
+    hybrids = tuple(sorted([u for u in units.values() if u.sendable_type == SendableType.HYBRID],
+                           key=attrgetter('op_over_dp'), reverse=True))
+    pure_offense = tuple(u for u in units.values() if u.sendable_type == SendableType.PURE_OFFENSE)
+    pure_defense = tuple(u for u in units.values() if u.sendable_type == SendableType.PURE_DEFENSE)
+    assert len(hybrids) + len(pure_offense) + len(pure_defense) == len(units)
+    hybrids_by_dp = tuple(sorted(hybrids, key=attrgetter('defense'), reverse=True))
+    return hybrids, hybrids_by_dp, pure_offense, pure_defense
+
+
 class Race(object):
-    RACE_REGISTRY: dict = dict()
+    """
+    A race as seen in one dominion: the RaceProfile plus Unit overlays for the dominion dependent units.
+
+    Races without dominion dependent units share the profile's units and orderings, so creating one
+    allocates nothing but this object.
+    """
+    __slots__ = ('name', 'dom', 'profile', 'units', '_snapshot')
 
-    def __init__(self, dom, name: str):
+    def __init__(self, dom, name: str, snapshot=False):
         assert isinstance(name, str)
         self.name = name
         self.dom = dom
-        self.yaml = self._load_race_data(self.name)
-        self.units = dict()
-        self.reverse_units = dict()
-        for i in range(1, 5):
-            unit = Unit(self.yaml['units'][i - 1], dom)
-            self.units[i] = unit
-            self.reverse_units[unit.name] = i
+        self.profile = RaceProfile.get(name)
+        self._snapshot = {} if snapshot else None
+        if self.profile.dynamic:
+            self.units = {nr: self.profile.shared_units.get(nr) or Unit(profile, dom, snapshot)
+                          for nr, profile in self.profile.unit_profiles.items()}
+        else:
+            self.units = self.profile.shared_units
+
+    def invalidate(self):
+        """Forget the values of this race and its units evaluated in snapshot mode."""
+        if self._snapshot is not None:
+            self._snapshot.clear()
+        for unit in self.units.values():
+            unit.invalidate()
 
     @staticmethod
-    @lru_cache(maxsize=None)
     def _load_race_data(name) -> dict:
-        if name not in Race.RACE_REGISTRY:
-            logger.debug(f'Cache miss for race {name}')
-            name = name.replace(' ', '').lower()
-            with open(f'{REF_DATA_DIR}/races/{name}.yml', 'r') as f:
-                Race.RACE_REGISTRY[name] = yaml.safe_load(f)
-        return Race.RACE_REGISTRY[name]
+        return ref_data().races[name.replace(' ', '').lower()]
+
+    @property
+    def reverse_units(self) -> dict:
+        return self.profile.reverse_units
 
     def unit(self, nr: int) -> Unit:
         return self.units[nr]
@@ -258,37 +356,37 @@ class Race(object):
     def nr_of_unit(self, unit) -> int:
         if isinstance(unit, int):
             return unit
-        return self.reverse_units[unit.name]
+        return self.profile.reverse_units[unit.name]
 
     def has_perk(self, name) -> bool:
-        return 'perks' in self.yaml and name in self.yaml['perks']
+        return name in self.profile.perks
 
     def get_perk(self, name, default=None):
-        if self.has_perk(name):
-            return self.yaml['perks'][name]
-        else:
-            return default
+        return self.profile.perks.get(name, default)
+
+    @snapshot_property
+    def _orderings(self) -> tuple[tuple, tuple, tuple, tuple]:
+        return unit_orderings(self.units)
 
     @property
-    def hybrid_units(self) -> list[Unit]:
-        return sorted([u for u in self.units.values() if u.sendable_type == SendableType.HYBRID], key=attrgetter('op_over_dp'), reverse=True)
+    def hybrid_units(self) -> tuple[Unit, ...]:
+        return self.profile.hybrid_units if not self.profile.dynamic else self._orderings[0]
 
     @property
-    def hybrids_by_dp(self) -> list[Unit]:
-        assert len(self.hybrid_units) + len(self.pure_offense_units) + len(self.pure_defense_units) == len(self.units)
-        return sorted(self.hybrid_units, key=attrgetter('defense'), reverse=True)
+    def hybrids_by_dp(self) -> tuple[Unit, ...]:
+        return self.profile.hybrids_by_dp if not self.profile.dynamic else self._orderings[1]
 
     @property
-    def pure_offense_units(self) -> list[Unit]:
-        return [u for u in self.units.values() if u.sendable_type == SendableType.PURE_OFFENSE]
+    def pure_offense_units(self) -> tuple[Unit, ...]:
+        return self.profile.pure_offense_units if not self.profile.dynamic else self._orderings[2]
 
     @property
-    def sendable_units(self) -> list[Unit]:
-        return self.pure_offense_units + self.hybrids_by_dp
+    def sendable_units(self) -> tuple[Unit, ...]:
+        return self.profile.sendable_units if not self.profile.dynamic else self.pure_offense_units + self.hybrids_by_dp
 
     @property
-    def pure_defense_units(self) -> list[Unit]:
-        return [u for u in self.units.values() if u.sendable_type == SendableType.PURE_DEFENSE]
+    def pure_defense_units(self) -> tuple[Unit, ...]:
+        return self.profile.pure_defense_units if not self.profile.dynamic else self._orderings[3]
 
 
 if __name__ == '__main__':
@@ -1,87 +1,629 @@
 """
 Cross-process cache for the ODInfo facade.
 
-Uses file-based invalidation to coordinate cache clearing across multiple
-worker processes. Each worker maintains its own in-memory cache but checks
-a shared invalidation file to know when to clear it.
+Each worker keeps a bounded in-memory cache: least recently used entries are evicted beyond
+max_entries, and entries older than the TTL (if any) are recomputed. Optionally the entries are
+also stored in a SharedCacheStore, a local SQLite file, so that a list computed by one worker
+process serves all of them. Hits in the shared store update its LRU order in batches, so that
+reading an entry doesn't take a write lock every time.
+
+Entries record what they depend on (tags like 'ops' or 'search') and the generation of the
+InvalidationLog they are up to date with. Invalidating a tag, optionally for some dominions only,
+appends events to the log, which bumps its generation. Every worker polls the log (at most once
+per INVALIDATION_CHECK_INTERVAL), and an entry is stale when an event for one of its tags came
+after it. Entries cached with a patch function are patched for the invalidated dominions instead
+of being recomputed. Without a shared store the log is kept in memory (LocalInvalidationLog), and
+other processes only signal that they invalidated something through a file, which invalidates
+every entry.
+
+get_or_compute is single-flight: while one thread computes a missing value, other threads that
+ask for it wait for that result. With a shared store, worker processes also take a lock on the key
+in the store, and the others wait for the value to appear there. Waiting ends after
+compute_timeout seconds, after which the waiting request computes the value itself.
 """
 
 import logging
 import os
+import pickle
+import sqlite3
+import threading
 import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
 from pathlib import Path
+from typing import Any, Callable, Iterable
 
-from odinfo.config import INSTANCE_DIR, executable_path
+from odinfo.config import INSTANCE_DIR, Config, executable_path
 
 logger = logging.getLogger('od-info.cache')
 
-INVALIDATION_FILE = Path(executable_path(INSTANCE_DIR)) / 'cache_invalidated_at'
+SHARED_CACHE_FILE = Path(executable_path(INSTANCE_DIR)) / 'facade_cache.sqlite'
+INVALIDATION_SIGNAL_FILE = Path(executable_path(INSTANCE_DIR)) / 'cache_invalidated_at'
+DEFAULT_MAX_ENTRIES = 64
+# Seconds between checks of the invalidation log
+INVALIDATION_CHECK_INTERVAL = 1.0
+# Seconds that invalidation events are kept; entries from before that are stale
+EVENT_RETENTION = 24 * 3600
+# Events kept in memory per worker, older ones are read from the log when needed
+MAX_LOCAL_EVENTS = 1000
+# Tag of an event that invalidates every entry
+ALL = '*'
+DEFAULT_COMPUTE_TIMEOUT = 120
+# Seconds between checks of the shared store while another worker computes a value
+COMPUTE_POLL_INTERVAL = 0.1
+# Seconds that the last use of shared entries is kept in memory before it is written to the store
+LAST_USED_FLUSH_INTERVAL = 60.0
 
+_MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    shared_hits: int = 0  # hits that were found in the shared store, not in memory
+    misses: int = 0
+    patches: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+    waits: int = 0  # misses that got the value computed by another thread or worker
+    wait_timeouts: int = 0
+    entries: int = 0
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    stored_at: float  # time.time()
+    generation: int  # generation of the invalidation log that the value is up to date with
+    depends_on: frozenset[str] | None  # None: depends on everything
+    patchable: bool = False
+
+
+@dataclass
+class _Flight:
+    """A computation in progress in this worker, that other threads can wait for."""
+    done: threading.Event = field(default_factory=threading.Event)
+    value: Any = _MISSING
+
+
+@dataclass(frozen=True)
+class InvalidationEvent:
+    generation: int
+    tag: str
+    dominion: int | None  # None: all dominions
 
-class FacadeCache:
-    def __init__(self):
-        self._data = {}
-        self._last_validated_at = 0.0
-        logger.debug("[pid=%d] FacadeCache created (id=%s)", os.getpid(), id(self))
 
-    def _check_invalidation(self):
-        """Check if cache should be cleared based on shared invalidation file."""
+class _SQLiteFile(object):
+    """A connection to a local SQLite file per process, usable from all threads of the process."""
+
+    SCHEMA = ''
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._lock = threading.RLock()
+        self._conn: sqlite3.Connection | None = None
+        self._pid = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # A connection can't be shared with a forked worker process
+        if self._conn is None or self._pid != os.getpid():
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self._path, timeout=10, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(self.SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+
+class InvalidationLog(_SQLiteFile):
+    """Invalidation events of all worker processes, numbered by a monotonic generation counter."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS CacheEvent (generation INTEGER PRIMARY KEY AUTOINCREMENT,
+                                               tag TEXT, dominion INTEGER, created REAL);
+        CREATE INDEX IF NOT EXISTS idx_CacheEvent_created ON CacheEvent (created);
+    """
+
+    def __init__(self, path: Path = SHARED_CACHE_FILE):
+        super().__init__(path)
+
+    def append(self, tag: str, dom_codes: Iterable[int] | None = None) -> int:
+        """Record an invalidation of tag, for some dominions or (None) all. Returns the new generation."""
+        now = time.time()
+        dominions = [None] if dom_codes is None else [int(code) for code in dom_codes]
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.executemany('INSERT INTO CacheEvent (tag, dominion, created) VALUES (?, ?, ?)',
+                                      [(tag, dominion, now) for dominion in dominions])
+                self.conn.execute('DELETE FROM CacheEvent WHERE created < ?', (now - EVENT_RETENTION,))
+                generation = self.generation()
+            except sqlite3.Error:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+            return generation
+
+    def generation(self) -> int:
+        """The current generation: that of the latest event."""
+        with self._lock:
+            row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'CacheEvent'").fetchone()
+            return row[0] if row else 0
+
+    def events_since(self, generation: int) -> tuple[list[InvalidationEvent], bool]:
+        """
+        The events after the given generation, oldest first.
+
+        Returns:
+            The events, and whether they are complete (False if some were already deleted).
+        """
+        with self._lock:
+            rows = self.conn.execute('SELECT generation, tag, dominion FROM CacheEvent WHERE generation > ? '
+                                     'ORDER BY generation', (generation,)).fetchall()
+            first = self.conn.execute('SELECT min(generation) FROM CacheEvent').fetchone()[0]
+        complete = first is None or first <= generation + 1
+        return [InvalidationEvent(*row) for row in rows], complete
+
+
+class LocalInvalidationLog(object):
+    """
+    Invalidation events of this process only, for a cache that isn't shared.
+
+    Other processes (the cron job, other web workers) can't see these events. Instead every
+    append writes a new signal to signal_file, and a signal from another process shows up here
+    as an invalidation of everything.
+    """
+
+    def __init__(self, signal_file: Path | None = INVALIDATION_SIGNAL_FILE):
+        """
+        Args:
+            signal_file: File to signal invalidations to other processes with, None to not signal them.
+        """
+        self._signal_file = signal_file
+        self._lock = threading.Lock()
+        self._events: list[tuple[InvalidationEvent, float]] = []
+        self._generation = 0
+        self._signal_seen = self._read_signal()
+
+    def _read_signal(self) -> str:
+        # Not the modification time: two signals can get the same one
+        if self._signal_file is None:
+            return ''
         try:
-            file_mtime = INVALIDATION_FILE.stat().st_mtime
-            if file_mtime > self._last_validated_at:
-                logger.debug("[pid=%d] Cache invalidated by file (file_mtime=%.3f > last_validated=%.3f)",
-                             os.getpid(), file_mtime, self._last_validated_at)
-                self._data.clear()
-                self._last_validated_at = time.time()
+            return self._signal_file.read_text()
         except FileNotFoundError:
-            pass
+            return ''
+
+    def _add(self, tag: str, dominions: list[int | None]):
+        now = time.time()
+        self._events.extend((InvalidationEvent(self._generation + nr, tag, dominion), now)
+                            for nr, dominion in enumerate(dominions, 1))
+        self._generation += len(dominions)
+        while self._events and self._events[0][1] < now - EVENT_RETENTION:
+            self._events.pop(0)
+
+    def _check_signal(self):
+        signal = self._read_signal()
+        if signal != self._signal_seen:
+            self._signal_seen = signal
+            self._add(ALL, [None])
+
+    def append(self, tag: str, dom_codes: Iterable[int] | None = None) -> int:
+        """Record an invalidation of tag, for some dominions or (None) all. Returns the new generation."""
+        dominions = [None] if dom_codes is None else [int(code) for code in dom_codes]
+        with self._lock:
+            self._check_signal()
+            self._add(tag, dominions)
+            if self._signal_file is not None:
+                self._signal_seen = f'{os.getpid()}-{id(self)}-{time.time_ns()}'
+                self._signal_file.parent.mkdir(parents=True, exist_ok=True)
+                self._signal_file.write_text(self._signal_seen)
+            return self._generation
+
+    def generation(self) -> int:
+        """The current generation: that of the latest event."""
+        with self._lock:
+            self._check_signal()
+            return self._generation
+
+    def events_since(self, generation: int) -> tuple[list[InvalidationEvent], bool]:
+        """
+        The events after the given generation, oldest first.
+
+        Returns:
+            The events, and whether they are complete (False if some were already deleted).
+        """
+        with self._lock:
+            self._check_signal()
+            events = [event for event, _ in self._events if event.generation > generation]
+            first = self._events[0][0].generation if self._events else None
+        complete = first is None or first <= generation + 1
+        return events, complete
+
+
+class SharedCacheStore(_SQLiteFile):
+    """
+    Cache entries shared by all worker processes, as pickled values in a local SQLite file.
+
+    The least recently used entries beyond max_entries are deleted on every write. Reads only note
+    when an entry was used, which is written to the store before every write or at most once per
+    LAST_USED_FLUSH_INTERVAL. The store also holds the locks of the keys that a worker is computing.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS CacheEntry (key TEXT PRIMARY KEY, value BLOB, stored_at REAL, last_used REAL,
+                                               generation INTEGER, depends_on TEXT, patchable INTEGER);
+        CREATE TABLE IF NOT EXISTS CacheLock (key TEXT PRIMARY KEY, owner TEXT, expires REAL);
+    """
+
+    def __init__(self, path: Path = SHARED_CACHE_FILE, max_entries: int = DEFAULT_MAX_ENTRIES):
+        super().__init__(path)
+        self._max_entries = max_entries
+        # When entries were last used by this process, since the last flush
+        self._used: dict[str, float] = {}
+        self._flushed_at = time.monotonic()
+
+    def _flush_used(self):
+        if self._used:
+            self.conn.executemany('UPDATE CacheEntry SET last_used = max(last_used, ?) WHERE key = ?',
+                                  [(used, key) for key, used in self._used.items()])
+            self._used = {}
+        self._flushed_at = time.monotonic()
 
-    @staticmethod
-    def signal_invalidation():
-        """Signal all workers to clear their caches by touching the invalidation file."""
-        INVALIDATION_FILE.parent.mkdir(parents=True, exist_ok=True)
-        INVALIDATION_FILE.touch()
-        logger.debug("[pid=%d] Cache invalidation signaled", os.getpid())
+    def get(self, key: str, ttl: float | None = None) -> CacheEntry:
+        """
+        The entry of a key.
+
+        Raises:
+            KeyError: If there is no such entry, or it's older than ttl seconds.
+        """
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute('SELECT value, stored_at, generation, depends_on, patchable FROM CacheEntry '
+                                    'WHERE key = ?', (key,)).fetchone()
+            if row is None or (ttl and now - row[1] > ttl):
+                raise KeyError(key)
+            self._used[key] = now
+            if time.monotonic() - self._flushed_at > LAST_USED_FLUSH_INTERVAL:
+                self._flush_used()
+        value, stored_at, generation, depends_on, patchable = row
+        return CacheEntry(pickle.loads(value), stored_at, generation,
+                          None if depends_on is None else frozenset(depends_on.split(',')), bool(patchable))
+
+    def set(self, key: str, entry: CacheEntry) -> int:
+        """Store an entry. Returns the number of entries evicted to stay within max_entries."""
+        data = pickle.dumps(entry.value, protocol=pickle.HIGHEST_PROTOCOL)
+        depends_on = None if entry.depends_on is None else ','.join(sorted(entry.depends_on))
+        with self._lock:
+            self._flush_used()
+            self.conn.execute('INSERT OR REPLACE INTO CacheEntry '
+                              '(key, value, stored_at, last_used, generation, depends_on, patchable) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (key, data, entry.stored_at, time.time(), entry.generation, depends_on,
+                               entry.patchable))
+            return self.conn.execute('DELETE FROM CacheEntry WHERE key NOT IN '
+                                     '(SELECT key FROM CacheEntry ORDER BY last_used DESC, rowid DESC LIMIT ?)',
+                                     (self._max_entries,)).rowcount
+
+    def acquire(self, key: str, owner: str, lease: float) -> bool:
+        """
+        Take the lock of a key for lease seconds, unless another owner holds it.
+
+        A lock that outlived its lease (its owner crashed or hangs) can be taken over.
+        """
+        now = time.time()
+        with self._lock:
+            return self.conn.execute('INSERT INTO CacheLock (key, owner, expires) VALUES (?, ?, ?) '
+                                     'ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires = excluded.expires '
+                                     'WHERE CacheLock.expires < ? OR CacheLock.owner = excluded.owner',
+                                     (key, owner, now + lease, now)).rowcount > 0
+
+    def release(self, key: str, owner: str):
+        with self._lock:
+            self.conn.execute('DELETE FROM CacheLock WHERE key = ? AND owner = ?', (key, owner))
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute('DELETE FROM CacheEntry')
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute('SELECT count(*) FROM CacheEntry').fetchone()[0]
+
+
+class FacadeCache:
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float | None = None,
+                 shared: SharedCacheStore | None = None, log: InvalidationLog | None = None,
+                 compute_timeout: float = DEFAULT_COMPUTE_TIMEOUT):
+        """
+        Args:
+            max_entries: Entries kept in memory, the least recently used ones are evicted beyond that.
+            ttl: Seconds after which an entry is recomputed, None to keep entries until invalidated.
+            shared: Store for sharing entries with the other worker processes.
+            log: Invalidation log shared with the other worker processes. By default the one in the
+                shared store's file, or one in memory without a shared store.
+            compute_timeout: Seconds to wait for a value that another thread or worker is computing.
+        """
+        self._data: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._shared = shared
+        if log is None:
+            log = InvalidationLog(shared.path) if shared is not None else LocalInvalidationLog()
+        self._log = log
+        self._compute_timeout = compute_timeout
+        self._stats = CacheStats()
+        self._lock = threading.RLock()
+        self._flights: dict[str, _Flight] = {}
+        self._owner = f'{os.getpid()}-{id(self)}'
+        self._generation = self._log.generation()
+        # The events after generation _events_from that this worker has seen
+        self._events_from = self._generation
+        self._events: list[InvalidationEvent] = []
+        self._last_checked_at = time.monotonic()
+        logger.debug("[pid=%d] FacadeCache created (id=%s)", os.getpid(), id(self))
+
+    @classmethod
+    def from_config(cls, config: Config) -> 'FacadeCache':
+        shared = SharedCacheStore(max_entries=config.cache_max_entries) if config.shared_cache else None
+        return cls(config.cache_max_entries, config.cache_ttl or None, shared,
+                   compute_timeout=config.cache_compute_timeout)
+
+    def _poll_events(self, force: bool = False):
+        """Read the new events of the invalidation log, at most once per INVALIDATION_CHECK_INTERVAL."""
+        now = time.monotonic()
+        if not force and now - self._last_checked_at < INVALIDATION_CHECK_INTERVAL:
+            return
+        self._last_checked_at = now
+        events, complete = self._log.events_since(self._generation)
+        if not complete:
+            logger.debug("[pid=%d] Missed cache invalidations, clearing", os.getpid())
+            self._data.clear()
+            self._events = []
+            self._events_from = self._generation = self._log.generation()
+        elif events:
+            logger.debug("[pid=%d] %d new cache invalidations", os.getpid(), len(events))
+            self._events.extend(events)
+            self._generation = events[-1].generation
+            if len(self._events) > MAX_LOCAL_EVENTS:
+                self._events_from = self._events[-MAX_LOCAL_EVENTS - 1].generation
+                self._events = self._events[-MAX_LOCAL_EVENTS:]
+
+    def _events_after(self, entry: CacheEntry) -> list[InvalidationEvent] | None:
+        """The events that affect an entry, or None if it's stale for all dominions."""
+        if entry.generation >= self._events_from:
+            events = [event for event in self._events if event.generation > entry.generation]
+        else:
+            events, complete = self._log.events_since(entry.generation)
+            if not complete:
+                return None
+            events = [event for event in events if event.generation <= self._generation]
+        events = [event for event in events
+                  if event.tag == ALL or entry.depends_on is None or event.tag in entry.depends_on]
+        if any(event.tag == ALL or event.dominion is None for event in events):
+            return None
+        return events
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return self._ttl is not None and time.time() - entry.stored_at > self._ttl
+
+    def _lookup(self, key: str, count: bool = True, patch: Callable[[Any, set[int]], Any] | None = None) -> Any:
+        """The up to date cached value, from memory or the shared store, or _MISSING."""
+        with self._lock:
+            self._poll_events()
+            entry, shared = self._data.get(key), False
+            if entry is not None and self._expired(entry):
+                del self._data[key]
+                self._stats.expirations += 1
+                entry = None
+            if entry is None and self._shared is not None:
+                try:
+                    entry, shared = self._shared.get(key, self._ttl), True
+                except KeyError:
+                    pass
+            events = self._events_after(entry) if entry is not None else None
+            if entry is not None and (events is None or (events and (patch is None or not entry.patchable))):
+                self._data.pop(key, None)
+                self._stats.invalidations += 1
+                entry = None
+            if entry is None:
+                if count:
+                    self._stats.misses += 1
+                return _MISSING
+            generation = self._generation
+            if not events:
+                if shared:
+                    self._store(key, entry, shared=False)
+                else:
+                    self._data.move_to_end(key)
+
+        if events:
+            dom_codes = {event.dominion for event in events}
+            logger.debug("Patching %s for dominions %s", key, sorted(dom_codes))
+            entry = replace(entry, value=patch(entry.value, dom_codes), generation=generation)
+        with self._lock:
+            if events:
+                self._stats.patches += 1
+                self._store(key, entry, shared=True)
+            if count:
+                self._stats.hits += 1
+                self._stats.shared_hits += shared
+        return entry.value
+
+    def _store(self, key: str, entry: CacheEntry, shared: bool):
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        while len(self._data) > self._max_entries:
+            self._data.popitem(last=False)
+            self._stats.evictions += 1
+        if shared and self._shared is not None:
+            try:
+                self._stats.evictions += self._shared.set(key, entry)
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                logger.warning("Cache entry %s can't be shared: %s", key, e)
 
     def __contains__(self, key):
-        self._check_invalidation()
-        return key in self._data
+        return self._lookup(key, count=False) is not _MISSING
 
     def __getitem__(self, key):
-        self._check_invalidation()
-        return self._data[key]
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
 
     def __setitem__(self, key, value):
-        self._check_invalidation()
-        self._data[key] = value
+        self.put(key, value)
+
+    def put(self, key: str, value: Any, depends_on: Iterable[str] | None = None, patchable: bool = False,
+            generation: int | None = None):
+        """
+        Cache a value.
+
+        Args:
+            key: Key of the value.
+            value: The value.
+            depends_on: Tags of the data the value is computed from, None if it depends on everything.
+            patchable: Whether the value is patched for invalidated dominions (see get_or_compute).
+            generation: Generation of the invalidation log the value is up to date with, if not the latest.
+        """
+        with self._lock:
+            entry = CacheEntry(value, time.time(), self._generation if generation is None else generation,
+                               None if depends_on is None else frozenset(depends_on), patchable)
+            self._store(key, entry, shared=True)
 
     def get(self, key, default=None):
-        self._check_invalidation()
-        return self._data.get(key, default)
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], depends_on: Iterable[str] | None = None,
+                       patch: Callable[[Any, set[int]], Any] | None = None) -> Any:
+        """
+        The cached value of key, computing and caching it first if needed.
+
+        Args:
+            key: Key of the value.
+            compute: Computes the value.
+            depends_on: Tags of the data the value is computed from, None if it depends on everything.
+            patch: Takes a cached value and the codes of the dominions that were invalidated since, and
+                returns the up to date value. Without one, invalidated values are recomputed.
+        """
+        value = self._lookup(key, patch=patch)
+        if value is not _MISSING:
+            logger.debug("Returning cached %s", key)
+            return value
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            logger.debug("Waiting for %s", key)
+            if flight.done.wait(self._compute_timeout) and flight.value is not _MISSING:
+                with self._lock:
+                    self._stats.waits += 1
+                return flight.value
+            # The computation failed or takes too long: try it here too
+            if not flight.done.is_set():
+                self._timed_out(key)
+            return self._compute(key, compute, depends_on, patch)
+
+        try:
+            flight.value = self._compute_once(key, compute, depends_on, patch)
+            return flight.value
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _compute_once(self, key: str, compute: Callable[[], Any], depends_on: Iterable[str] | None,
+                      patch: Callable[[Any, set[int]], Any] | None) -> Any:
+        """Compute a value, or wait for another worker that holds the lock of key in the shared store."""
+        if self._shared is None:
+            return self._compute(key, compute, depends_on, patch)
+
+        deadline = time.monotonic() + self._compute_timeout
+        while not self._shared.acquire(key, self._owner, self._compute_timeout):
+            if time.monotonic() > deadline:
+                self._timed_out(key)
+                return self._compute(key, compute, depends_on, patch)
+            time.sleep(COMPUTE_POLL_INTERVAL)
+            value = self._lookup(key, count=False, patch=patch)
+            if value is not _MISSING:
+                with self._lock:
+                    self._stats.waits += 1
+                return value
+        try:
+            # Another worker may have stored it just before releasing the lock
+            value = self._lookup(key, count=False, patch=patch)
+            if value is _MISSING:
+                return self._compute(key, compute, depends_on, patch)
+            with self._lock:
+                self._stats.waits += 1
+            return value
+        finally:
+            self._shared.release(key, self._owner)
+
+    def _compute(self, key: str, compute: Callable[[], Any], depends_on: Iterable[str] | None,
+                 patch: Callable[[Any, set[int]], Any] | None) -> Any:
+        logger.debug("Computing %s", key)
+        # Invalidations that come in during the computation still apply to the result
+        generation = self._generation
+        value = compute()
+        self.put(key, value, depends_on, patchable=patch is not None, generation=generation)
+        return value
+
+    def _timed_out(self, key: str):
+        logger.warning("[pid=%d] Waited %ss for %s, computing it here as well", os.getpid(),
+                       self._compute_timeout, key)
+        with self._lock:
+            self._stats.wait_timeouts += 1
 
     def keys(self):
-        self._check_invalidation()
-        return self._data.keys()
+        with self._lock:
+            self._poll_events()
+            return list(self._data.keys())
+
+    def invalidate(self, tag: str, dom_codes: Iterable[int] | None = None) -> int:
+        """
+        Invalidate the entries of all workers that depend on tag, for some dominions or (None) all.
+
+        Returns the new generation of the invalidation log.
+        """
+        dom_codes = None if dom_codes is None else list(dom_codes)
+        if dom_codes == []:
+            return self._generation
+        generation = self._log.append(tag, dom_codes)
+        logger.debug("[pid=%d] Invalidated %s for %s (generation %d)", os.getpid(), tag,
+                     'all dominions' if dom_codes is None else dom_codes, generation)
+        with self._lock:
+            self._poll_events(force=True)
+        return generation
 
     def clear(self):
-        """Clear this worker's cache and signal other workers to clear theirs."""
-        self._data.clear()
-        self._last_validated_at = time.time()
-        self.signal_invalidation()
+        """Clear this worker's cache and the shared store, and invalidate the caches of other workers."""
+        with self._lock:
+            self._data.clear()
+            if self._shared is not None:
+                self._shared.clear()
+        self.invalidate(ALL)
 
-    def invalidate_prefix(self, prefix: str) -> int:
-        """Remove all entries with keys starting with the given prefix.
+    def generation(self) -> int:
+        """The latest generation of the invalidation log, which changes with every update of the data."""
+        return self._log.generation()
 
-        Also signals other workers to clear their caches entirely.
-        Returns the number of entries removed from this worker's cache.
-        """
-        self._check_invalidation()
-        keys_to_remove = [k for k in self._data if k.startswith(prefix)]
-        for k in keys_to_remove:
-            del self._data[k]
-        self.signal_invalidation()
-        return len(keys_to_remove)
+    def stats(self) -> CacheStats:
+        """Hit/miss/eviction counts of this worker's cache, and its current number of entries."""
+        with self._lock:
+            return replace(self._stats, entries=len(self._data))
 
     def __len__(self):
-        self._check_invalidation()
-        return len(self._data)
\ No newline at end of file
+        with self._lock:
+            self._poll_events()
+            return len(self._data)
@@ -1,21 +1,45 @@
-from matplotlib.figure import Figure
-import base64
-from io import BytesIO
+"""
+Land/networth history graphs of a dominion.
+
+The graphs are served as images of their own, so that the dominion page doesn't wait for them.
+Rendered graphs are kept in GraphCache, a directory of image files named after the dominion, the
+metric and the timestamp of the latest history: a graph is only rendered again when new history
+comes in.
+
+Graphs are rendered as SVG by odinfo.facade.svgchart. matplotlib (PNG) is an optional fallback,
+chosen with GRAPH_RENDERER = matplotlib in the secrets file.
+"""
+
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
 from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+from typing import Callable
 
+from odinfo.config import INSTANCE_DIR, executable_path
+from odinfo.facade.svgchart import Series, line_chart
 
-def land_history_graph(dom_history):
-    return dom_history_graph(dom_history, 'land')
+logger = logging.getLogger('od-info.graphs')
 
+GRAPH_CACHE_DIR = Path(executable_path(INSTANCE_DIR)) / 'graphs'
+METRICS = ('networth', 'land')
 
-def nw_history_graph(dom_history):
-    return dom_history_graph(dom_history, 'networth')
 
+def history_graph_svg(dom_history, yaxis: str) -> bytes:
+    """SVG image of the yaxis ('land' or 'networth') of the history over time."""
+    converted = {h.timestamp: getattr(h, yaxis) for h in dom_history}
+    points = sorted(converted.items())
+    return line_chart([Series(yaxis.capitalize(), points)], f"{yaxis.capitalize()} over Time").encode()
+
+
+def history_graph_png(dom_history, yaxis: str) -> bytes:
+    """PNG image of the yaxis ('land' or 'networth') of the history over time, drawn by matplotlib."""
+    # matplotlib is optional and slow to import
+    from matplotlib.figure import Figure
 
-def dom_history_graph(dom_history, yaxis: str):
-    # def conv_ts(ts):
-    #     # return datetime.fromisoformat(ts).strftime('%Y-%m-%d %H:%M')
-    #     return datetime.fromisoformat(ts)
     converted = {h.timestamp: getattr(h, yaxis) for h in dom_history}
     x = list(converted.keys())
     x.sort()
@@ -27,6 +51,66 @@ def dom_history_graph(dom_history, yaxis: str):
     fig.suptitle(f"{yaxis.capitalize()} over Time")
     buf = BytesIO()
     fig.savefig(buf, format="png")
-    # Embed the result in the html output.
-    data = base64.b64encode(buf.getbuffer()).decode("ascii")
-    return f"<img src='data:image/png;base64,{data}'/>"
+    return buf.getvalue()
+
+
+@dataclass(frozen=True)
+class GraphRenderer:
+    render: Callable[[list, str], bytes]
+    suffix: str  # of the files, which determines their content type
+
+
+SVG = GraphRenderer(history_graph_svg, '.svg')
+PNG = GraphRenderer(history_graph_png, '.png')
+
+
+def graph_renderer(name: str) -> GraphRenderer:
+    """The renderer for GRAPH_RENDERER: 'svg', or 'matplotlib' if it is installed."""
+    if name == 'matplotlib':
+        try:
+            import matplotlib  # noqa: F401
+            return PNG
+        except ImportError:
+            logger.warning("matplotlib isn't installed, rendering graphs as SVG")
+    return SVG
+
+
+class GraphCache(object):
+    """Rendered history graphs on disk, shared by all worker processes."""
+
+    def __init__(self, directory: Path = GRAPH_CACHE_DIR, renderer: GraphRenderer = SVG):
+        self._directory = directory
+        self._renderer = renderer
+
+    def path(self, dom_code: int, metric: str, latest: datetime | None) -> Path:
+        version = latest.strftime('%Y%m%d%H%M%S') if latest else 'empty'
+        return self._directory / f'{dom_code}_{metric}_{version}{self._renderer.suffix}'
+
+    def graph(self, dom_code: int, metric: str, latest: datetime | None, load_history: Callable[[], list]) -> Path:
+        """
+        The file of a graph, rendered first if there is none for the latest history yet.
+
+        Args:
+            dom_code: The dominion.
+            metric: 'land' or 'networth'.
+            latest: Timestamp of the latest history of the dominion, None if it has none.
+            load_history: Loads the history of the dominion, when the graph needs to be rendered.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric}")
+        path = self.path(dom_code, metric, latest)
+        if path.exists():
+            return path
+
+        logger.debug("Rendering %s graph of %s", metric, dom_code)
+        data = self._renderer.render(load_history(), metric)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        # Written under a temporary name, so that other workers never serve half a file
+        fd, tmp_name = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+        for old in self._directory.glob(f'{dom_code}_{metric}_*.*'):
+            if old != path:
+                old.unlink(missing_ok=True)
+        return path
@@ -9,16 +9,26 @@ Domain-specific operations are delegated to specialized services.
 """
 
 import logging
+import time
+from pathlib import Path
+from typing import Callable
+
+from sqlalchemy.orm import Session
 
 from odinfo.calculators.networthcalculator import get_networth_deltas
+from odinfo.calculators.strength_sampler import StrengthDistribution
 from odinfo.config import Config, SEARCH_PAGE
 from odinfo.repositories.game import GameRepository
 from odinfo.domain.models import Dominion
-from odinfo.timeutils import hours_since, add_duration, current_od_time
+from odinfo.exceptions import ODInfoException
+from odinfo.timeutils import hours_since, add_duration, current_od_time, truncate_to_tick
 from odinfo.facade.awardstats import AwardStats
 from odinfo.facade.cache import FacadeCache
+from odinfo.facade.graphs import GraphCache, graph_renderer
 from odinfo.opsdata.scrapetools import read_tick_time, get_soup_page
 from odinfo.opsdata.updater import query_stealables
+from odinfo.services.cleanup_service import CleanupService, CleanupProgress, OPS_RETENTION_HOURS
+from odinfo.services.job_service import JobService, JobStatus
 from odinfo.services.od_session import ODSession
 from odinfo.services.military_service import MilitaryService
 from odinfo.services.report_service import ReportService
@@ -28,6 +38,21 @@ from odinfoweb.viewmodels.ratios import build_ratio_list_vm
 
 logger = logging.getLogger('od-info.facade')
 
+# What the cached queries depend on, for FacadeCache.invalidate
+OPS = 'ops'  # the ops of a dominion
+SEARCH = 'search'  # land and networth of all dominions, from the search page
+DOMINIONS = 'dominions'  # player names and roles
+TOWN_CRIER = 'town_crier'
+
+# Hours that the NW tracker can look back
+NW_TRACKER_WINDOWS = (12, 24, 36, 48)
+
+# Background jobs that the pages enqueue, see run_job
+UPDATE_OVERVIEW = 'update_overview'  # the dominion index, and the ops of all dominions and the realmies
+UPDATE_DOMINION = 'update_dominion'  # the ops of the dominion with the argument as code
+UPDATE_TOWN_CRIER = 'update_town_crier'
+JOBS = (UPDATE_OVERVIEW, UPDATE_DOMINION, UPDATE_TOWN_CRIER)
+
 
 class ODInfoFacade(object):
     def __init__(self, config: Config, repo: GameRepository, cache: FacadeCache):
@@ -37,16 +62,18 @@ class ODInfoFacade(object):
         self._cache = cache
         self._update_service = UpdateService(config, repo, lambda: self.od_session)
         self._report_service = ReportService(repo)
-        self._military_service = MilitaryService(repo)
+        self._military_service = MilitaryService(repo, bs_window=config.bs_refinement_window)
+        self._graphs = GraphCache(renderer=graph_renderer(config.graph_renderer))
         self._update_service.initialize_if_empty()
 
     def clear_cache(self):
         logger.debug("Cache cleared (had %d entries)", len(self._cache))
         self._cache.clear()
 
-    def invalidate_cache(self, prefix: str):
-        removed = self._cache.invalidate_prefix(prefix)
-        logger.debug("Cache invalidated for prefix '%s' (%d entries removed)", prefix, removed)
+    def invalidate_cache(self, tag: str, dom_codes: list[int] | None = None):
+        """Invalidate the cached queries that depend on tag, for the given dominions or (None) all."""
+        generation = self._cache.invalidate(tag, dom_codes)
+        logger.debug("Cache invalidated for %s of %s (generation %d)", tag, dom_codes or 'all dominions', generation)
 
     @property
     def od_session(self):
@@ -61,43 +88,73 @@ class ODInfoFacade(object):
 
     def update_all(self):
         """Update ops for all dominions that have newer scans available."""
-        self._update_service.update_all()
-        self.clear_cache()
+        self.invalidate_cache(OPS, self._update_service.update_all())
 
     # ---------------------------------------- COMMANDS - Update from OpenDominion.net
 
     def update_dom_index(self):
         """Update the dominion index from OpenDominion search page."""
         self._update_service.update_dom_index()
+        self.invalidate_cache(SEARCH)
 
     def update_ops(self, dom_code: int):
         """Update ops data for a single dominion."""
         self._update_service.update_ops(dom_code)
+        self.invalidate_cache(OPS, [int(dom_code)])
 
     def update_single_dom(self, dom_code: int):
-        """Update ops for a single dominion and clear cache."""
-        self._update_service.update_ops(dom_code)
-        self.clear_cache()
+        """Update ops for a single dominion and invalidate what depends on them."""
+        self.update_ops(dom_code)
 
     def update_town_crier(self):
         """Update all Town Crier events from OpenDominion."""
         self._update_service.update_town_crier()
+        self.invalidate_cache(TOWN_CRIER)
 
     def update_realmies(self):
         """Update ops for all dominions in the player's realm."""
-        self._update_service.update_realmies(self.realmie_codes())
+        realmie_codes = self.realmie_codes()
+        self._update_service.update_realmies(realmie_codes)
+        self.invalidate_cache(OPS, realmie_codes)
+
+    # ---------------------------------------- COMMANDS - Background jobs
+
+    @staticmethod
+    def enqueue_job(jobs: JobService, kind: str, argument: str | int | None = None) -> JobStatus:
+        """Queue a job to run in the background, or return the same job that is queued or running already."""
+        if kind not in JOBS:
+            raise ODInfoException(f"Unknown job {kind}")
+        return jobs.enqueue(kind, argument)
+
+    def run_job(self, job: JobStatus, report: Callable[[str], None]):
+        """Run a job queued by enqueue_job; called by JobService on its worker thread."""
+        if job.kind == UPDATE_OVERVIEW:
+            report("Updating the dominion index")
+            self.update_dom_index()
+            report("Updating the ops of all dominions")
+            self.update_all()
+            report("Updating the ops of the realmies")
+            self.update_realmies()
+        elif job.kind == UPDATE_DOMINION:
+            report(f"Updating the ops of {job.argument}")
+            self.update_single_dom(int(job.argument))
+        elif job.kind == UPDATE_TOWN_CRIER:
+            report("Updating the Town Crier")
+            self.update_town_crier()
+        else:
+            raise ODInfoException(f"Unknown job {job.kind}")
 
     # ---------------------------------------- COMMANDS - Change directly
 
     def update_role(self, dom_code, role):
         logger.debug("Updating dominion %s role to %s", dom_code, role)
         self._repo.update_dominion_role(dom_code, role)
-        self.invalidate_cache('dom_list')
+        self.invalidate_cache(DOMINIONS, [int(dom_code)])
 
     def update_player(self, dom_code, player_name):
         logger.debug("Updating dominion player of dominion %s to %s", dom_code, player_name)
         self._repo.update_dominion_player(dom_code, player_name)
-        self.invalidate_cache('dom_list')
+        self.invalidate_cache(DOMINIONS, [int(dom_code)])
 
     # ---------------------------------------- COMMANDS - Send out information
 
@@ -124,26 +181,32 @@ class ODInfoFacade(object):
             self.update_ops(dom_code)
         return self._repo.get_dominion(dom_code).last_cs
 
-    def nw_history(self, dom_code):
-        """Get the networth history of a specific dominion."""
+    def nw_history(self, dom_code, hours: int | None = None):
+        """Get the land/networth history of a specific dominion, downsampled for long time spans."""
         logger.debug("Getting NW history for %s", dom_code)
-        return self._repo.get_dominion(dom_code).history
+        return self._repo.get_history(dom_code, hours)
+
+    def history_graph(self, dom_code: int, metric: str) -> Path:
+        """File of the land or networth graph of a dominion, rendered only when there is new history."""
+        latest = self._repo.latest_history_timestamp(dom_code)
+        return self._graphs.graph(dom_code, metric, latest, lambda: self.nw_history(dom_code))
 
     # ---------------------------------------- QUERIES - Lists
 
     def dom_list(self, since='-12 hours'):
         """Get overview information of all dominions."""
-        cache_key = f'dom_list_{since}'
-        if cache_key in self._cache:
-            logger.debug("Returning cached dom_list for %s", cache_key)
-            return self._cache[cache_key]
-
-        logger.debug("Computing dom_list for %s", cache_key)
-        dominions = list(self._repo.all_dominions())
-        nw_deltas = get_networth_deltas(self._repo)
-        result = build_overview_list_vm(dominions, nw_deltas)
-        self._cache[cache_key] = result
-        return result
+        def compute():
+            dominions = list(self._repo.all_dominions())
+            nw_deltas = get_networth_deltas(self._repo)
+            return build_overview_list_vm(dominions, nw_deltas)
+
+        def patch(rows, dom_codes):
+            # Networth deltas come from the search page, which invalidates the whole list
+            nw_deltas = {row.code: row.nw_delta for row in rows}
+            return self._patched_rows(rows, dom_codes, build_overview_list_vm(self._dominions(dom_codes), nw_deltas),
+                                      lambda row: row.land)
+
+        return self._cache.get_or_compute(f'dom_list_{since}', compute, (OPS, SEARCH, DOMINIONS), patch)
 
     def get_town_crier(self):
         logger.debug("Getting Town Crier")
@@ -151,39 +214,38 @@ class ODInfoFacade(object):
 
     def ratio_list(self):
         """Overview of the ratios of all dominions."""
-        cache_key = 'ratio_list'
-        if cache_key in self._cache:
-            logger.debug("Returning cached ratio_list")
-            return self._cache[cache_key]
-
-        logger.debug("Computing ratio_list")
-        result = build_ratio_list_vm(list(self._repo.all_dominions()))
-        self._cache[cache_key] = result
-        return result
-
-    def all_doms_ops_age(self):
-        cache_key = 'all_doms_ops_age'
-        if cache_key in self._cache:
-            logger.debug("Returning cached all_doms_ops_age")
-            return self._cache[cache_key]
-
-        logger.debug("Computing all_doms_ops_age")
-        result = {dom.code: hours_since(dom.last_op) for dom in self._repo.all_dominions()}
-        self._cache[cache_key] = result
-        return result
+        return self._cache.get_or_compute(
+            'ratio_list', lambda: build_ratio_list_vm(list(self._repo.all_dominions())), (OPS, SEARCH),
+            lambda rows, dom_codes: self._patched_rows(rows, dom_codes, build_ratio_list_vm(self._dominions(dom_codes)),
+                                                       lambda row: row.spa or 0))
+
+    def all_doms_ops_age(self) -> dict[int, int]:
+        """Hours since the last op of each dominion."""
+        # The ages change with the clock, only the timestamps of the last ops change with new ops
+        last_ops = self._cache.get_or_compute(
+            'all_doms_last_op', lambda: {dom.code: dom.last_op for dom in self._repo.all_dominions()},
+            (OPS, ), lambda last_ops, dom_codes: last_ops | {dom.code: dom.last_op
+                                                             for dom in self._dominions(dom_codes)})
+        return {code: hours_since(last_op) for code, last_op in last_ops.items()}
 
     def military_list(self, versus_op=0, top=20, include_current_strength=False):
         """Get military overview for top dominions."""
-        cache_key = f'military_list_{versus_op}_{top}_{include_current_strength}'
-        if cache_key in self._cache:
-            logger.debug("Returning cached military_list for %s", cache_key)
-            return self._cache[cache_key]
-
-        current_day = self.current_tick.day
-        result_list = self._military_service.military_list(
-            current_day, versus_op, top, include_current_strength)
-        self._cache[cache_key] = result_list
-        return result_list
+        # One cached table per list; other enemy OPs are evaluated from its safe OP curves.
+        # Paid strength and what is in training count down every tick.
+        table = self._cache.get_or_compute(
+            f'military_table_{top}_{include_current_strength}_{self._tick_key()}',
+            lambda: self._military_service.military_table(self.current_tick.day, top, include_current_strength),
+            (OPS, SEARCH),
+            lambda table, dom_codes: self._military_service.patch_military_table(table, self._dominions(dom_codes)))
+        return table.versus(versus_op)
+
+    def _dominions(self, dom_codes) -> list[Dominion]:
+        return [dom for dom in (self._repo.get_dominion(code) for code in sorted(dom_codes)) if dom]
+
+    @staticmethod
+    def _patched_rows(rows: list, dom_codes: set[int], new_rows: list, sort_key) -> list:
+        """A cached list with the rows of some dominions replaced, in the order of the list."""
+        return sorted([row for row in rows if row.code not in dom_codes] + new_rows, key=sort_key, reverse=True)
 
     def top_op(self, mil_calc_result: list):
         """Find the dominion with highest 5/4 OP from a military list."""
@@ -201,6 +263,11 @@ class ODInfoFacade(object):
         """Get 12-tick strength forecast for a single dominion."""
         return self._military_service.strength_forecast(dom)
 
+    def strength_distribution(self, dom: Dominion) -> StrengthDistribution | None:
+        """Get the sampled current OP/DP distribution for a single dominion."""
+        # Seeded per dominion, so that reloading the page shows the same numbers
+        return self._military_service.strength_distribution(dom, seed=dom.code)
+
     def realmie_codes(self) -> list[int]:
         logger.debug("Getting Realmies")
         return [dom.code for dom in self.realmies()]
@@ -215,10 +282,14 @@ class ODInfoFacade(object):
         return self._military_service.realmies_with_blops_info(self.realmies(), current_day)
 
     def stealables(self) -> list:
-        logger.debug("Listing stealables")
-        since = add_duration(current_od_time(as_str=True), -12, True)
-        result = query_stealables(self._repo, since, self._repo.get_realm_of_dominion(self._config.current_player_id))
-        return result
+        def compute():
+            logger.debug("Listing stealables")
+            since = add_duration(current_od_time(as_str=True), -12, True)
+            return list(query_stealables(self._repo, since,
+                                         self._repo.get_realm_of_dominion(self._config.current_player_id)))
+
+        # The list covers the last 12 hours, so it changes every tick
+        return self._cache.get_or_compute(f'stealables_{self._tick_key()}', compute, (OPS, SEARCH))
 
     # ---------------------------------------- QUERIES - Utility
 
@@ -227,6 +298,11 @@ class ODInfoFacade(object):
         logger.debug("Getting name for %s", domcode)
         return self._repo.get_dominion(domcode).name
 
+    @staticmethod
+    def _tick_key() -> str:
+        """Part of the cache key of lists that cover the last hours, and so change every tick."""
+        return truncate_to_tick(current_od_time()).strftime('%Y%m%d%H')
+
     @property
     def current_tick(self):
         soup = get_soup_page(self.od_session, SEARCH_PAGE)
@@ -236,11 +312,38 @@ class ODInfoFacade(object):
 
     def get_unchanged_nw(self, top: int = 50, since: int = 12):
         """Get dominions with unchanged networth."""
-        return self._report_service.get_unchanged_nw(top, since=since)
+        return self._cache.get_or_compute(f'unchanged_nw_{top}_{since}_{self._tick_key()}',
+                                          lambda: self._report_service.get_unchanged_nw(top, since=since),
+                                          (SEARCH, DOMINIONS))
 
     def get_top_bot_nw(self, top=True, filter_zeroes=False, since: int = 12):
         """Get top or bottom networth changers."""
-        return self._report_service.get_top_bot_nw(top, filter_zeroes, since=since)
+        return self._cache.get_or_compute(f'top_bot_nw_{top}_{filter_zeroes}_{since}_{self._tick_key()}',
+                                          lambda: self._report_service.get_top_bot_nw(top, filter_zeroes, since=since),
+                                          (SEARCH, DOMINIONS))
+
+    # ---------------------------------------- COMMANDS - Cache
+
+    def warm_up_cache(self) -> float:
+        """
+        Compute the lists of the main pages with their default parameters into the cache.
+
+        Meant to run right after an update, with a shared cache, so that the first page loads after a
+        tick are cache hits. Returns the duration in seconds.
+        """
+        start = time.monotonic()
+        self.dom_list()
+        self.military_list(top=1000)
+        self.ratio_list()
+        self.all_doms_ops_age()
+        self.stealables()
+        for hours in NW_TRACKER_WINDOWS:
+            self.get_top_bot_nw(filter_zeroes=True, since=hours)
+            self.get_top_bot_nw(top=False, filter_zeroes=True, since=hours)
+            self.get_unchanged_nw(since=hours)
+        duration = time.monotonic() - start
+        logger.debug("Cache warmed up in %.1f seconds (%d entries)", duration, len(self._cache))
+        return duration
 
     def award_stats(self):
         # self.update_town_crier()
@@ -248,18 +351,39 @@ class ODInfoFacade(object):
 
     # ---------------------------------------- COMMANDS - Database Maintenance
 
-    def cleanup_old_ops(self, hours: int = 72) -> dict[str, int]:
+    def cleanup_old_ops(self, cleanup: CleanupService, hours: int = OPS_RETENTION_HOURS,
+                        enable_incremental_vacuum: bool = False) -> CleanupProgress:
         """
-        Delete ops older than specified hours.
+        Delete ops older than specified hours, in chunks, and reclaim the freed space.
 
         Preserves DominionHistory (for graphs) and TownCrier.
-        Returns dict of table name -> deleted row count.
+        Returns the final progress, with the deleted row count per table.
         """
         cutoff = add_duration(current_od_time(as_str=True), -hours, True)
         logger.info(f"Cleaning up ops older than {cutoff} ({hours} hours)")
-        deleted = self._repo.cleanup_old_ops(cutoff)
-        self.clear_cache()
-        return deleted
+        return cleanup.run(self._repo, cutoff, enable_incremental_vacuum, on_done=self._ops_cleaned_up)
+
+    def start_cleanup_old_ops(self, cleanup: CleanupService, hours: int = OPS_RETENTION_HOURS,
+                              enable_incremental_vacuum: bool = False) -> bool:
+        """
+        Start deleting ops older than specified hours in the background.
+
+        Progress can be followed through cleanup.progress.
+        Returns False if a cleanup is already running.
+        """
+        cutoff = add_duration(current_od_time(as_str=True), -hours, True)
+        engine = self._repo.session.get_bind()
+        started = cleanup.start(lambda: GameRepository(Session(bind=engine)), cutoff,
+                                enable_incremental_vacuum, on_done=self._ops_cleaned_up)
+        if started:
+            logger.info(f"Started background cleanup of ops older than {cutoff} ({hours} hours)")
+        return started
+
+    def _ops_cleaned_up(self, dom_codes: set[int]):
+        """Called by CleanupService when it deleted ops, possibly on its worker thread."""
+        # Only dominions that lost their latest op of a type look different in the lists
+        if dom_codes:
+            self.invalidate_cache(OPS, sorted(dom_codes))
 
     def get_ops_counts(self) -> dict[str, int]:
         """Get current row counts for all ops tables."""
@@ -0,0 +1,147 @@
+"""
+Minimal SVG line charts over time, without dependencies.
+
+Enough for the land/networth graphs: a time axis and a value axis with round tick values, one or
+more series, and min/max downsampling of long series so that the SVG stays small while peaks and
+dips stay visible.
+"""
+
+import math
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+# Longest series that is drawn point by point, longer ones are downsampled
+MAX_POINTS = 400
+COLORS = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd')
+# Steps between time ticks to choose from, and the label format for each
+TIME_STEPS = (
+    (timedelta(hours=1), '%m-%d %H:%M'),
+    (timedelta(hours=2), '%m-%d %H:%M'),
+    (timedelta(hours=3), '%m-%d %H:%M'),
+    (timedelta(hours=6), '%m-%d %H:%M'),
+    (timedelta(hours=12), '%m-%d %H:%M'),
+    (timedelta(days=1), '%Y-%m-%d'),
+    (timedelta(days=2), '%Y-%m-%d'),
+    (timedelta(days=7), '%Y-%m-%d'),
+    (timedelta(days=14), '%Y-%m-%d'),
+    (timedelta(days=28), '%Y-%m-%d'),
+)
+# Margins around the plot area: left (value labels), right, top (title), bottom (time labels)
+MARGINS = (70, 20, 40, 80)
+
+
+@dataclass
+class Series:
+    name: str
+    points: list[tuple[datetime, float]]  # in time order
+
+
+def downsample(points: list[tuple[datetime, float]], max_points: int = MAX_POINTS) -> list[tuple[datetime, float]]:
+    """At most max_points of the points: the lowest and highest point of every bucket, in time order."""
+    if len(points) <= max_points:
+        return points
+    buckets = max(1, max_points // 2)
+    size = len(points) / buckets
+    result = []
+    for nr in range(buckets):
+        bucket = points[int(nr * size):int((nr + 1) * size)]
+        if not bucket:
+            continue
+        lowest = min(bucket, key=lambda point: point[1])
+        highest = max(bucket, key=lambda point: point[1])
+        result.extend(sorted({lowest, highest}))
+    return result
+
+
+def nice_ticks(low: float, high: float, count: int = 6) -> list[float]:
+    """About count round values from low (or just below) to high (or just above)."""
+    if high <= low:
+        low, high = low - 1, high + 1
+    raw_step = (high - low) / max(1, count - 1)
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(factor * magnitude for factor in (1, 2, 2.5, 5, 10) if factor * magnitude >= raw_step)
+    first = math.floor(low / step) * step
+    last = math.ceil(high / step) * step
+    return [first + nr * step for nr in range(round((last - first) / step) + 1)]
+
+
+def time_ticks(start: datetime, end: datetime, count: int = 8) -> tuple[list[datetime], str]:
+    """At most about count round times between start and end, and the format for their labels."""
+    span = end - start
+    step, fmt = next(((step, fmt) for step, fmt in TIME_STEPS if span / step <= count), TIME_STEPS[-1])
+    if step < timedelta(days=1):
+        tick = start.replace(minute=0, second=0, microsecond=0)
+        hours = int(step.total_seconds() // 3600)
+        tick -= timedelta(hours=tick.hour % hours)
+    else:
+        tick = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    ticks = []
+    while tick <= end:
+        if tick >= start:
+            ticks.append(tick)
+        tick += step
+    return ticks, fmt
+
+
+def format_value(value: float) -> str:
+    if abs(value) >= 10_000_000:
+        return f'{value / 1_000_000:g}M'
+    if abs(value) >= 10_000:
+        return f'{value / 1_000:g}k'
+    return f'{value:g}'
+
+
+def line_chart(series: list[Series], title: str = '', width: int = 640, height: int = 480,
+               max_points: int = MAX_POINTS) -> str:
+    """SVG document with a line per series, on a shared time axis and value axis."""
+    left, right, top, bottom = MARGINS
+    plot_width, plot_height = width - left - right, height - top - bottom
+    drawn = [Series(s.name, downsample(s.points, max_points)) for s in series]
+    points = [point for s in drawn for point in s.points]
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="0 0 {width} {height}" font-family="sans-serif" font-size="11">',
+             f'<rect width="{width}" height="{height}" fill="white"/>',
+             f'<text x="{width / 2}" y="{top / 2 + 6}" text-anchor="middle" font-size="15">{escape(title)}</text>']
+    if not points:
+        parts.append(f'<text x="{width / 2}" y="{height / 2}" text-anchor="middle">No data</text>')
+        parts.append('</svg>')
+        return '\n'.join(parts)
+
+    start, end = min(t for t, _ in points), max(t for t, _ in points)
+    if end == start:
+        start, end = start - timedelta(hours=1), end + timedelta(hours=1)
+    values = nice_ticks(min(v for _, v in points), max(v for _, v in points))
+    low, high = values[0], values[-1]
+
+    def x(t: datetime) -> float:
+        return round(left + (t - start) / (end - start) * plot_width, 1)
+
+    def y(v: float) -> float:
+        return round(top + (high - v) / (high - low) * plot_height, 1)
+
+    for value in values:
+        parts.append(f'<line x1="{left}" x2="{left + plot_width}" y1="{y(value)}" y2="{y(value)}" stroke="#e0e0e0"/>')
+        parts.append(f'<text x="{left - 6}" y="{y(value) + 4}" text-anchor="end">{format_value(value)}</text>')
+    ticks, fmt = time_ticks(start, end)
+    label_y = top + plot_height + 12
+    for tick in ticks:
+        parts.append(f'<line x1="{x(tick)}" x2="{x(tick)}" y1="{top + plot_height}" y2="{top + plot_height + 4}" '
+                     f'stroke="black"/>')
+        parts.append(f'<text x="{x(tick)}" y="{label_y}" text-anchor="end" '
+                     f'transform="rotate(-30 {x(tick)} {label_y})">{tick.strftime(fmt)}</text>')
+    parts.append(f'<rect x="{left}" y="{top}" width="{plot_width}" height="{plot_height}" fill="none" '
+                 f'stroke="black"/>')
+
+    for nr, s in enumerate(drawn):
+        color = COLORS[nr % len(COLORS)]
+        coordinates = ' '.join(f'{x(t)},{y(v)}' for t, v in s.points)
+        parts.append(f'<polyline points="{coordinates}" fill="none" stroke="{color}" stroke-width="1.5"/>')
+        if len(drawn) > 1:
+            legend_y = top + 14 + nr * 14
+            parts.append(f'<line x1="{left + 8}" x2="{left + 24}" y1="{legend_y - 4}" y2="{legend_y - 4}" '
+                         f'stroke="{color}" stroke-width="2"/>')
+            parts.append(f'<text x="{left + 28}" y="{legend_y}">{escape(s.name)}</text>')
+    parts.append('</svg>')
+    return '\n'.join(parts)
@@ -0,0 +1,4 @@
+/* Run-length compressed DominionHistory: last sample time at which land and networth were still unchanged */
+ALTER TABLE DominionHistory ADD COLUMN last_seen DATETIME;
+
+INSERT INTO SchemaVersion (timestamp, version) VALUES (DATETIME('now'), '1.3');
@@ -0,0 +1,35 @@
+/* Normalized queue ticks of training, returning, incoming land and constructing buildings */
+CREATE TABLE IF NOT EXISTS QueueTick (
+    dominion INTEGER NOT NULL REFERENCES Dominions,
+    timestamp DATETIME NOT NULL,
+    queue VARCHAR(20) NOT NULL,
+    unit VARCHAR(40) NOT NULL,
+    tick INTEGER NOT NULL,
+    amount INTEGER,
+    PRIMARY KEY (dominion, timestamp, queue, unit, tick)
+);
+
+CREATE INDEX IF NOT EXISTS idx_QueueTick_dom_queue_ts ON QueueTick (dominion, queue, timestamp);
+
+/* Backfill from the JSON queues of the ops already in the database, zero amounts included */
+INSERT OR IGNORE INTO QueueTick (dominion, timestamp, queue, unit, tick, amount)
+SELECT b.dominion, b.timestamp, 'training', u.key, CAST(t.key AS INTEGER), t.value
+FROM BarracksSpy b, json_each(b.training) u, json_each(u.value) t
+WHERE json_valid(b.training) AND u.type = 'object';
+
+INSERT OR IGNORE INTO QueueTick (dominion, timestamp, queue, unit, tick, amount)
+SELECT b.dominion, b.timestamp, 'returning', u.key, CAST(t.key AS INTEGER), t.value
+FROM BarracksSpy b, json_each(b."return") u, json_each(u.value) t
+WHERE json_valid(b."return") AND u.type = 'object';
+
+INSERT OR IGNORE INTO QueueTick (dominion, timestamp, queue, unit, tick, amount)
+SELECT l.dominion, l.timestamp, 'incoming', u.key, CAST(t.key AS INTEGER), t.value
+FROM LandSpy l, json_each(l.incoming) u, json_each(u.value) t
+WHERE json_valid(l.incoming) AND u.type = 'object';
+
+INSERT OR IGNORE INTO QueueTick (dominion, timestamp, queue, unit, tick, amount)
+SELECT s.dominion, s.timestamp, 'constructing', u.key, CAST(t.key AS INTEGER), t.value
+FROM SurveyDominion s, json_each(s.constructing) u, json_each(u.value) t
+WHERE json_valid(s.constructing) AND u.type = 'object';
+
+INSERT INTO SchemaVersion (timestamp, version) VALUES (DATETIME('now'), '1.4');
@@ -11,7 +11,7 @@ from odinfo.timeutils import cleanup_timestamp
 from odinfo.domain.models import Dominion, DominionHistory, TownCrier
 from odinfo.facade.towncrier import get_number_of_tc_pages, get_tc_page
 from odinfo.domain.models import (ClearSight, CastleSpy, BarracksSpy,
-                                  SurveyDominion, LandSpy, Vision, Revelation)
+                                  SurveyDominion, LandSpy, Vision, Revelation, QueueTick)
 from odinfo.repositories.game import GameRepository
 
 logger = logging.getLogger('od-info.updater')
@@ -19,8 +19,12 @@ logger = logging.getLogger('od-info.updater')
 # ---------------------------------------------------------------------- Updaters Ops => DB
 
 
-def update_dom_index(od_session, repo: GameRepository):
-    """Update the dominion index from OpenDominion search page."""
+def update_dom_index(od_session, repo: GameRepository, compress_history: bool = False):
+    """Update the dominion index from OpenDominion search page.
+
+    With compress_history, land/networth samples that didn't change since the previous one
+    only extend that sample's last_seen marker instead of adding a new DominionHistory row.
+    """
     doms = {d.code: d for d in repo.all_dominions()}
     new_doms = []
     new_history = []
@@ -42,8 +46,7 @@ def update_dom_index(od_session, repo: GameRepository):
     with repo.transaction():
         for dom in new_doms:
             repo.session.add(dom)
-        for dh in new_history:
-            repo.session.add(dh)
+    repo.add_history(new_history, compress=compress_history)
 
 
 def update_obj(ops, obj, mapping):
@@ -95,6 +98,7 @@ def update_ops(ops, repo: GameRepository, dom_code):
             obj = BarracksSpy(dominion_id=dom_code, timestamp=timestamp)
             update_obj(ops, obj, BARRACKS_SPY_MAPPING)
             session.add(obj)
+            session.add_all(QueueTick.from_op(obj))
             dom.add_last_op(timestamp)
         else:
             logger.debug(f"Already had Barracks Spy for {dom_code} at {timestamp}")
@@ -104,6 +108,7 @@ def update_ops(ops, repo: GameRepository, dom_code):
             obj = SurveyDominion(dominion_id=dom_code, timestamp=timestamp)
             update_obj(ops, obj, SURVEY_DOMINION_MAPPING)
             session.add(obj)
+            session.add_all(QueueTick.from_op(obj))
             dom.add_last_op(timestamp)
         else:
             logger.debug(f"Already had SurveyDominion for {dom_code} at {timestamp}")
@@ -113,6 +118,7 @@ def update_ops(ops, repo: GameRepository, dom_code):
             obj = LandSpy(dominion_id=dom_code, timestamp=timestamp)
             update_obj(ops, obj, LAND_SPY_MAPPING)
             session.add(obj)
+            session.add_all(QueueTick.from_op(obj))
             dom.add_last_op(timestamp)
         else:
             logger.debug(f"Already had LandSpy for {dom_code} at {timestamp}")
@@ -164,6 +170,7 @@ def update_barracks_archive(od_session, repo: GameRepository, dom_code: int) ->
                 returning=entry['returning'],
             )
             session.add(bs)
+            session.add_all(QueueTick.from_op(bs))
             dom.add_last_op(timestamp)
             added += 1
 
@@ -250,6 +257,8 @@ select
     max(c.timestamp),
     c.dominion,
     d.name,
+    d.realm,
+    d.race,
     c.land,
     c.resource_platinum as platinum,
     c.resource_food as food,
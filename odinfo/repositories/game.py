@@ -6,22 +6,65 @@ hiding SQLAlchemy details from the rest of the application.
 """
 
 import logging
+import time
+from math import ceil
 from contextlib import contextmanager
-from typing import Iterator
+from typing import Callable, Iterable, Iterator
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from sqlalchemy import select, func, update, delete
+from sqlalchemy import select, func, update, delete, and_, or_, literal_column
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 
 from odinfo.domain.models import (
-    Dominion, TownCrier, ClearSight, BarracksSpy, CastleSpy,
-    LandSpy, SurveyDominion, Vision, Revelation
+    Dominion, DominionHistory, DominionHistoryRollup, TownCrier, ClearSight,
+    BarracksSpy, CastleSpy, LandSpy, SurveyDominion, Vision, Revelation, QueueTick, MilitaryResult
 )
+from odinfo.timeutils import current_od_time, truncate_to_bucket, hours_since
 
 
 logger = logging.getLogger('od-info.repository')
 
+# Rollup resolutions (hours per bucket) maintained for DominionHistory, finest first.
+HISTORY_ROLLUP_RESOLUTIONS = (6, 24)
+# Time spans up to this many hours are served from the raw hourly DominionHistory.
+RAW_HISTORY_HOURS = 7 * 24
+# Time spans up to this many hours are served from the 6-hour rollup, longer ones from the daily one.
+SIX_HOUR_HISTORY_HOURS = 60 * 24
+
+# Tables removed by cleanup_old_ops; DominionHistory and TownCrier are kept.
+OPS_TABLES = (ClearSight, BarracksSpy, CastleSpy, LandSpy, SurveyDominion, Vision, Revelation, QueueTick)
+
+# Values of SQLite's PRAGMA auto_vacuum.
+SQLITE_AUTO_VACUUM_NONE = 0
+SQLITE_AUTO_VACUUM_INCREMENTAL = 2
+
+
+def history_resolution_for_span(hours: float) -> int:
+    """Hours per sample to use for a history query covering the given time span (1 means raw)."""
+    if hours <= RAW_HISTORY_HOURS:
+        return 1
+    elif hours <= SIX_HOUR_HISTORY_HOURS:
+        return 6
+    else:
+        return 24
+
+
+def _expand_compressed_sample(row) -> list:
+    """Hourly samples represented by one (possibly run-length compressed) DominionHistory row."""
+    if not row.last_seen or row.last_seen <= row.timestamp:
+        return [row]
+    samples = []
+    timestamp = row.timestamp
+    while timestamp < row.last_seen:
+        samples.append(DominionHistory(dominion_id=row.dominion_id, timestamp=timestamp,
+                                       land=row.land, networth=row.networth))
+        timestamp += timedelta(hours=1)
+    samples.append(DominionHistory(dominion_id=row.dominion_id, timestamp=row.last_seen,
+                                   land=row.land, networth=row.networth))
+    return samples
+
 
 class GameRepository:
     """
@@ -114,6 +157,284 @@ class GameRepository:
                 update(Dominion).where(Dominion.code == dom_id).values(player=player_name)
             )
 
+    # ----------------------------- DominionHistory queries
+
+    def add_history(self, history: list[DominionHistory], compress: bool = False) -> None:
+        """
+        Add DominionHistory samples and fold them into the rollup tables (auto-commits).
+
+        With compress, a sample with the same land and networth as the latest stored sample of its
+        dominion is not stored: the latest sample's last_seen marker is moved forward instead.
+        """
+        with self.transaction():
+            if compress:
+                latest = self.latest_history_by_dominion()
+                stored = []
+                for dh in history:
+                    previous = latest.get(dh.dominion_id)
+                    if (previous is not None
+                            and previous.land == dh.land
+                            and previous.networth == dh.networth
+                            and dh.timestamp > previous.timestamp):
+                        previous.last_seen = max(previous.seen_until, dh.timestamp)
+                    else:
+                        stored.append(dh)
+                        latest[dh.dominion_id] = dh
+                logger.debug(f"Storing {len(stored)} of {len(history)} history samples")
+            else:
+                stored = history
+            self._session.add_all(stored)
+            self._update_history_rollups(history)
+
+    def latest_history_by_dominion(self) -> dict[int, DominionHistory]:
+        """The most recent DominionHistory row of every dominion, in one query."""
+        latest_subq = select(
+            DominionHistory.dominion_id,
+            func.max(DominionHistory.timestamp).label('max_timestamp')
+        ).group_by(DominionHistory.dominion_id).subquery()
+        rows = self._session.execute(
+            select(DominionHistory).join(
+                latest_subq,
+                and_(DominionHistory.dominion_id == latest_subq.c.dominion_id,
+                     DominionHistory.timestamp == latest_subq.c.max_timestamp)
+            )
+        ).scalars()
+        return {dh.dominion_id: dh for dh in rows}
+
+    def latest_history_timestamp(self, dom_id: int) -> datetime | None:
+        """When the latest history of a dominion was seen, None if it has no history."""
+        return self._session.execute(
+            select(func.max(func.coalesce(DominionHistory.last_seen, DominionHistory.timestamp)))
+            .where(DominionHistory.dominion_id == dom_id)
+        ).scalar()
+
+    def _update_history_rollups(self, history: list) -> None:
+        """Fold samples into the rollups. Loads all affected buckets in one query per resolution."""
+        for resolution in HISTORY_ROLLUP_RESOLUTIONS:
+            buckets = {truncate_to_bucket(dh.timestamp, resolution) for dh in history}
+            if not buckets:
+                continue
+            existing = {
+                (r.dominion_id, r.timestamp): r for r in self._session.execute(
+                    select(DominionHistoryRollup)
+                    .where(DominionHistoryRollup.resolution == resolution)
+                    .where(DominionHistoryRollup.timestamp.in_(buckets))
+                ).scalars()
+            }
+            for dh in history:
+                bucket = truncate_to_bucket(dh.timestamp, resolution)
+                rollup = existing.get((dh.dominion_id, bucket))
+                if rollup is None:
+                    rollup = DominionHistoryRollup(dominion_id=dh.dominion_id, resolution=resolution,
+                                                   timestamp=bucket, samples=0)
+                    self._session.add(rollup)
+                    existing[(dh.dominion_id, bucket)] = rollup
+                rollup.add_sample(dh.timestamp, dh.land, dh.networth)
+
+    def rebuild_history_rollups(self, batch_size: int = 10000) -> int:
+        """
+        Recompute all rollups from the raw DominionHistory. Returns the number of samples processed.
+
+        The history is read in chunks of at most batch_size rows, in (dominion, timestamp) order along
+        the index, and each chunk is rolled up in its own transaction, so that the whole table is never
+        in memory at once.
+        """
+        with self.transaction():
+            self._session.execute(delete(DominionHistoryRollup))
+        processed = 0
+        last = None
+        while True:
+            query = (select(DominionHistory.dominion_id, DominionHistory.timestamp, DominionHistory.last_seen,
+                            DominionHistory.land, DominionHistory.networth)
+                     .order_by(DominionHistory.dominion_id, DominionHistory.timestamp)
+                     .limit(batch_size))
+            if last:
+                query = query.where(or_(DominionHistory.dominion_id > last.dominion_id,
+                                        and_(DominionHistory.dominion_id == last.dominion_id,
+                                             DominionHistory.timestamp > last.timestamp)))
+            rows = self._session.execute(query).all()
+            if not rows:
+                break
+            batch = [sample for row in rows for sample in _expand_compressed_sample(row)]
+            with self.transaction():
+                self._update_history_rollups(batch)
+            processed += len(batch)
+            last = rows[-1]
+        logger.info(f"Rebuilt history rollups from {processed} samples")
+        return processed
+
+    def has_history_rollups(self) -> bool:
+        """True if the rollups are populated, or there is no history to roll up."""
+        has_rollup = self._session.execute(select(DominionHistoryRollup.dominion_id).limit(1)).first()
+        if has_rollup:
+            return True
+        return self._session.execute(select(DominionHistory.dominion_id).limit(1)).first() is None
+
+    def get_history(self, dom_id: int, hours: int | None = None) -> list:
+        """
+        Land/networth history of a dominion, newest first.
+
+        Picks the resolution from the requested time span (the whole recorded history if hours
+        is None): raw hourly samples for short spans, 6-hour or daily rollups for longer ones.
+        Every returned row has timestamp, land and networth attributes.
+        """
+        now = current_od_time()
+        if hours is None:
+            first = self._session.execute(
+                select(func.min(DominionHistory.timestamp)).where(DominionHistory.dominion_id == dom_id)
+            ).scalar()
+            since = first if first else now
+        else:
+            since = now - timedelta(hours=hours)
+        resolution = history_resolution_for_span((now - since) / timedelta(hours=1))
+        logger.debug(f"History for {dom_id} since {since} at resolution {resolution}h")
+        if resolution == 1:
+            rows = self._session.execute(
+                select(DominionHistory)
+                .where(DominionHistory.dominion_id == dom_id)
+                .where(or_(DominionHistory.timestamp >= since, DominionHistory.last_seen >= since))
+                .order_by(DominionHistory.timestamp.desc())
+            ).scalars()
+            result = []
+            for dh in rows:
+                # A compressed run ends with a sample at last_seen carrying the same values.
+                if dh.last_seen and dh.last_seen > dh.timestamp:
+                    result.append(DominionHistory(dominion_id=dh.dominion_id, timestamp=dh.last_seen,
+                                                  land=dh.land, networth=dh.networth))
+                if dh.timestamp >= since:
+                    result.append(dh)
+                else:
+                    # The run started before the window: its first sample inside the window.
+                    first_in_window = dh.timestamp + timedelta(hours=ceil((since - dh.timestamp) / timedelta(hours=1)))
+                    if first_in_window < dh.last_seen:
+                        result.append(DominionHistory(dominion_id=dh.dominion_id, timestamp=first_in_window,
+                                                      land=dh.land, networth=dh.networth))
+            return result
+        return list(self._session.execute(
+            select(DominionHistoryRollup)
+            .where(DominionHistoryRollup.dominion_id == dom_id)
+            .where(DominionHistoryRollup.resolution == resolution)
+            .where(DominionHistoryRollup.timestamp >= truncate_to_bucket(since, resolution))
+            .order_by(DominionHistoryRollup.timestamp.desc())
+        ).scalars())
+
+    # ----------------------------- BarracksSpy queries
+
+    def barracks_spies_in_latest_tick(self, dom_ids: Iterable[int] | None = None,
+                                      window_ticks: int = 0) -> dict[int, list[BarracksSpy]]:
+        """
+        The BarracksSpy ops in the tick of each dominion's latest BarracksSpy, newest first, in one query.
+
+        Args:
+            dom_ids: Dominions to get the ops of, all dominions if None.
+            window_ticks: Also get the ops of this many ticks before the latest tick.
+
+        Returns:
+            Dict of dominion code -> list of BarracksSpy, for dominions with at least one.
+        """
+        latest_bs = select(
+            BarracksSpy.dominion_id,
+            func.max(BarracksSpy.timestamp).label('max_timestamp')
+        ).group_by(BarracksSpy.dominion_id)
+        if dom_ids is not None:
+            latest_bs = latest_bs.where(BarracksSpy.dominion_id.in_(list(dom_ids)))
+        latest_bs = latest_bs.subquery()
+
+        # SQLite stores the timestamps as text, their tick is the date and the hour
+        def tick_of(timestamp, *modifiers):
+            return func.strftime('%Y-%m-%d %H', timestamp, *modifiers)
+
+        result = {}
+        for bs in self._session.execute(
+            select(BarracksSpy)
+            .join(latest_bs, and_(BarracksSpy.dominion_id == latest_bs.c.dominion_id,
+                                  tick_of(BarracksSpy.timestamp) >= tick_of(latest_bs.c.max_timestamp,
+                                                                            f'-{window_ticks} hours')))
+            .order_by(BarracksSpy.dominion_id, BarracksSpy.timestamp.desc())
+        ).scalars():
+            result.setdefault(bs.dominion_id, []).append(bs)
+        return result
+
+    # ----------------------------- Queue tick queries
+
+    def queue_arrays(self, dom_id: int, timestamp: datetime, queue: str) -> dict[str, list[int]]:
+        """A queue of one op as {unit: [amount arriving at tick 0, 1, ...]}."""
+        result = {}
+        rows = self._session.execute(
+            select(QueueTick.unit, QueueTick.tick, QueueTick.amount)
+            .where(QueueTick.dominion_id == dom_id)
+            .where(QueueTick.queue == queue)
+            .where(QueueTick.timestamp == timestamp)
+        ).all()
+        for row in rows:
+            amounts = result.setdefault(row.unit, [])
+            if len(amounts) <= row.tick:
+                amounts.extend([0] * (row.tick + 1 - len(amounts)))
+            amounts[row.tick] += row.amount
+        return result
+
+    def arrived_amounts(self, dom_id: int, timestamp: datetime, queue: str, elapsed: int) -> dict[str, int]:
+        """Per unit, the amount of a queue of one op that has arrived after elapsed ticks."""
+        rows = self._session.execute(
+            select(QueueTick.unit, func.sum(QueueTick.amount).label('amount'))
+            .where(QueueTick.dominion_id == dom_id)
+            .where(QueueTick.queue == queue)
+            .where(QueueTick.timestamp == timestamp)
+            .where(QueueTick.tick <= elapsed)
+            .group_by(QueueTick.unit)
+        ).all()
+        return {row.unit: row.amount for row in rows}
+
+    def paid_until_by_dominion(self, dom_ids: Iterable[int] | None = None) -> dict[int, int]:
+        """
+        Ticks until the training queue of each dominion's latest BarracksSpy is done, in one query.
+
+        Args:
+            dom_ids: Dominions to look up, None for all. Dominions without a BarracksSpy are left out;
+                those with an empty training queue are paid (0).
+        """
+        latest_bs = select(
+            BarracksSpy.dominion_id,
+            func.max(BarracksSpy.timestamp).label('max_timestamp')
+        ).group_by(BarracksSpy.dominion_id)
+        if dom_ids is not None:
+            latest_bs = latest_bs.where(BarracksSpy.dominion_id.in_(list(dom_ids)))
+        latest_bs = latest_bs.subquery()
+        rows = self._session.execute(
+            select(latest_bs.c.dominion_id, latest_bs.c.max_timestamp, func.max(QueueTick.tick).label('max_tick'))
+            .outerjoin(QueueTick, and_(QueueTick.dominion_id == latest_bs.c.dominion_id,
+                                       QueueTick.queue == 'training',
+                                       QueueTick.timestamp == latest_bs.c.max_timestamp,
+                                       QueueTick.unit.in_([f'unit{i}' for i in range(1, 5)])))
+            .group_by(latest_bs.c.dominion_id, latest_bs.c.max_timestamp)
+        ).all()
+        return {row.dominion_id: max(0, (row.max_tick or 0) - hours_since(row.max_timestamp)) for row in rows}
+
+    # ----------------------------- MilitaryResult queries
+
+    def military_results(self, dom_ids: Iterable[int]) -> dict[int, MilitaryResult]:
+        """The stored military results of the given dominions, by dominion code."""
+        return {result.dominion_id: result for result in self._session.execute(
+            select(MilitaryResult).where(MilitaryResult.dominion_id.in_(list(dom_ids)))
+        ).scalars()}
+
+    def save_military_results(self, results: list[MilitaryResult]) -> None:
+        """
+        Store military results, replacing the previous result of each dominion.
+
+        Uses an upsert, so that workers storing the same dominion at the same time don't conflict.
+        """
+        if not results:
+            return
+        attributes = {attribute.columns[0].name: attribute.key for attribute in MilitaryResult.__mapper__.column_attrs}
+        rows = [{column: getattr(result, key) for column, key in attributes.items()} for result in results]
+        statement = sqlite_insert(MilitaryResult.__table__)
+        with self.transaction():
+            self._session.execute(statement.on_conflict_do_update(
+                index_elements=['dominion'],
+                set_={column: statement.excluded[column] for column in attributes if column != 'dominion'}
+            ), rows)
+
     # ----------------------------- TownCrier queries
 
     def all_town_crier_events(self) -> Iterator[TownCrier]:
@@ -147,51 +468,99 @@ class GameRepository:
 
     # ----------------------------- Ops cleanup
 
-    def cleanup_old_ops(self, cutoff_time: datetime) -> dict[str, int]:
+    def dominions_losing_latest_ops(self, cutoff_time: datetime) -> set[int]:
+        """
+        Codes of the dominions of which cleanup_old_ops(cutoff_time) deletes the latest op of a type.
+
+        The cached lists are built from the latest ops of each type, so only these dominions change.
+        """
+        dom_codes = set()
+        for table in OPS_TABLES:
+            newer = select(table.dominion_id).where(table.timestamp >= cutoff_time)
+            dom_codes.update(self._session.scalars(
+                select(table.dominion_id).distinct()
+                .where(table.timestamp < cutoff_time)
+                .where(table.dominion_id.not_in(newer))
+            ))
+        return dom_codes
+
+    def cleanup_old_ops(self, cutoff_time: datetime, chunk_size: int = 5000, pause: float = 0.0,
+                        progress: Callable[[str, int], None] | None = None) -> dict[str, int]:
         """
         Delete ops entries older than cutoff_time.
 
+        Rows are deleted in chunks of at most chunk_size rows, each in its own transaction,
+        sleeping pause seconds between chunks so that writers (updates from the web app or cron)
+        never wait long for the database lock. progress, when given, is called with the table
+        name and the number of rows deleted from it so far after every chunk.
+
         Preserves DominionHistory (for land/networth graphs) and TownCrier.
         Returns a dict mapping table name to number of deleted rows.
         """
-        ops_tables = [
-            ClearSight,
-            BarracksSpy,
-            CastleSpy,
-            LandSpy,
-            SurveyDominion,
-            Vision,
-            Revelation,
-        ]
-
         deleted_counts = {}
-        with self.transaction():
-            for table in ops_tables:
-                result = self._session.execute(
-                    delete(table).where(table.timestamp < cutoff_time)
-                )
-                deleted_counts[table.__tablename__] = result.rowcount
-                logger.info(f"Deleted {result.rowcount} rows from {table.__tablename__}")
+        for table in OPS_TABLES:
+            deleted = 0
+            while True:
+                with self.transaction():
+                    chunk = select(literal_column('rowid')).select_from(table) \
+                        .where(table.timestamp < cutoff_time).limit(chunk_size).scalar_subquery()
+                    rowcount = self._session.execute(
+                        delete(table).where(literal_column('rowid').in_(chunk))
+                    ).rowcount
+                deleted += rowcount
+                if progress:
+                    progress(table.__tablename__, deleted)
+                if rowcount < chunk_size:
+                    break
+                if pause:
+                    time.sleep(pause)
+            deleted_counts[table.__tablename__] = deleted
+            logger.info(f"Deleted {deleted} rows from {table.__tablename__}")
 
         return deleted_counts
 
+    def reclaim_space(self, enable_incremental_vacuum: bool = False) -> dict[str, int | str]:
+        """
+        Hand the pages freed by cleanup_old_ops back to the file system (SQLite only).
+
+        Runs PRAGMA incremental_vacuum when the database uses auto_vacuum=INCREMENTAL and
+        truncates the write-ahead log when it is in WAL mode. A database created without
+        incremental auto_vacuum needs a one-time full VACUUM to switch over; that only
+        happens when enable_incremental_vacuum is set, as it locks the database while it runs.
+        Returns the auto_vacuum mode, journal mode and number of freed pages.
+        """
+        engine = self._session.get_bind()
+        if engine.dialect.name != 'sqlite':
+            return {}
+        self._session.commit()
+        with engine.connect() as conn:
+            free_pages = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+            auto_vacuum = conn.exec_driver_sql('PRAGMA auto_vacuum').scalar()
+            if auto_vacuum == SQLITE_AUTO_VACUUM_NONE and enable_incremental_vacuum:
+                logger.info("Switching database to incremental auto_vacuum (full VACUUM)")
+                conn.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.exec_driver_sql('VACUUM')
+                auto_vacuum = conn.exec_driver_sql('PRAGMA auto_vacuum').scalar()
+            elif auto_vacuum == SQLITE_AUTO_VACUUM_INCREMENTAL:
+                # Executed as a script: a plain execute only steps the pragma once, freeing a single page.
+                conn.connection.driver_connection.executescript('PRAGMA incremental_vacuum;')
+            else:
+                logger.info("Database does not use incremental auto_vacuum, %d free pages kept", free_pages)
+            journal_mode = conn.exec_driver_sql('PRAGMA journal_mode').scalar()
+            if journal_mode == 'wal':
+                conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+            freed = free_pages - conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+
+        logger.info(f"Reclaimed {freed} pages (auto_vacuum={auto_vacuum}, journal_mode={journal_mode})")
+        return {'auto_vacuum': auto_vacuum, 'journal_mode': journal_mode, 'freed_pages': freed}
+
     def count_ops(self) -> dict[str, int]:
         """Count rows in each ops table."""
-        ops_tables = [
-            ClearSight,
-            BarracksSpy,
-            CastleSpy,
-            LandSpy,
-            SurveyDominion,
-            Vision,
-            Revelation,
-        ]
-
         counts = {}
-        for table in ops_tables:
+        for table in OPS_TABLES:
             count = self._session.execute(
                 select(func.count()).select_from(table)
             ).scalar()
             counts[table.__tablename__] = count
 
-        return counts
\ No newline at end of file
+        return counts
@@ -0,0 +1,162 @@
+"""
+SQL statement instrumentation for the database engine.
+
+Hooks into the engine's before_cursor_execute/after_cursor_execute events and records, per unit
+of work (a Flask request or a cron job), how many statements were executed, how long they took and
+how often each statement shape was repeated. A shape executed more than n_plus_one_threshold times
+is flagged as a likely N+1 query, typically a lazy relationship loaded in a loop over dominions.
+"""
+
+import logging
+import re
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('od-info.querystats')
+
+# The same statement shape executed more often than this within one unit of work is flagged as N+1.
+N_PLUS_ONE_THRESHOLD = 20
+# Number of finished units of work kept for the debug endpoint.
+RECENT_STATS_KEPT = 50
+
+_QUOTED = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAM_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """Shape of a SQL statement: literals replaced by ?, IN lists collapsed, whitespace normalized."""
+    shape = _QUOTED.sub('?', statement)
+    shape = _NUMBER.sub('?', shape)
+    shape = _PARAM_LIST.sub('(?)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+@dataclass
+class QueryStats:
+    """Statements executed during one unit of work."""
+    label: str
+    started_at: datetime = field(default_factory=datetime.now)
+    count: int = 0
+    total_time: float = 0.0
+    slowest_time: float = 0.0
+    slowest_statement: str = ''
+    shape_counts: Counter = field(default_factory=Counter)
+    shape_times: defaultdict = field(default_factory=lambda: defaultdict(float))
+
+    def record(self, statement: str, duration: float):
+        shape = fingerprint(statement)
+        self.count += 1
+        self.total_time += duration
+        self.shape_counts[shape] += 1
+        self.shape_times[shape] += duration
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = shape
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> list[tuple[str, int]]:
+        """Statement shapes executed more than threshold times, most frequent first."""
+        return [(shape, count) for shape, count in self.shape_counts.most_common() if count > threshold]
+
+    def summary(self, threshold: int = N_PLUS_ONE_THRESHOLD, top: int = 10) -> dict:
+        return {
+            'label': self.label,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'statements': self.count,
+            'distinct_statements': len(self.shape_counts),
+            'total_ms': round(self.total_time * 1000, 1),
+            'slowest_ms': round(self.slowest_time * 1000, 1),
+            'slowest_statement': self.slowest_statement,
+            'top_statements': [
+                {'statement': shape, 'count': count, 'total_ms': round(self.shape_times[shape] * 1000, 1)}
+                for shape, count in self.shape_counts.most_common(top)
+            ],
+            'n_plus_one': [{'statement': shape, 'count': count} for shape, count in self.repeated(threshold)],
+        }
+
+
+class QueryRecorder:
+    """
+    Collects QueryStats for the units of work executed on the engines it is installed on.
+
+    The unit of work being recorded is tracked in a context variable, so concurrent requests on
+    different threads each get their own stats. Statements executed outside a unit of work
+    (e.g. at startup) are not recorded.
+    """
+
+    def __init__(self, n_plus_one_threshold: int = N_PLUS_ONE_THRESHOLD, kept: int = RECENT_STATS_KEPT):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._current: ContextVar[QueryStats | None] = ContextVar('query_stats', default=None)
+        self._recent: deque[QueryStats] = deque(maxlen=kept)
+
+    def install(self, engine: Engine):
+        """Register the cursor execute hooks on the engine."""
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_start_time'].pop()
+        stats = self._current.get()
+        if stats is not None:
+            stats.record(statement, duration)
+
+    def start(self, label: str) -> Token:
+        """Start recording a unit of work, returns the token to pass to finish()."""
+        return self._current.set(QueryStats(label))
+
+    def finish(self, token: Token) -> QueryStats | None:
+        """Stop recording the unit of work started with token, log its summary and keep it."""
+        stats = self._current.get()
+        self._current.reset(token)
+        if stats is not None:
+            self._recent.append(stats)
+            self.log(stats)
+        return stats
+
+    def suspend(self, token: Token) -> QueryStats | None:
+        """Stop recording the unit of work started with token for now, to continue it with resumed()."""
+        stats = self._current.get()
+        self._current.reset(token)
+        return stats
+
+    @contextmanager
+    def recording(self, label: str) -> Iterator[QueryStats]:
+        token = self.start(label)
+        try:
+            yield self._current.get()
+        finally:
+            self.finish(token)
+
+    @contextmanager
+    def resumed(self, stats: QueryStats | None) -> Iterator[QueryStats | None]:
+        """Continue recording a suspended unit of work, and finish it at the end."""
+        token = self._current.set(stats)
+        try:
+            yield stats
+        finally:
+            self.finish(token)
+
+    def log(self, stats: QueryStats):
+        logger.info("%s: %d statements (%d distinct) in %.1f ms, slowest %.1f ms",
+                    stats.label, stats.count, len(stats.shape_counts),
+                    stats.total_time * 1000, stats.slowest_time * 1000)
+        for shape, count in stats.repeated(self.n_plus_one_threshold):
+            logger.warning("%s: possible N+1, executed %d times: %s", stats.label, count, shape)
+
+    def recent(self) -> list[dict]:
+        """Summaries of the most recently finished units of work, newest first."""
+        return [stats.summary(self.n_plus_one_threshold) for stats in reversed(self._recent)]
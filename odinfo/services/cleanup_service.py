@@ -0,0 +1,148 @@
+"""
+Cleanup service for removing old ops from the database.
+
+Deleting a few days of ops used to run as one big transaction from the /cleanup page,
+locking the database for the duration. This service deletes in bounded chunks, each in
+its own transaction, and can do so on a background thread while reporting its progress.
+Afterwards it hands the freed pages back to the file system.
+
+Design principles:
+- Single Responsibility: Only handles removal of old ops and space reclamation
+- Dependency Injection: Receives a repository (or a factory for one on the worker thread)
+- Thread safety: Progress is only read and written under a lock, readers get a copy
+"""
+
+import copy
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable
+
+from odinfo.repositories.game import GameRepository
+
+logger = logging.getLogger('od-info.cleanup_service')
+
+# Ops older than this are removed by the cleanup page and the cron job.
+OPS_RETENTION_HOURS = 48
+
+
+@dataclass
+class CleanupProgress:
+    """Snapshot of the state of a (running or finished) cleanup."""
+    status: str = 'idle'  # idle, running, done or failed
+    cutoff: datetime | None = None
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    current_table: str | None = None
+    deleted: dict[str, int] = field(default_factory=dict)
+    reclaimed: dict[str, int | str] = field(default_factory=dict)
+    error: str | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.status == 'running'
+
+    @property
+    def total_deleted(self) -> int:
+        return sum(self.deleted.values())
+
+
+class CleanupService:
+    """
+    Service for chunked deletion of old ops.
+
+    One instance is shared per process, so that a cleanup started from one request can be
+    followed from the next. At most one cleanup runs at a time.
+    """
+
+    def __init__(self, chunk_size: int = 5000, pause: float = 0.05):
+        """
+        Create the cleanup service.
+
+        Args:
+            chunk_size: Maximum number of rows deleted per transaction.
+            pause: Seconds to sleep between chunks, giving other writers a turn.
+        """
+        self._chunk_size = chunk_size
+        self._pause = pause
+        self._lock = threading.Lock()
+        self._progress = CleanupProgress()
+
+    @property
+    def progress(self) -> CleanupProgress:
+        """A copy of the progress of the current or last cleanup."""
+        with self._lock:
+            return copy.deepcopy(self._progress)
+
+    def _update(self, **changes):
+        with self._lock:
+            for name, value in changes.items():
+                setattr(self._progress, name, value)
+
+    def _table_progress(self, table: str, deleted: int):
+        with self._lock:
+            self._progress.current_table = table
+            self._progress.deleted[table] = deleted
+
+    def _claim(self, cutoff: datetime) -> bool:
+        with self._lock:
+            if self._progress.running:
+                return False
+            self._progress = CleanupProgress(status='running', cutoff=cutoff, started_at=datetime.now())
+            return True
+
+    def _run(self, repo: GameRepository, enable_incremental_vacuum: bool,
+             on_done: Callable[[set[int]], None] | None):
+        try:
+            dom_codes = repo.dominions_losing_latest_ops(self._progress.cutoff)
+            deleted = repo.cleanup_old_ops(self._progress.cutoff, chunk_size=self._chunk_size, pause=self._pause,
+                                           progress=self._table_progress)
+            if on_done and sum(deleted.values()):
+                on_done(dom_codes)
+            self._update(current_table=None,
+                         reclaimed=repo.reclaim_space(enable_incremental_vacuum=enable_incremental_vacuum))
+            self._update(status='done', finished_at=datetime.now())
+        except Exception as e:
+            logger.exception("Cleanup of ops older than %s failed", self._progress.cutoff)
+            self._update(status='failed', error=str(e), finished_at=datetime.now())
+
+    def run(self,
+            repo: GameRepository,
+            cutoff: datetime,
+            enable_incremental_vacuum: bool = False,
+            on_done: Callable[[set[int]], None] | None = None) -> CleanupProgress:
+        """
+        Delete ops older than cutoff on the calling thread and return the final progress.
+
+        If any rows were deleted, on_done is called with the codes of the dominions that lost their latest
+        op of a type, before space is reclaimed.
+        Returns the progress of the already running cleanup if there is one.
+        """
+        if self._claim(cutoff):
+            self._run(repo, enable_incremental_vacuum, on_done)
+        return self.progress
+
+    def start(self,
+              repo_factory: Callable[[], GameRepository],
+              cutoff: datetime,
+              enable_incremental_vacuum: bool = False,
+              on_done: Callable[[set[int]], None] | None = None) -> bool:
+        """
+        Delete ops older than cutoff on a background thread.
+
+        repo_factory is called on the worker thread, as database sessions can't be shared
+        between threads. Returns False if a cleanup is already running.
+        """
+        if not self._claim(cutoff):
+            return False
+
+        def work():
+            repo = repo_factory()
+            try:
+                self._run(repo, enable_incremental_vacuum, on_done)
+            finally:
+                repo.session.close()
+
+        threading.Thread(target=work, name='ops-cleanup', daemon=True).start()
+        return True
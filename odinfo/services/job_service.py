@@ -0,0 +1,228 @@
+"""
+Background jobs, such as the updates from OpenDominion that the pages ask for.
+
+Scraping OpenDominion can take minutes, too long to keep a web request (and the browser) waiting.
+A page enqueues a job and returns at once; a worker thread runs the job and the page follows its
+progress through the job's status.
+
+The jobs are Job records in the database, so that they are shared by all web worker processes:
+enqueueing a job that is already queued or running returns that job instead of a second one, and
+each process runs the queued jobs that it manages to claim.
+
+Design principles:
+- Single Responsibility: Only queues, claims and runs jobs; what a job does is up to `execute`
+- Dependency Injection: Receives a factory for database sessions, as sessions can't be shared
+  between threads, and the function that executes a job
+"""
+
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from odinfo.domain.models import Job
+
+logger = logging.getLogger('od-info.job_service')
+
+# Seconds between looks for jobs enqueued by other processes
+JOB_POLL_INTERVAL = 2.0
+# A job that runs longer than this was abandoned by a process that died, and can be enqueued again
+JOB_TIMEOUT = timedelta(minutes=30)
+# Finished jobs are deleted after this
+JOB_RETENTION = timedelta(days=7)
+
+
+@dataclass
+class JobStatus:
+    """Snapshot of a Job record."""
+    id: int
+    kind: str
+    argument: str
+    status: str  # queued, running, done or failed
+    progress: str | None = None
+    error: str | None = None
+    enqueued_at: datetime | None = None
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+    @classmethod
+    def from_job(cls, job: Job) -> 'JobStatus':
+        return cls(job.id, job.kind, job.argument, job.status, job.progress, job.error,
+                   job.enqueued_at, job.started_at, job.finished_at)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    @property
+    def duration(self) -> float | None:
+        """Seconds the job ran, or has been running; None if it hasn't started."""
+        if not self.started_at:
+            return None
+        return ((self.finished_at or datetime.now()) - self.started_at).total_seconds()
+
+    def as_dict(self) -> dict:
+        """The status for JSON, with timestamps in ISO format."""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'argument': self.argument,
+            'status': self.status,
+            'finished': self.finished,
+            'progress': self.progress,
+            'error': self.error,
+            'enqueued_at': self.enqueued_at.isoformat() if self.enqueued_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration': self.duration,
+        }
+
+
+class JobService:
+    """
+    Queue of background jobs and the worker thread that runs them.
+
+    One instance is shared per process. The worker thread is started by the first enqueue, so that
+    it isn't started before a web server forks its worker processes.
+    """
+
+    def __init__(self,
+                 session_factory: Callable[[], Session],
+                 execute: Callable[[JobStatus, Callable[[str], None]], None],
+                 poll_interval: float = JOB_POLL_INTERVAL,
+                 autostart: bool = True):
+        """
+        Create the job service.
+
+        Args:
+            session_factory: Creates a database session, on the thread that uses it.
+            execute: Runs a job; it is passed the job and a function to report its progress with.
+                A job fails if it raises an exception.
+            poll_interval: Seconds between looks for jobs enqueued by other processes.
+            autostart: Start the worker thread on the first enqueue. Else jobs only run after start()
+                or in run_pending().
+        """
+        self._session_factory = session_factory
+        self._execute = execute
+        self._poll_interval = poll_interval
+        self._autostart = autostart
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def enqueue(self, kind: str, argument: str | int | None = None) -> JobStatus:
+        """
+        Queue a job and wake up the worker thread.
+
+        Returns the job that is already queued or running for the same kind and argument, if there is one.
+        """
+        argument = '' if argument is None else str(argument)
+        with self._session_factory() as session:
+            self._expire(session)
+            while True:
+                job = Job(kind=kind, argument=argument, status='queued', enqueued_at=datetime.now())
+                session.add(job)
+                try:
+                    session.commit()
+                    logger.info("Queued job %s %s (%d)", kind, argument, job.id)
+                    status = JobStatus.from_job(job)
+                    break
+                except IntegrityError:
+                    session.rollback()
+                pending = session.scalar(select(Job).where(Job.kind == kind, Job.argument == argument,
+                                                           Job.status.in_(('queued', 'running'))))
+                # Else it finished in the meantime, and a new one can be queued
+                if pending:
+                    logger.debug("Job %s %s is already %s (%d)", kind, argument, pending.status, pending.id)
+                    status = JobStatus.from_job(pending)
+                    break
+        if self._autostart:
+            self.start()
+        self._wakeup.set()
+        return status
+
+    def status(self, job_id: int) -> JobStatus | None:
+        with self._session_factory() as session:
+            job = session.get(Job, job_id)
+            return JobStatus.from_job(job) if job else None
+
+    def run_pending(self) -> int:
+        """Run queued jobs on the calling thread until there are none left, and return how many ran."""
+        count = 0
+        while (job := self._claim()) is not None:
+            self._run(job)
+            count += 1
+        return count
+
+    def start(self):
+        """Start the worker thread, unless it is running."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._work, name='job-runner', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float | None = None):
+        """Stop the worker thread after the job it is running, if any."""
+        self._stopping.set()
+        self._wakeup.set()
+        with self._lock:
+            thread = self._thread
+        if thread:
+            thread.join(timeout)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("Job runner failed")
+            self._wakeup.wait(self._poll_interval)
+
+    def _expire(self, session: Session):
+        """Fail jobs abandoned by a process that died, and delete old finished jobs."""
+        now = datetime.now()
+        session.execute(update(Job)
+                        .where(Job.status == 'running', Job.started_at < now - JOB_TIMEOUT)
+                        .values(status='failed', error='Abandoned', finished_at=now))
+        session.execute(delete(Job).where(Job.status.in_(('done', 'failed')),
+                                          Job.finished_at < now - JOB_RETENTION))
+        session.commit()
+
+    def _claim(self) -> JobStatus | None:
+        """The oldest queued job, marked as running by this process; None if there is none."""
+        with self._session_factory() as session:
+            while (job_id := session.scalar(select(Job.id).where(Job.status == 'queued')
+                                            .order_by(Job.id).limit(1))) is not None:
+                # Another process can claim the same job in the meantime
+                claimed = session.execute(update(Job)
+                                          .where(Job.id == job_id, Job.status == 'queued')
+                                          .values(status='running', started_at=datetime.now(),
+                                                  worker=f'pid {os.getpid()}')).rowcount
+                session.commit()
+                if claimed:
+                    return JobStatus.from_job(session.get(Job, job_id))
+        return None
+
+    def _set(self, job_id: int, **values):
+        with self._session_factory() as session:
+            session.execute(update(Job).where(Job.id == job_id).values(**values))
+            session.commit()
+
+    def _run(self, job: JobStatus):
+        logger.info("Running job %s %s (%d)", job.kind, job.argument, job.id)
+        try:
+            self._execute(job, lambda progress: self._set(job.id, progress=progress[:200]))
+            self._set(job.id, status='done', progress=None, finished_at=datetime.now())
+        except Exception as e:
+            logger.exception("Job %s %s (%d) failed", job.kind, job.argument, job.id)
+            self._set(job.id, status='failed', error=str(e)[:500], finished_at=datetime.now())
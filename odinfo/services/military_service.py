@@ -11,16 +11,47 @@ Design principles:
 """
 
 import logging
-from datetime import timedelta
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
 
-from odinfo.calculators.military import MilitaryCalculator, RatioCalculator
-from odinfo.domain.models import Dominion, BarracksSpy
+import numpy as np
+
+from odinfo.calculators.bs_refinement import DEFAULT_WINDOW, CrossTickRefinement
+from odinfo.calculators.military import ArrivalTimeline, MilitaryCalculator, RatioCalculator, SafeOpCurve
+from odinfo.calculators.military_batch import BatchMilitaryCalculator, BatchRefinedStrength
+from odinfo.calculators.strength_sampler import DEFAULT_SAMPLES, StrengthDistribution, sample_strength
+from odinfo.domain.models import Dominion, BarracksSpy, MilitaryResult
 from odinfo.repositories.game import GameRepository
-from odinfo.timeutils import hours_since, truncate_to_tick
+from odinfo.timeutils import current_od_time, hours_since, truncate_to_tick
 from odinfoweb.viewmodels.military import MilitaryRowVM, RealmieRowVM
 
 logger = logging.getLogger('od-info.military_service')
 
+# Version of the stored MilitaryResult figures: bump it when a change to the calculators changes them
+RESULT_VERSION = '3'
+
+
+@dataclass
+class MilitaryTable:
+    """The military list with the default safe OP/DP, and the safe OP curve of each row."""
+    rows: list[MilitaryRowVM]
+    curves: list[SafeOpCurve]
+    # The arguments the table was made with
+    current_day: int = 0
+    top: int = 20
+    include_current_strength: bool = False
+
+    def versus(self, versus_op: int) -> list[MilitaryRowVM]:
+        """The rows with safe OP/DP against the given enemy OP (0 for the default)."""
+        if versus_op == 0:
+            return self.rows
+        result_list = []
+        for row, curve in zip(self.rows, self.curves):
+            safe_op, safe_dp = curve.at(versus_op)
+            result_list.append(replace(row, safe_op=safe_op, safe_dp=safe_dp,
+                                       safe_op_with_temples=curve.op_with_temples(versus_op)))
+        return result_list
+
 
 class MilitaryService:
     """
@@ -31,14 +62,19 @@ class MilitaryService:
     the repository for data access.
     """
 
-    def __init__(self, repo: GameRepository):
+    def __init__(self, repo: GameRepository, bs_window: int = DEFAULT_WINDOW):
         """
         Create the military service.
 
         Args:
             repo: Repository for accessing dominion data.
+            bs_window: Number of ticks before the latest BS whose BS ops also refine the home units
+                (see CrossTickRefinement), 0 to only use the BS ops of the latest tick.
         """
         self._repo = repo
+        self._bs_window = bs_window
+        # (dominion code, BS timestamp) -> (calculator, arrival timeline), or None when there is nothing to refine
+        self._timelines: dict[tuple[int, datetime], tuple[MilitaryCalculator, ArrivalTimeline] | None] = {}
 
     def military_list(self, current_day: int, versus_op: int = 0, top: int = 20,
                       include_current_strength: bool = False) -> list[MilitaryRowVM]:
@@ -55,99 +91,212 @@ class MilitaryService:
         Returns:
             List of MilitaryRowVM view models for each dominion.
         """
-        logger.debug("Computing military_list for versus_op=%s, top=%s, current=%s",
-                     versus_op, top, include_current_strength)
+        return self.military_table(current_day, top, include_current_strength).versus(versus_op)
+
+    def military_table(self, current_day: int, top: int = 20,
+                       include_current_strength: bool = False) -> MilitaryTable:
+        """
+        Get the military overview for top dominions, to be evaluated against any enemy OP.
+
+        The op-derived figures are stored as MilitaryResult rows and only recomputed for dominions
+        with newer ops (or on a new day), so they are shared between workers and cron runs. What counts
+        down with the clock (paid_until, the refined paid and current strength) is derived when the rows
+        are made.
+
+        Args:
+            current_day: Current game day (for boat protection calculations).
+            top: Number of top dominions to include.
+            include_current_strength: If True, include the current strength from
+                refined BS data.
+
+        Returns:
+            MilitaryTable with the default rows and the safe OP curve of each row.
+        """
+        logger.debug("Getting military_table for top=%s, current=%s", top, include_current_strength)
         all_doms = list(self._repo.all_dominions())[:top]
-        mil_calcs = sorted(
-            [MilitaryCalculator(dom) for dom in all_doms],
-            key=lambda d: d.dom.current_networth,
-            reverse=True
-        )
-        mc_list = [d for d in mil_calcs if d.army]
-        result_list = []
+        results = self._military_results(all_doms, current_day)
+        rows = sorted([(dom, results[dom.code]) for dom in all_doms if results[dom.code].figures is not None],
+                      key=lambda row: row[0].current_networth, reverse=True)
+        paid_until = self._repo.paid_until_by_dominion([dom.code for dom, result in rows])
+        result_list = [self._military_row(dom, result, paid_until.get(dom.code, '?'), include_current_strength)
+                       for dom, result in rows]
+        return MilitaryTable(result_list, [result.curve for dom, result in rows],
+                             current_day, top, include_current_strength)
+
+    def patch_military_table(self, table: MilitaryTable, doms: list[Dominion]) -> MilitaryTable:
+        """
+        The table with the rows of the given dominions recomputed, after new ops came in for them.
 
-        for mc in mc_list:
-            five_four_op, five_four_dp = mc.five_over_four
-            boat_stuff = mc.boats(current_day)
+        Args:
+            table: Table from military_table.
+            doms: Dominions with new ops.
 
-            # Get refined paid strength (uses midpoint estimates)
-            refined_paid_op, refined_paid_dp, confidence = self.refine_paid_strength(mc.dom)
-            paid_op = refined_paid_op if refined_paid_op is not None else mc.paid_op
-            paid_dp = refined_paid_dp if refined_paid_dp is not None else mc.paid_dp
+        Returns:
+            The patched table, or a new table if rows appear or disappear.
+        """
+        results = self._military_results(doms, table.current_day)
+        paid_until = self._repo.paid_until_by_dominion([dom.code for dom in doms])
+        rows, curves = list(table.rows), list(table.curves)
+        index = {row.code: row_nr for row_nr, row in enumerate(rows)}
+        for dom in doms:
+            result = results[dom.code]
+            if (dom.code in index) != (result.figures is not None):
+                return self.military_table(table.current_day, table.top, table.include_current_strength)
+            if dom.code in index:
+                rows[index[dom.code]] = self._military_row(dom, result, paid_until.get(dom.code, '?'),
+                                                           table.include_current_strength)
+                curves[index[dom.code]] = result.curve
+        return replace(table, rows=rows, curves=curves)
+
+    def _military_results(self, doms: list[Dominion], current_day: int) -> dict[int, MilitaryResult]:
+        """The stored military results of the dominions, recomputing those of older ops first."""
+        version = f'{RESULT_VERSION}-w{self._bs_window}'
+        results = self._repo.military_results(dom.code for dom in doms)
+        stale = [dom for dom in doms if dom.code not in results
+                 or not results[dom.code].is_valid_for(dom.last_op, version, current_day)]
+        if stale:
+            logger.debug("Computing military results for %d of %d dominions", len(stale), len(doms))
+            computed = self._compute_military_results(stale, current_day, version)
+            self._repo.save_military_results(computed)
+            results.update((result.dominion_id, result) for result in computed)
+        return results
+
+    def _compute_military_results(self, doms: list[Dominion], current_day: int, version: str) -> list[MilitaryResult]:
+        """The op-derived figures of the military list for the given dominions, in one batch."""
+        mc_list = [mc for mc in (MilitaryCalculator(dom) for dom in doms) if mc.army]
+        batch = BatchMilitaryCalculator(mc_list)
+
+        # Refined paid (and current) strength of all rows from one query for the BS ops
+        window_spies = self._repo.barracks_spies_in_latest_tick([mc.dom.code for mc in mc_list],
+                                                                window_ticks=self._bs_window)
+        mc_by_code = {mc.dom.code: mc for mc in mc_list}
+        latest_spies, cross_tick_home = {}, {}
+        for code, bs_list in window_spies.items():
+            latest_spies[code], refinement = self._split_window(bs_list, mc_by_code[code])
+            if refinement is not None:
+                cross_tick_home[code] = refinement.refined_home()
+        refined = BatchRefinedStrength(batch, latest_spies, cross_tick_home)
+        # Strength and error for every tick since the BS until everything has arrived, so the paid and
+        # current strength are a lookup for as long as the result is valid
+        strength_per_tick = [refined.strength(np.full(len(mc_list), tick)) for tick in range(refined.training.shape[2])]
+
+        computed_at = current_od_time()
+        results = {dom.code: MilitaryResult(dominion_id=dom.code, last_op=dom.last_op, version=version,
+                                            current_day=current_day, computed_at=computed_at) for dom in doms}
+        for row_nr, mc in enumerate(mc_list):
+            five_four_op, five_four_dp = batch.five_over_four(row_nr)
+            boat_stuff = mc.boats(current_day)
 
-            # Calculate current strength only if requested
-            if include_current_strength:
-                current_op, current_dp, _ = self.calculate_current_strength(mc.dom)
+            # The refined paid strength (uses midpoint estimates) is looked up in the strength per tick
+            if refined.refined[row_nr]:
+                paid = {}
+                strength = [[int(op[row_nr]), int(dp[row_nr]), float(error[row_nr])]
+                            for op, dp, error in strength_per_tick]
             else:
-                current_op, current_dp = None, None
-
-            row = MilitaryRowVM(
-                code=mc.dom.code,
-                name=mc.dom.name,
-                realm=mc.dom.realm,
-                race=mc.dom.race,
-                ops_age=hours_since(mc.dom.last_op),
-                land=mc.dom.current_land,
-                hittable_75_percent=mc.hittable_75_percent,
-                five_over_four_op=five_four_op,
-                five_over_four_dp=five_four_dp,
-                five_four_op_with_temples=mc.five_four_op_with_temples,
+                paid = dict(paid_op=int(batch.paid_op[row_nr]), paid_dp=int(batch.paid_dp[row_nr]), confidence=None)
+                strength = None
+
+            result = results[mc.dom.code]
+            result.bs_timestamp = refined.latest[row_nr].timestamp if refined.refined[row_nr] else None
+            result.curve = mc.safe_op_curve
+            result.figures = dict(
+                five_over_four_op=int(five_four_op),
+                five_over_four_dp=int(five_four_dp),
+                five_four_op_with_temples=int(batch.five_four_op_with_temples[row_nr]),
                 temples=mc.temple_bonus,
                 boats_amount=boat_stuff[0],
                 boats_prt=boat_stuff[1],
                 boats_sendable=boat_stuff[2],
                 boats_capacity=boat_stuff[3],
-                paid_until=mc.army.get('paid_until', '?'),
                 draftees=mc.draftees,
-                raw_op=mc.raw_op,
-                paid_op=paid_op,
-                raw_dp=mc.raw_dp,
-                paid_dp=paid_dp,
-                safe_op=mc.safe_op if versus_op == 0 else mc.safe_op_versus(versus_op)[0],
-                safe_dp=mc.safe_dp if versus_op == 0 else mc.safe_op_versus(versus_op)[1],
-                safe_op_with_temples=mc.safe_op_with_temples(versus_op),
-                networth=mc.dom.current_networth,
+                raw_op=int(round(batch.raw_op[row_nr])),
+                raw_dp=int(round(batch.raw_dp[row_nr])),
+                safe_op=int(batch.safe_op[row_nr]),
+                safe_dp=int(batch.safe_dp[row_nr]),
+                safe_op_with_temples=int(batch.safe_op_with_temples[row_nr]),
                 has_incomplete_intel=mc.has_incomplete_intel(),
-                current_op=current_op,
-                current_dp=current_dp,
-                confidence=confidence,
+                strength=strength,
+                **paid,
             )
-            result_list.append(row)
+        return list(results.values())
 
-        return result_list
+    @classmethod
+    def _military_row(cls, dom: Dominion, result: MilitaryResult, paid_until: int | str,
+                      include_current_strength: bool) -> MilitaryRowVM:
+        """
+        A military list row from the stored figures and the (search page) data of the dominion.
 
-    def calculate_current_strength(self, dom: Dominion) -> tuple[int | None, int | None, str | None]:
-        """Calculate current strength from refined BS data.
+        The figures that count down with the clock are derived here: the refined paid strength is the
+        strength at the tick the training is done (paid_until), the current strength that of this tick.
+        """
+        figures = dict(result.figures)
+        strength = figures.pop('strength')
+        ticks_since_bs = int(hours_since(result.bs_timestamp)) if strength else 0
+        if strength:
+            paid_op, paid_dp, paid_error = strength[min(ticks_since_bs + paid_until, len(strength) - 1)]
+            figures.update(paid_op=paid_op, paid_dp=paid_dp, confidence=cls._confidence_text(paid_error))
+        # Current strength only if requested
+        if include_current_strength and strength:
+            current_op, current_dp, _ = strength[min(ticks_since_bs, len(strength) - 1)]
+        else:
+            current_op, current_dp = None, None
+        return MilitaryRowVM(
+            code=dom.code,
+            name=dom.name,
+            realm=dom.realm,
+            race=dom.race,
+            ops_age=hours_since(dom.last_op),
+            land=dom.current_land,
+            hittable_75_percent=MilitaryCalculator.hittable_land(dom.current_land),
+            networth=dom.current_networth,
+            current_op=current_op,
+            current_dp=current_dp,
+            paid_until=paid_until,
+            **figures,
+        )
+
+    def arrival_timeline(self, dom: Dominion) -> tuple[MilitaryCalculator, ArrivalTimeline, int] | None:
+        """The refined BS data of a dominion's latest tick, built once per dominion and BS.
 
         Args:
-            dom: Dominion to calculate current strength for.
+            dom: Dominion to refine the BS data of.
 
         Returns:
-            Tuple of (current_op, current_dp, confidence_string).
-            Returns (None, None, None) if no BS data available.
+            Tuple of (calculator, arrival timeline, ticks since the BS).
+            Returns None if no BS data available for refinement.
         """
         last_bs = dom.last_barracks
         if not last_bs:
-            return None, None, None
+            return None
+        key = (dom.code, last_bs.timestamp)
+        if key not in self._timelines:
+            mc = MilitaryCalculator(dom)
+            bs_list, refinement = self._split_window(self._window_spies(dom), mc)
+            refined_home = refinement.refined_home() if refinement else None
+            timeline = mc.arrival_timeline(bs_list, last_bs, refined_home) if bs_list else None
+            self._timelines[key] = (mc, timeline) if timeline and timeline.refined_home else None
+        if self._timelines[key] is None:
+            return None
+        mc, timeline = self._timelines[key]
+        return mc, timeline, int(hours_since(last_bs.timestamp))
 
-        bs_list = self.get_barracks_spies_in_tick(dom, last_bs.timestamp)
-        if not bs_list:
-            return None, None, None
+    def calculate_current_strength(self, dom: Dominion) -> tuple[int | None, int | None, str | None]:
+        """Calculate current strength from refined BS data.
 
-        mc = MilitaryCalculator(dom)
-        ticks_since_bs = int(hours_since(last_bs.timestamp))
+        Args:
+            dom: Dominion to calculate current strength for.
 
-        refined_home = mc.refined_home_units(bs_list)
-        if not refined_home:
+        Returns:
+            Tuple of (current_op, current_dp, confidence_string).
+            Returns (None, None, None) if no BS data available.
+        """
+        refined = self.arrival_timeline(dom)
+        if not refined:
             return None, None, None
+        mc, timeline, ticks_since_bs = refined
 
-        arrived_returning = mc.arrived_returning_units(bs_list, ticks_since_bs)
-        arrived_training = mc.arrived_training_units(last_bs, ticks_since_bs)
-
-        current_op = mc.current_op(refined_home, arrived_returning, arrived_training)
-        current_dp = mc.current_dp(refined_home, arrived_returning, arrived_training)
-
-        confidence = self._calculate_confidence(refined_home, arrived_returning)
+        current_op, current_dp = timeline.strength(mc, ticks_since_bs)
+        confidence = self._calculate_confidence(timeline.refined_home, timeline.arrived_returning(ticks_since_bs))
 
         return current_op, current_dp, confidence
 
@@ -164,32 +313,16 @@ class MilitaryService:
             Tuple of (paid_op, paid_dp, confidence_string).
             Returns (None, None, None) if no BS data available for refinement.
         """
-        last_bs = dom.last_barracks
-        if not last_bs:
-            return None, None, None
-
-        bs_list = self.get_barracks_spies_in_tick(dom, last_bs.timestamp)
-        if not bs_list:
-            return None, None, None
-
-        mc = MilitaryCalculator(dom)
-        ticks_since_bs = int(hours_since(last_bs.timestamp))
-
-        refined_home = mc.refined_home_units(bs_list)
-        if not refined_home:
+        refined = self.arrival_timeline(dom)
+        if not refined:
             return None, None, None
+        mc, timeline, ticks_since_bs = refined
 
         # Calculate at the paid_until tick (when all training completes)
-        paid_until = last_bs.paid_until
-        total_elapsed = ticks_since_bs + paid_until
-
-        arrived_returning = mc.arrived_returning_units(bs_list, total_elapsed)
-        arrived_training = mc.arrived_training_units(last_bs, total_elapsed)
-
-        paid_op = mc.current_op(refined_home, arrived_returning, arrived_training)
-        paid_dp = mc.current_dp(refined_home, arrived_returning, arrived_training)
+        total_elapsed = ticks_since_bs + dom.last_barracks.paid_until
 
-        confidence = self._calculate_confidence(refined_home, arrived_returning)
+        paid_op, paid_dp = timeline.strength(mc, total_elapsed)
+        confidence = self._calculate_confidence(timeline.refined_home, timeline.arrived_returning(total_elapsed))
 
         return paid_op, paid_dp, confidence
 
@@ -202,34 +335,36 @@ class MilitaryService:
         Returns:
             List of (tick, op, dp) tuples for ticks 0-12 from now.
         """
-        last_bs = dom.last_barracks
-        if not last_bs:
-            return []
-
-        bs_list = self.get_barracks_spies_in_tick(dom, last_bs.timestamp)
-        if not bs_list:
+        refined = self.arrival_timeline(dom)
+        if not refined:
             return []
+        mc, timeline, ticks_since_bs = refined
 
-        mc = MilitaryCalculator(dom)
-        ticks_since_bs = int(hours_since(last_bs.timestamp))
+        return [(future_tick, *timeline.strength(mc, ticks_since_bs + future_tick)) for future_tick in range(13)]
 
-        refined_home = mc.refined_home_units(bs_list)
-        if not refined_home:
-            return []
-
-        forecast = []
-        for future_tick in range(13):
-            total_elapsed = ticks_since_bs + future_tick
+    def strength_distribution(self, dom: Dominion, samples: int = DEFAULT_SAMPLES,
+                              seed: int | None = None) -> StrengthDistribution | None:
+        """Sample the current OP and DP from the BS fuzz.
 
-            arrived_returning = mc.arrived_returning_units(bs_list, total_elapsed)
-            arrived_training = mc.arrived_training_units(last_bs, total_elapsed)
+        The home units are sampled within the same bounds as the current strength is calculated from:
+        refined across ticks when there are older BS ops in the window, else from those of the latest tick.
 
-            op = mc.current_op(refined_home, arrived_returning, arrived_training)
-            dp = mc.current_dp(refined_home, arrived_returning, arrived_training)
+        Args:
+            dom: Dominion to sample.
+            samples: Number of samples.
+            seed: Seed for reproducible samples.
 
-            forecast.append((future_tick, op, dp))
+        Returns:
+            StrengthDistribution with P10/P50/P90 OP and DP, or None if no BS data available.
+        """
+        refined = self.arrival_timeline(dom)
+        if not refined:
+            return None
+        mc, timeline, ticks_since_bs = refined
 
-        return forecast
+        bs_list, refinement = self._split_window(self._window_spies(dom), mc)
+        home_bounds = refinement.bounds() if refinement else None
+        return sample_strength(mc, bs_list, dom.last_barracks, ticks_since_bs, samples, seed, home_bounds)
 
     def _calculate_confidence(self, refined_home: dict, arrived_returning: dict) -> str:
         """Calculate confidence string from refined estimates.
@@ -244,10 +379,15 @@ class MilitaryService:
         for key, (lower, upper, error_pct) in arrived_returning.items():
             max_error = max(max_error, error_pct)
 
+        return self._confidence_text(max_error)
+
+    @staticmethod
+    def _confidence_text(max_error: float) -> str:
+        """Confidence string for a max error percentage."""
         if max_error < 1:
             return "locked"
         else:
-            return f"±{round(max_error)}%"
+            return f"±{round(float(max_error))}%"
 
     def top_op(self, mil_calc_result: list[MilitaryRowVM]) -> MilitaryRowVM | None:
         """
@@ -308,6 +448,24 @@ class MilitaryService:
 
         return sorted(result_list, key=lambda x: x.land, reverse=True)
 
+    def _window_spies(self, dom: Dominion) -> list[BarracksSpy]:
+        """The BS ops of the dominion in the window up to its latest BS, newest first."""
+        window_start = truncate_to_tick(dom.last_barracks.timestamp) - timedelta(hours=self._bs_window)
+        return [bs for bs in dom.barracks_spy if bs.timestamp >= window_start]
+
+    def _split_window(self, bs_list: list[BarracksSpy],
+                      mc: MilitaryCalculator) -> tuple[list[BarracksSpy], CrossTickRefinement | None]:
+        """Split the BS ops of a window (newest first) into those of the latest tick, and their refinement
+        across ticks if there are older ones (None otherwise). mc gives the return time of the units."""
+        if not bs_list:
+            return [], None
+        latest_tick = truncate_to_tick(bs_list[0].timestamp)
+        latest = [bs for bs in bs_list if truncate_to_tick(bs.timestamp) == latest_tick]
+        if len(latest) == len(bs_list):
+            return latest, None
+        return_ticks = {f'unit{nr}': mc.return_ticks(nr) for nr in range(1, 5)}
+        return latest, CrossTickRefinement.from_barracks_spies(bs_list, self._bs_window, return_ticks)
+
     def get_barracks_spies_in_tick(self, dom: Dominion, tick_time) -> list[BarracksSpy]:
         """Get all BarracksSpy records for a dominion within a specific tick.
 
@@ -59,7 +59,8 @@ class UpdateService:
 
     def update_dom_index(self):
         """Update the dominion index from OpenDominion search page."""
-        update_dom_index(self._od_session, self._repo)
+        compress_history = 'compress_history' in self._config.feature_toggles
+        update_dom_index(self._od_session, self._repo, compress_history=compress_history)
 
     def update_ops(self, dom_code: int):
         """
@@ -95,26 +96,36 @@ class UpdateService:
         for dom_code in realmie_codes:
             self.update_ops(dom_code)
 
-    def update_all(self):
+    def update_all(self) -> list[int]:
         """
         Update ops for all dominions that have newer scans available.
 
         Compares local data timestamps with the OP Center to find
         dominions with newer intelligence, then updates only those.
+
+        Returns:
+            The codes of the updated dominions.
         """
         last_scans = get_last_scans(self._od_session)
+        updated = []
         for dom in self._repo.all_dominions():
             domcode = dom.code
             if (domcode in last_scans) and (
                     (dom.last_op is None) or
                     (dom.last_op < last_scans[domcode])):
                 self.update_ops(domcode)
+                updated.append(domcode)
+        return updated
 
     def initialize_if_empty(self):
         """
         Initialize the dominion index if the database is empty.
 
-        Called during startup to ensure we have dominion data.
+        Called during startup to ensure we have dominion data. Databases from before the
+        DominionHistory rollups existed get their rollups backfilled once.
         """
         if self._repo.is_empty():
-            self.update_dom_index()
\ No newline at end of file
+            self.update_dom_index()
+        elif not self._repo.has_history_rollups():
+            logger.info("Backfilling DominionHistory rollups")
+            self._repo.rebuild_history_rollups()
\ No newline at end of file
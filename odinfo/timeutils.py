@@ -61,3 +61,9 @@ def add_duration(timestamp: str, duration: int, whole_hour=False) -> str:
 def truncate_to_tick(timestamp: datetime) -> datetime:
     """Floor a timestamp to the start of its tick (hour boundary)."""
     return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def truncate_to_bucket(timestamp: datetime, hours: int) -> datetime:
+    """Floor a timestamp to the start of its bucket of `hours` hours, aligned to midnight."""
+    tick = truncate_to_tick(timestamp)
+    return tick.replace(hour=tick.hour - tick.hour % hours)
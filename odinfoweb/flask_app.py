@@ -7,28 +7,39 @@ Main entrypoint for the application.
 
 """
 
+import dataclasses
+import functools
+import hashlib
 import os
 import sys
 import logging
 import flask
 from flask import Flask, g, request, render_template, session
-from flask_login import LoginManager, login_user, login_required
+from flask_login import LoginManager, current_user, login_user, login_required
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import Session
 
 from odinfo.timeutils import current_od_time
 from odinfoweb.forms import LoginForm
+from odinfoweb.streaming import HEADER_END, buffered, compress
 
 from odinfo.domain.models import Base
 from odinfoweb.user import load_user_by_id, load_user_by_name, User
 
 from odinfo.config import OP_CENTER_URL, load_secrets, check_dirs_and_configs, get_config
 from odinfo.facade.cache import FacadeCache
-from odinfo.facade.odinfo import ODInfoFacade
-from odinfo.facade.graphs import nw_history_graph, land_history_graph
+from odinfo.facade.odinfo import (ODInfoFacade, NW_TRACKER_WINDOWS, UPDATE_OVERVIEW, UPDATE_DOMINION,
+                                  UPDATE_TOWN_CRIER)
+from odinfo.facade.graphs import METRICS
 from odinfo.exceptions import ODInfoException
 from odinfo.repositories.game import GameRepository
+from odinfo.repositories.querystats import QueryRecorder
+from odinfo.services.cleanup_service import CleanupService, OPS_RETENTION_HOURS
+from odinfo.services.job_service import JobService, JobStatus
+from odinfoweb.viewmodels.datatables import TableQuery
 from odinfoweb.viewmodels.dominfo import build_dominfo_vm
 from odinfoweb.viewmodels.economy import build_economy_vm
+from odinfoweb.viewmodels.stealables import build_stealable_list_vm
 
 # ---------------------------------------------------------------------- Flask
 
@@ -92,6 +103,30 @@ db.init_app(app)
 with app.app_context():
     db.create_all()
 
+# ---------------------------------------------------------------------- SQL instrumentation
+
+app.query_recorder = QueryRecorder()
+with app.app_context():
+    app.query_recorder.install(db.engine)
+
+
+@app.before_request
+def start_query_stats():
+    g._query_stats_token = app.query_recorder.start(f'{request.method} {request.path}')
+
+
+@app.teardown_request
+def finish_query_stats(exception):
+    # A streamed response tears down the request again when the stream ends
+    token = g.pop('_query_stats_token', None)
+    if not token:
+        return
+    if g.pop('_query_stats_streamed', False) and exception is None:
+        # The template is still to be rendered: render_streamed records its queries
+        g._query_stats_suspended = app.query_recorder.suspend(token)
+    else:
+        app.query_recorder.finish(token)
+
 # ---------------------------------------------------------------------- flask_login
 
 app.secret_key = load_secrets()['secret_key']
@@ -114,7 +149,8 @@ def load_user(user_id):
 
 # ---------------------------------------------------------------------- Facade Singleton
 
-app.facade_cache = FacadeCache()
+app.facade_cache = FacadeCache.from_config(get_config())
+app.cleanup_service = CleanupService()
 
 
 def facade() -> ODInfoFacade:
@@ -125,6 +161,103 @@ def facade() -> ODInfoFacade:
     return _facade
 
 
+# ---------------------------------------------------------------------- Background Jobs
+
+with app.app_context():
+    engine = db.engine
+
+
+def run_job(job: JobStatus, report):
+    """Runs a background job on the worker thread, with a facade and database session of its own."""
+    repo = GameRepository(Session(bind=engine))
+    job_facade = ODInfoFacade(get_config(), repo, app.facade_cache)
+    try:
+        with app.query_recorder.recording(f'job {job.kind} {job.argument}'.strip()):
+            job_facade.run_job(job, report)
+    finally:
+        job_facade.teardown()
+        repo.session.close()
+
+
+app.job_service = JobService(lambda: Session(bind=engine), run_job)
+
+
+def start_job(kind: str, argument=None, **values) -> flask.Response:
+    """
+    Queue a job and redirect to the page of the request with ?job=, which shows the progress of the
+    job and reloads when it's done.
+    """
+    job = facade().enqueue_job(app.job_service, kind, argument)
+    return flask.redirect(flask.url_for(request.endpoint, job=job.id, **values))
+
+
+# ---------------------------------------------------------------------- Conditional GET
+
+# Changes when the templates are deployed anew, the same in all worker processes
+TEMPLATES_VERSION = int(max((os.path.getmtime(os.path.join(root, name))
+                             for root, _, names in os.walk(template_folder) for name in names), default=0))
+
+
+def page_etag() -> str:
+    """ETag of a page, from the data generation, the current tick, the request and the user."""
+    parts = (app.facade_cache.generation(), current_od_time().strftime('%Y%m%d%H'), TEMPLATES_VERSION,
+             request.full_path, current_user.get_id(), get_config().feature_toggles)
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def conditional(view):
+    """
+    Answer a GET with 304 Not Modified, without rendering the page, when the browser has it already.
+
+    Requests that update data (?update=..., /update, /send) are always rendered.
+    Not for the /api/ tables: DataTables makes every URL unique with a _ parameter, so the browser
+    never has one to revalidate, and the draw counter in the response changes with every request.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if (request.method != 'GET' or request.args.get('update')
+                or any(kwargs.get(name) for name in ('update', 'send'))):
+            return view(*args, **kwargs)
+        # Before rendering: data that changes meanwhile gets a new ETag on the next request
+        etag = page_etag()
+        # Weak: the same page is sent both with and without gzip
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            response = flask.make_response(view(*args, **kwargs))
+        response.set_etag(etag, weak=True)
+        # Browsers may keep the page, but have to check it with the ETag every time
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+
+# ---------------------------------------------------------------------- Streaming and compression
+
+def render_streamed(template_name: str, **context) -> flask.Response:
+    """
+    Like render_template, but sends the page in chunks while it is being rendered.
+
+    Only worth it for pages that render a big body on the server: the page head and header are sent
+    at once, so the browser can fetch the stylesheets and scripts while the rest is rendered.
+    """
+    g._query_stats_streamed = True
+
+    @flask.stream_with_context
+    def generate():
+        # The request's query recording, suspended when the view returned, ends with the stream
+        with app.query_recorder.resumed(g.pop('_query_stats_suspended', None)):
+            yield from buffered(flask.stream_template(template_name, **context), flush_after=HEADER_END)
+
+    return app.response_class(generate(), mimetype='text/html')
+
+
+@app.after_request
+def compress_response(response):
+    return compress(request, response)
+
+
 # ---------------------------------------------------------------------- Template Context
 
 @app.context_processor
@@ -140,7 +273,10 @@ def handle_odinfo_error(error):
     """Handle ODInfo-specific errors gracefully."""
     import traceback
     error_traceback = traceback.format_exc()
-    
+    if request.path.startswith('/api/'):
+        # Shown by DataTables
+        return flask.jsonify(error=str(error)), 500
+
     # Try to render the appropriate template with error info
     # Use the referrer to determine which page to show
     template = 'odinfo-base.html'
@@ -180,6 +316,9 @@ def handle_general_error(error):
         details={'original_error': str(error)}
     )
     wrapped_error.__cause__ = error
+    if request.path.startswith('/api/'):
+        # Shown by DataTables
+        return flask.jsonify(error=str(wrapped_error)), 500
 
     # Try to render the appropriate template with error info
     template = 'odinfo-base.html'
@@ -208,11 +347,8 @@ def handle_general_error(error):
 @app.route('/', methods=['GET', 'POST'])
 @app.route('/dominfo/', methods=['GET', 'POST'])
 @login_required
+@conditional
 def overview():
-    if request.args.get('update'):
-        facade().update_dom_index()
-        facade().update_all()
-        facade().update_realmies()
     if request.method == 'POST':
         for k, v in request.form.items():
             if k.startswith('role.'):
@@ -223,59 +359,75 @@ def overview():
                 prefix, dom, old_name = k.split('.')
                 if old_name != v:
                     facade().update_player(dom, v)
+    if request.args.get('update'):
+        return start_job(UPDATE_OVERVIEW)
     return render_template(
         'overview.html',
-        doms=facade().dom_list(),
         current_time=current_od_time(as_str=True))
 
 
 @app.route('/dominfo/<domcode>')
 @app.route('/dominfo/<domcode>/<update>')
 @login_required
+@conditional
 def dominfo(domcode: int, update=None):
     if update == 'update':
-        facade().update_single_dom(domcode)
-    nw_history = facade().nw_history(domcode)
+        return start_job(UPDATE_DOMINION, int(domcode), domcode=domcode)
     dominion = facade().dominion(domcode)
     current_strength = facade().current_strength(dominion)
     paid_strength = facade().refine_paid_strength(dominion)
     strength_forecast = facade().strength_forecast(dominion)
-    dom_vm = build_dominfo_vm(dominion, current_strength, paid_strength, strength_forecast)
+    strength_distribution = facade().strength_distribution(dominion)
+    dom_vm = build_dominfo_vm(dominion, current_strength, paid_strength, strength_forecast,
+                              strength_distribution, request.args.get('break_op', type=int))
     return render_template(
         'dominfo.html',
         dom_vm=dom_vm,
-        nw_history_graph=nw_history_graph(nw_history),
-        land_history_graph=land_history_graph(nw_history),
+        graph_metrics=METRICS,
         op_center_url=OP_CENTER_URL)
 
 
+@app.route('/dominfo/<int:domcode>/graph/<metric>')
+@login_required
+def history_graph(domcode: int, metric: str):
+    if metric not in METRICS:
+        flask.abort(404)
+    # send_file answers If-None-Match/If-Modified-Since for the cached file itself, and takes the
+    # content type (SVG or PNG) from its name
+    return flask.send_file(facade().history_graph(domcode, metric))
+
+
 @app.route('/towncrier')
 @login_required
+@conditional
 def towncrier():
     if request.args.get('update'):
-        facade().update_town_crier()
-    return render_template('towncrier.html',
-                            towncrier=facade().get_town_crier())
+        return start_job(UPDATE_TOWN_CRIER)
+    # Read before streaming: the database session is closed when the view returns
+    return render_streamed('towncrier.html',
+                            towncrier=list(facade().get_town_crier()))
 
 
 @app.route('/stats')
 @login_required
+@conditional
 def stats():
     if request.args.get('update'):
-        facade().update_town_crier()
-    return render_template('stats.html',
+        return start_job(UPDATE_TOWN_CRIER)
+    return render_streamed('stats.html',
                             stats=facade().award_stats())
 
 
 @app.route('/nwtracker/<send>')
 @app.route('/nwtracker')
 @login_required
+@conditional
 def nw_tracker(send=None):
     result_of_send = ''
     if send == 'send':
         result_of_send = facade().send_top_bot_nw_to_discord()
     hours = request.args.get('hours', 12, type=int)
-    if hours not in (12, 24, 36, 48):
+    if hours not in NW_TRACKER_WINDOWS:
         hours = 12
     return render_template('nwtracker.html',
                            top_nw=facade().get_top_bot_nw(filter_zeroes=True, since=hours),
@@ -287,6 +439,7 @@ def nw_tracker(send=None):
 
 @app.route('/economy')
 @login_required
+@conditional
 def economy():
     dom = facade().current_player_dominion()
     econ_vm = build_economy_vm(dom)
@@ -297,28 +450,24 @@ def economy():
 
 @app.route('/ratios')
 @login_required
+@conditional
 def ratios():
-    return render_template('ratios.html', doms=facade().ratio_list())
+    return render_template('ratios.html')
 
 
 @app.route('/military', defaults={'versus_op': 0})
 @app.route('/military/<int:versus_op>')
 @login_required
+@conditional
 def military(versus_op: int = 0):
-    include_current = request.args.get('current', '').lower() == 'true'
-    dom_list = facade().military_list(versus_op=versus_op, top=1000,
-                                       include_current_strength=include_current)
     return render_template('military.html',
-                           doms=dom_list,
-                           ages=facade().all_doms_ops_age(),
-                           top_op=facade().top_op(dom_list),
                            versus_op=versus_op,
-                           include_current=include_current,
-                           current_day=facade().current_tick.day)
+                           include_current=request.args.get('current', '').lower() == 'true')
 
 
 @app.route('/realmies')
 @login_required
+@conditional
 def realmies():
     return render_template('realmies.html',
                             realmies=facade().realmies_with_blops_info())
@@ -326,17 +475,77 @@ def realmies():
 
 @app.route('/stealables')
 @login_required
+@conditional
 def stealables():
-    return render_template('stealables.html',
-                           stealables = facade().stealables(),
-                           ages=facade().all_doms_ops_age())
+    return render_template('stealables.html')
+
+
+# ---------------------------------------------------------------------- Table API (DataTables server-side)
+
+@app.route('/api/overview')
+@login_required
+def api_overview():
+    query = TableQuery.from_args(request.args)
+    return flask.jsonify(query.response(facade().dom_list(), search_fields=('name', 'race', 'player', 'role')))
+
+
+@app.route('/api/ratios')
+@login_required
+def api_ratios():
+    query = TableQuery.from_args(request.args)
+    return flask.jsonify(query.response(facade().ratio_list(), search_fields=('name', 'race')))
+
+
+@app.route('/api/military', defaults={'versus_op': 0})
+@app.route('/api/military/<int:versus_op>')
+@login_required
+def api_military(versus_op: int = 0):
+    include_current = request.args.get('current', '').lower() == 'true'
+    dom_list = facade().military_list(versus_op=versus_op, top=1000, include_current_strength=include_current)
+    query = TableQuery.from_args(request.args)
+    return flask.jsonify(query.response(dom_list, search_fields=('name', 'race')))
+
+
+@app.route('/api/stealables')
+@login_required
+def api_stealables():
+    stealables = build_stealable_list_vm(facade().stealables(), facade().all_doms_ops_age())
+    query = TableQuery.from_args(request.args)
+    return flask.jsonify(query.response(stealables, search_fields=('name', 'race')))
+
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job(job_id: int):
+    job = app.job_service.status(job_id)
+    if job is None:
+        return flask.jsonify(error=f"Unknown job {job_id}"), 404
+    response = flask.jsonify(job.as_dict())
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 
 @app.route('/cleanup')
 @login_required
 def cleanup():
-    deleted = facade().cleanup_old_ops(hours=48)
-    return render_template('cleanup.html', deleted=deleted)
+    if not request.args.get('status'):
+        facade().start_cleanup_old_ops(app.cleanup_service,
+                                       enable_incremental_vacuum=bool(request.args.get('vacuum')))
+    return render_template('cleanup.html',
+                           progress=app.cleanup_service.progress,
+                           hours=OPS_RETENTION_HOURS)
+
+
+@app.route('/debug/queries')
+@login_required
+def debug_queries():
+    return flask.jsonify(app.query_recorder.recent())
+
+
+@app.route('/debug/cache')
+@login_required
+def debug_cache():
+    return flask.jsonify(dataclasses.asdict(app.facade_cache.stats()))
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -0,0 +1,85 @@
+"""
+Streamed responses and on-the-fly gzip compression.
+
+Pages with big server-side bodies are rendered with Jinja streaming, so that the browser gets the
+page header and the first rows while the rest is still being rendered. Jinja yields a chunk per
+template statement; buffered() sends the page head and header at once, and joins the rest into
+chunks of a reasonable size for the network.
+
+compress() gzips responses for clients that accept it. Streamed responses are compressed chunk by
+chunk, with a sync flush after each chunk, so that compression doesn't hold the stream back.
+"""
+
+import gzip
+import zlib
+from typing import Iterable, Iterator
+
+from flask import Request, Response
+
+# Characters that are sent at once when streaming a page
+STREAM_CHUNK_SIZE = 8192
+# Where odinfo-base.html starts the content of a page: everything before it is sent at once
+HEADER_END = '<!-- !PAGE CONTENT! -->'
+# Smaller responses are sent as they are
+MIN_COMPRESS_SIZE = 500
+COMPRESS_LEVEL = 6
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript',
+                          'image/svg+xml'}
+
+
+def buffered(chunks: Iterable[str], size: int = STREAM_CHUNK_SIZE, flush_after: str | None = None) -> Iterator[str]:
+    """
+    The chunks joined into chunks of at least size characters (except the last).
+
+    The chunks up to the first one that contains flush_after are sent at once, however short they are.
+    """
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if flush_after and flush_after in chunk:
+            flush_after = None
+        elif length < size:
+            continue
+        yield ''.join(buffer)
+        buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def gzip_stream(chunks: Iterable[str | bytes], level: int = COMPRESS_LEVEL) -> Iterator[bytes]:
+    """A gzip stream of the chunks, flushed after every chunk."""
+    # wbits 31: with gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Ends the request context of a stream_with_context stream that was aborted
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress(request: Request, response: Response) -> Response:
+    """The response gzipped, if the client accepts that and it is worth it."""
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'gzip' not in request.accept_encodings):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.is_streamed:
+        response.response = gzip_stream(response.response)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return response
+        response.set_data(gzip.compress(data, COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,118 @@
+"""
+Server-side processing of DataTables requests over lists of view models.
+
+The facade caches the complete lists; a DataTables request (see
+https://datatables.net/manual/server-side) asks for one page of such a list, filtered and sorted.
+Besides the DataTables search box, tables can be filtered on realm, race, land and ops age.
+"""
+
+import dataclasses
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Any, Iterable, Mapping
+
+
+@dataclass
+class TableQuery:
+    """A DataTables request for one page of a list."""
+    draw: int = 0
+    start: int = 0
+    length: int = -1  # -1: all rows
+    search: str = ''
+    order: list[tuple[str, bool]] = field(default_factory=list)  # (attribute, descending)
+    realm: int | None = None
+    race: str | None = None
+    min_land: int | None = None
+    max_land: int | None = None
+    max_ops_age: float | None = None
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str]) -> 'TableQuery':
+        """
+        The query of the request arguments that DataTables sends, and the filter arguments.
+
+        A column is sorted on its name if it has one, else on its data attribute.
+        """
+        columns = []
+        for nr in count():
+            if f'columns[{nr}][data]' not in args:
+                break
+            columns.append(args.get(f'columns[{nr}][name]') or args.get(f'columns[{nr}][data]'))
+        order = []
+        for nr in count():
+            column = _number(args, f'order[{nr}][column]', int)
+            if column is None:
+                break
+            if 0 <= column < len(columns) and columns[column]:
+                order.append((columns[column], args.get(f'order[{nr}][dir]') == 'desc'))
+        length = _number(args, 'length', int)
+        return cls(
+            draw=_number(args, 'draw', int) or 0,
+            start=max(0, _number(args, 'start', int) or 0),
+            length=-1 if length is None else length,
+            search=args.get('search[value]', '').strip(),
+            order=order,
+            realm=_number(args, 'realm', int),
+            race=args.get('race', '').strip() or None,
+            min_land=_number(args, 'min_land', int),
+            max_land=_number(args, 'max_land', int),
+            max_ops_age=_number(args, 'max_ops_age', float),
+        )
+
+    def filtered(self, rows: list, search_fields: Iterable[str] = ('name', )) -> list:
+        """The rows that match the filters, and contain the search text in one of the search_fields."""
+        search = self.search.lower()
+        race = self.race.lower() if self.race else None
+        return [row for row in rows
+                if (self.realm is None or getattr(row, 'realm', None) == self.realm)
+                and (race is None or str(getattr(row, 'race', '')).lower() == race)
+                and (self.min_land is None or (row.land or 0) >= self.min_land)
+                and (self.max_land is None or (row.land or 0) <= self.max_land)
+                and (self.max_ops_age is None or getattr(row, 'ops_age', 0) <= self.max_ops_age)
+                and (not search or any(search in str(getattr(row, name, '') or '').lower()
+                                       for name in search_fields))]
+
+    def sorted(self, rows: list) -> list:
+        """The rows in the requested order; unknown attributes are ignored and missing values go last."""
+        if not rows:
+            return rows
+        result = list(rows)
+        for name, descending in reversed(self.order):
+            if not hasattr(rows[0], name):
+                continue
+
+            def key(row, name=name, descending=descending):
+                value = getattr(row, name)
+                if isinstance(value, str):
+                    value = value.lower()
+                return (value is not None) if descending else (value is None), value
+
+            result.sort(key=key, reverse=descending)
+        return result
+
+    def response(self, rows: list, search_fields: Iterable[str] = ('name', )) -> dict:
+        """The DataTables response with the requested page of rows."""
+        filtered = self.sorted(self.filtered(rows, search_fields))
+        page = filtered[self.start:] if self.length < 0 else filtered[self.start:self.start + self.length]
+        return {
+            'draw': self.draw,
+            'recordsTotal': len(rows),
+            'recordsFiltered': len(filtered),
+            'data': [row_data(row) for row in page],
+        }
+
+
+def row_data(row) -> dict[str, Any]:
+    """The attributes and properties of a view model, for JSON."""
+    data = dataclasses.asdict(row)
+    for name, attribute in vars(type(row)).items():
+        if isinstance(attribute, property):
+            data[name] = getattr(row, name)
+    return data
+
+
+def _number(args: Mapping[str, str], key: str, number_type: type) -> Any:
+    try:
+        return number_type(args[key])
+    except (KeyError, TypeError, ValueError):
+        return None
@@ -8,6 +8,7 @@ data for template consumption.
 from dataclasses import dataclass
 
 from odinfo.calculators.military import MilitaryCalculator, RatioCalculator
+from odinfo.calculators.strength_sampler import StrengthDistribution
 from odinfo.domain.models import Dominion
 from odinfo.timeutils import hours_since
 
@@ -91,6 +92,11 @@ class MilitaryInfoVM:
     # 12-tick forecast: list of (tick, op, dp) tuples
     strength_forecast: list[tuple[int, int, int]]
 
+    # Current strength sampled from the BS fuzz, and the chance that break_op breaks the dominion
+    strength_distribution: StrengthDistribution | None
+    break_op: int | None
+    break_probability: float | None
+
     # Bonuses
     offense_bonuses: OffenseBonusesVM
     defense_bonuses: DefenseBonusesVM
@@ -139,7 +145,9 @@ class DomInfoVM:
 def build_dominfo_vm(dom: Dominion,
                      current_strength: tuple[int | None, int | None, str | None] = (None, None, None),
                      paid_strength: tuple[int | None, int | None, str | None] = (None, None, None),
-                     strength_forecast: list[tuple[int, int, int]] = None
+                     strength_forecast: list[tuple[int, int, int]] = None,
+                     strength_distribution: StrengthDistribution | None = None,
+                     break_op: int | None = None
                      ) -> DomInfoVM:
     """
     Build a DomInfoVM from a Dominion object.
@@ -152,6 +160,8 @@ def build_dominfo_vm(dom: Dominion,
         current_strength: Tuple of (current_op, current_dp, confidence) from refinement.
         paid_strength: Tuple of (paid_op, paid_dp, confidence) from refinement at paid_until tick.
         strength_forecast: List of (tick, op, dp) tuples for 12-tick forecast.
+        strength_distribution: Sampled current OP/DP, or None.
+        break_op: OP to show the break probability of, or None.
     """
     mc = MilitaryCalculator(dom)
     rc = RatioCalculator(dom)
@@ -254,6 +264,10 @@ def build_dominfo_vm(dom: Dominion,
         current_dp=current_dp,
         confidence=confidence,
         strength_forecast=strength_forecast,
+        strength_distribution=strength_distribution,
+        break_op=break_op,
+        break_probability=(round(strength_distribution.break_probability(break_op) * 100, 1)
+                           if strength_distribution and break_op else None),
         offense_bonuses=offense_bonuses,
         defense_bonuses=defense_bonuses,
         units=units,
@@ -0,0 +1,42 @@
+"""
+View models for the stealables page.
+"""
+
+from dataclasses import dataclass
+
+
+@dataclass
+class StealableRowVM:
+    """View model for a row in the stealables list."""
+    code: int
+    name: str
+    realm: int
+    race: str
+    land: int
+    ops_age: float
+    platinum: int
+    food: int
+    mana: int
+    gems: int
+    lumber: int
+
+
+def build_stealable_list_vm(stealables: list, ops_ages: dict[int, float]) -> list[StealableRowVM]:
+    """
+    Build a list of StealableRowVM from the stealables query rows and the ops age of every dominion.
+
+    Keeps the order of the query (most platinum first).
+    """
+    return [StealableRowVM(
+        code=row.dominion,
+        name=row.name,
+        realm=row.realm,
+        race=row.race,
+        land=row.land,
+        ops_age=ops_ages.get(row.dominion, 0),
+        platinum=row.platinum,
+        food=row.food,
+        mana=row.mana,
+        gems=row.gems,
+        lumber=row.lumber,
+    ) for row in stealables]
@@ -0,0 +1,44 @@
+"""
+Benchmark of MilitaryCalculator against BatchMilitaryCalculator for a synthetic 1000-dominion round.
+
+Run with: python -m test.calculators.bench_military_batch [dominions]
+"""
+
+import sys
+import time
+
+from odinfo.calculators.military import MilitaryCalculator
+from odinfo.calculators.military_batch import BatchMilitaryCalculator
+from test.fixtures import create_db_session, synthetic_round
+
+
+def scalar(calcs: list[MilitaryCalculator]):
+    return [(mc.raw_op, mc.paid_op, mc.raw_dp, mc.paid_dp, mc.safe_op, mc.safe_dp, mc.five_over_four)
+            for mc in calcs]
+
+
+def main(size: int):
+    session = create_db_session()
+    doms = synthetic_round(session, size)
+    # Load all ops up front, so both variants are timed without lazy loading.
+    for dom in doms:
+        MilitaryCalculator(dom).paid_op
+
+    start = time.perf_counter()
+    scalar([MilitaryCalculator(dom) for dom in doms])
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    calcs = [MilitaryCalculator(dom) for dom in doms]
+    packed = time.perf_counter()
+    BatchMilitaryCalculator(calcs)
+    batch_time = time.perf_counter() - start
+
+    print(f"{size} dominions")
+    print(f"scalar: {scalar_time * 1000:8.1f} ms")
+    print(f"batch:  {batch_time * 1000:8.1f} ms (calculators {(packed - start) * 1000:.1f} ms)")
+    print(f"speedup: {scalar_time / batch_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
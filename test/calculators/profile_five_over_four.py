@@ -0,0 +1,54 @@
+"""
+Counts the property evaluations of one MilitaryCalculator.five_over_four call, with and without snapshot mode.
+
+Run with: python -m test.calculators.profile_five_over_four
+"""
+
+import cProfile
+import pstats
+from collections import Counter
+
+from odinfo.calculators.military import MilitaryCalculator
+from odinfo.domain.domainhelper import Buildings, Land, Technology
+from odinfo.domain.models import Dominion
+from odinfo.domain.refdata import Race, Unit
+from test.fixtures import create_db_session, synthetic_round
+
+PROFILED_CLASSES = (MilitaryCalculator, Race, Unit, Dominion, Buildings, Land, Technology)
+
+
+def property_names() -> set[str]:
+    return {name for cls in PROFILED_CLASSES for name, value in vars(cls).items() if isinstance(value, property)}
+
+
+def evaluations(dom: Dominion, snapshot: bool) -> Counter:
+    """Number of times each property body ran during one five_over_four call."""
+    mc = MilitaryCalculator(dom, snapshot=snapshot)
+    profiler = cProfile.Profile()
+    profiler.runcall(lambda: mc.five_over_four)
+    names = property_names()
+    counts = Counter()
+    for (filename, line, function), (primitive_calls, *_) in pstats.Stats(profiler).stats.items():
+        if function in names:
+            counts[function] += primitive_calls
+    return counts
+
+
+def main():
+    session = create_db_session()
+    doms = synthetic_round(session, 30, seed=32)
+    # A race with hybrids, so five_over_four goes through all its steps.
+    dom = next(dom for dom in doms if len(MilitaryCalculator(dom).race.hybrid_units) >= 2)
+    for dom_ops in (dom.clear_sight, dom.barracks_spy, dom.castle_spy, dom.survey_dominion, dom.land_spy, dom.vision):
+        list(dom_ops)
+
+    before = evaluations(dom, snapshot=False)
+    after = evaluations(dom, snapshot=True)
+    print(f"five_over_four for {dom.race}: {sum(before.values())} property evaluations, "
+          f"{sum(after.values())} in snapshot mode")
+    for name, count in before.most_common(15):
+        print(f"  {name:24} {count:6} -> {after[name]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import unittest
+from datetime import datetime, timedelta
+
+from odinfo.calculators.bs_refinement import CrossTickRefinement
+from odinfo.calculators.military import MilitaryCalculator
+from odinfo.domain.models import BarracksSpy
+
+REFERENCE = datetime(2026, 10, 1, 12, 30)
+TRUE_HOME = {'draftees': 1000, 'home_unit1': 2000, 'home_unit2': 3000, 'home_unit3': 4000, 'home_unit4': 5000}
+
+
+def bs(hours_before: int, factor: float, training: dict | None = None, returning: dict | None = None,
+       **home) -> BarracksSpy:
+    """A BS taken hours_before the reference, with every home amount observed factor times its true value."""
+    amounts = {**TRUE_HOME, **home}
+    return BarracksSpy(timestamp=REFERENCE - timedelta(hours=hours_before, microseconds=int(factor * 1000)),
+                       training=training or {}, returning=returning or {},
+                       **{name: round(amount * factor) for name, amount in amounts.items()})
+
+
+class CrossTickRefinementTestCase(unittest.TestCase):
+    def test_same_tick_matches_refined_home_units(self):
+        spies = [bs(0, 1.0), bs(0, 0.9), bs(0, 1.1)]
+        refinement = CrossTickRefinement.from_barracks_spies(spies)
+        expected = {}
+        for key, attribute in (('draftees', 'draftees'), *((f'unit{i}', f'home_unit{i}') for i in range(1, 5))):
+            expected[key] = MilitaryCalculator.refine_unit_estimate([getattr(spy, attribute) for spy in spies])
+        self.assertEqual(expected, refinement.refined_home())
+        self.assertEqual([], refinement.rejected)
+
+    def test_older_bs_tightens_bounds(self):
+        # Three ticks ago unit1 was 500 lower, and 500 arrived from training since
+        older = bs(3, 0.85, training={'unit1': {'3': 500}}, home_unit1=1500)
+        latest = bs(0, 1 / 0.85)
+        same_tick = CrossTickRefinement.from_barracks_spies([latest]).refined_home()
+        cross_tick = CrossTickRefinement.from_barracks_spies([older, latest]).refined_home()
+        for key in ('unit1', 'unit2', 'unit3', 'unit4'):
+            lower, upper, error = cross_tick[key]
+            self.assertLess(error, same_tick[key][2])
+            self.assertLess(upper - lower, 2)
+        self.assertAlmostEqual(2000, sum(cross_tick['unit1'][:2]) / 2, delta=1)
+        # Draftees are only refined by the reference tick
+        self.assertEqual(same_tick['draftees'], cross_tick['draftees'])
+
+    def test_units_sent_out_are_subtracted(self):
+        # 1000 unit2 left two ticks ago, so they return in 10 ticks according to the latest BS
+        older = bs(2, 0.85, home_unit2=4000)
+        latest = bs(0, 1 / 0.85, returning={'unit2': {'10': 1000}})
+        refinement = CrossTickRefinement.from_barracks_spies([older, latest])
+        self.assertEqual([], refinement.rejected)
+        lower, upper, count = refinement.bounds()['unit2']
+        self.assertEqual(2, count)
+        self.assertLessEqual(lower, 3000)
+        self.assertGreaterEqual(upper, 3000)
+
+    def test_faster_return(self):
+        # 3000 unit2 left a tick ago: with faster_return 3 they return in 8 ticks, not 11
+        older = bs(2, 1.0, home_unit2=6000)
+        latest = bs(0, 1.0, returning={'unit2': {'8': 3000}})
+        self.assertIn('unit2', CrossTickRefinement.from_barracks_spies([older, latest]).rejected[0].reason)
+        refinement = CrossTickRefinement.from_barracks_spies([older, latest], return_ticks={'unit2': 9})
+        self.assertEqual([], refinement.rejected)
+        lower, upper, count = refinement.bounds()['unit2']
+        self.assertEqual(2, count)
+        self.assertLessEqual(lower, 3000)
+        self.assertGreaterEqual(upper, 3000)
+
+    def test_changed_army_is_rejected(self):
+        # The army shrunk by half without anything in the queues (an invasion)
+        older = bs(4, 1.0, home_unit3=8000)
+        latest = bs(0, 1.0)
+        refinement = CrossTickRefinement.from_barracks_spies([older, latest])
+        self.assertEqual([older.timestamp], [rejected.timestamp for rejected in refinement.rejected])
+        self.assertIn('unit3', refinement.rejected[0].reason)
+        self.assertEqual(1, refinement.bounds()['unit3'][2])
+        # BS ops from before the change are rejected from then on
+        self.assertEqual(older.timestamp.replace(minute=0, second=0, microsecond=0), refinement.cutoff_tick)
+        self.assertFalse(refinement.add(bs(6, 1.0)))
+
+    def test_outside_window(self):
+        refinement = CrossTickRefinement.from_barracks_spies([bs(0, 1.0)], window=2)
+        self.assertFalse(refinement.add(bs(3, 1.0)))
+        self.assertEqual(1, len(refinement.observations))
+
+    def test_incremental_add_projects_forward(self):
+        refinement = CrossTickRefinement()
+        self.assertTrue(refinement.add(bs(5, 0.85, training={'unit4': {'2': 300}}, home_unit4=4700)))
+        self.assertTrue(refinement.add(bs(0, 1 / 0.85)))
+        self.assertEqual(REFERENCE.replace(minute=0), refinement.reference_tick)
+        self.assertEqual([5, 0], [observation.ticks_before for observation in refinement.observations])
+        lower, upper, error = refinement.refined_home()['unit4']
+        self.assertLessEqual(lower, 5000)
+        self.assertGreaterEqual(upper, 5000)
+        self.assertLess(error, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,9 @@
+import random
 import unittest
 
 from odinfo.calculators.military import MilitaryCalculator
-from odinfo.domain.models import Dominion
-from test.fixtures import create_db_session, init_db
+from odinfo.domain.models import BarracksSpy, Dominion
+from test.fixtures import create_db_session, init_db, synthetic_round
 
 
 class MilitaryCalculatorTestCase(unittest.TestCase):
@@ -33,6 +34,65 @@ class MilitaryCalculatorTestCase(unittest.TestCase):
         self.assertEqual(116, mc.paid_dp)
         self.assertEqual((107, 89), mc.five_over_four)
 
+    def test_snapshot_invalidate(self):
+        mc = MilitaryCalculator(self.dom)
+        paid_op = mc.paid_op
+        self.assertEqual(mc.five_over_four, MilitaryCalculator(self.dom, snapshot=False).five_over_four)
+
+        self.dom.last_cs.military_unit1 += 100
+        self.dom.last_cs.prestige += 200
+        self.assertEqual(paid_op, mc.paid_op)
+        mc.invalidate()
+        reference = MilitaryCalculator(self.dom, snapshot=False)
+        self.assertNotEqual(paid_op, mc.paid_op)
+        self.assertEqual(reference.paid_op, mc.paid_op)
+        self.assertEqual(reference.offense_bonus, mc.offense_bonus)
+        self.assertEqual(reference.five_over_four, mc.five_over_four)
+
+    def test_return_ticks(self):
+        self.assertEqual([12, 12, 12, 12], [MilitaryCalculator(self.dom).return_ticks(nr) for nr in range(1, 5)])
+        self.dom.race = 'Human'
+        # Cavalry have faster_return: 3
+        self.assertEqual([12, 12, 12, 9], [MilitaryCalculator(self.dom).return_ticks(nr) for nr in range(1, 5)])
+
+    def test_arrival_timeline(self):
+        rng = random.Random(36)
+        last_bs = self.dom.last_barracks
+        for nr in range(3):
+            self.dom.barracks_spy.append(BarracksSpy(
+                draftees=rng.randint(8, 12), home_unit1=10, home_unit2=10, home_unit3=10, home_unit4=10,
+                training=last_bs.training,
+                returning={f'unit{i}': {str(tick): rng.randint(0, 500) for tick in rng.sample(range(1, 13), 4)}
+                           for i in (1, 2, 4)},
+                # Same tick, but the timestamp is part of the primary key
+                timestamp=last_bs.timestamp.replace(microsecond=(last_bs.timestamp.microsecond + nr + 1) % 1_000_000)))
+        self.session.commit()
+
+        mc = MilitaryCalculator(self.dom)
+        bs_list = self.dom.barracks_spy
+        timeline = mc.arrival_timeline(bs_list, last_bs)
+        self.assertEqual(mc.refined_home_units(bs_list), timeline.refined_home)
+        for ticks in range(-1, 16):
+            with self.subTest(ticks=ticks):
+                self.assertEqual(mc.arrived_returning_units(bs_list, ticks), timeline.arrived_returning(ticks))
+                self.assertEqual(mc.arrived_training_units(last_bs, ticks), timeline.arrived_training(ticks))
+
+    def test_safe_op_curve(self):
+        synthetic_round(self.session, 100, seed=35)
+        for dom in self.session.query(Dominion).all():
+            mc = MilitaryCalculator(dom, snapshot=False)
+            if not mc.army:
+                continue
+            curve = MilitaryCalculator(dom).safe_op_curve
+            # Around each breakpoint, and across the range of the synthetic round
+            enemy_ops = [int(op) + delta for op in curve.breakpoints for delta in (-1, 0, 1)]
+            enemy_ops += list(range(0, 300_000, 7_919))
+            with self.subTest(dom=dom.code, race=dom.race):
+                self.assertEqual([mc.safe_op_versus(op) for op in enemy_ops], curve.sweep(enemy_ops))
+                # safe_op_with_temples(0) is the default safe OP, not safe_op_versus(0)
+                self.assertEqual([mc.safe_op_with_temples(op) for op in enemy_ops if op],
+                                 [curve.op_with_temples(op) for op in enemy_ops if op])
+
     # def test_five_over_four_liz(self):
     #     bs = self.dom.last_barracks
     #     bs.draftees = 10
@@ -0,0 +1,40 @@
+import unittest
+
+from odinfo.calculators.military import MilitaryCalculator
+from odinfo.calculators.military_batch import BatchMilitaryCalculator
+from odinfo.domain.models import Dominion
+from test.fixtures import create_db_session, init_db, synthetic_round
+
+
+class BatchMilitaryCalculatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.session = create_db_session()
+        init_db(self.session)
+        synthetic_round(self.session, 300, seed=31)
+        self.doms = self.session.query(Dominion).all()
+
+    def test_identical_to_scalar(self):
+        # The batch is packed from snapshot mode calculators, the reference evaluates everything every time.
+        calcs = [MilitaryCalculator(dom, snapshot=False) for dom in self.doms]
+        batch = BatchMilitaryCalculator.for_dominions(self.doms)
+        for row, mc in enumerate(calcs):
+            with self.subTest(dom=mc.dom.code, race=mc.dom.race):
+                self.assertEqual(mc.raw_op, batch.raw_op[row])
+                self.assertEqual(mc.raw_dp, batch.raw_dp[row])
+                self.assertEqual(mc.paid_op, batch.paid_op[row])
+                self.assertEqual(mc.paid_dp, batch.paid_dp[row])
+                self.assertEqual(mc.five_over_four, (batch.five_four_op[row], batch.five_four_dp[row]))
+                self.assertEqual(mc.safe_op, batch.safe_op[row])
+                self.assertEqual(mc.safe_dp, batch.safe_dp[row])
+                self.assertEqual(mc.five_four_op_with_temples, batch.five_four_op_with_temples[row])
+                self.assertEqual(mc.safe_op_with_temples(0), batch.safe_op_with_temples[row])
+
+    def test_fixture_dominion(self):
+        dom = self.session.get(Dominion, 1)
+        batch = BatchMilitaryCalculator.for_dominions([dom])
+        self.assertEqual({1: 0}, batch.index)
+        self.assertEqual(MilitaryCalculator(dom).five_over_four, tuple(batch.five_over_four(0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+import numpy as np
+
+from odinfo.calculators.military import MilitaryCalculator
+from odinfo.calculators.strength_sampler import sample_strength, sample_true_amounts
+from odinfo.domain.models import BarracksSpy, Dominion
+from test.fixtures import create_db_session, init_db
+
+
+class StrengthSamplerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.session = create_db_session()
+        init_db(self.session)
+        self.dom = self.session.get(Dominion, 1)
+        self.bs = self.dom.last_barracks
+        self.bs.draftees, self.bs.home_unit1, self.bs.home_unit2 = 1000, 2000, 3000
+        self.bs.home_unit3, self.bs.home_unit4 = 4000, 5000
+        self.session.commit()
+
+    def add_bs(self, factor: float):
+        """Another BS in the same tick, with every amount observed factor times the first one."""
+        self.dom.barracks_spy.append(BarracksSpy(
+            draftees=round(self.bs.draftees * factor),
+            **{f'home_unit{i}': round(getattr(self.bs, f'home_unit{i}') * factor) for i in range(1, 5)},
+            training=self.bs.training, returning=self.bs.returning,
+            timestamp=self.bs.timestamp.replace(microsecond=(self.bs.timestamp.microsecond + 1) % 1_000_000)))
+        self.session.commit()
+
+    def sample(self, **kwargs):
+        bs_list = list(self.dom.barracks_spy)
+        return sample_strength(MilitaryCalculator(self.dom), bs_list, self.bs, 0, **kwargs)
+
+    def test_true_amounts_within_bounds(self):
+        rng = np.random.default_rng(1)
+        lower = np.array([850.0, 935.0, 0.0, 1000.0])
+        upper = np.array([1176.0, 1176.0, 0.0, 900.0])
+        amounts = sample_true_amounts(lower, upper, np.array([1, 2, 1, 2]), rng.random((10000, 4)))
+        self.assertTrue(np.all(amounts[:, :2] >= lower[:2]) and np.all(amounts[:, :2] <= upper[:2]))
+        self.assertTrue(np.all(amounts[:, 2] == 0))
+        # Inconsistent bounds fall back to the midpoint
+        self.assertTrue(np.all(amounts[:, 3] == 950))
+        # More observations favour the lower end of the bounds
+        self.assertLess(np.median(amounts[:, 1]), (lower[1] + upper[1]) / 2)
+
+    def test_seeded(self):
+        first = self.sample(samples=2000, seed=38)
+        self.assertEqual(first.op_percentiles, self.sample(samples=2000, seed=38).op_percentiles)
+        self.assertEqual(2000, first.samples)
+
+    def test_percentiles_narrow_with_observations(self):
+        single = self.sample(seed=1)
+        mc = MilitaryCalculator(self.dom)
+        op_low, op_median, op_high = single.op_percentiles
+        self.assertLess(op_low, op_median)
+        self.assertLess(op_median, op_high)
+
+        # Observations at both ends of the fuzz range pin the amounts down
+        self.add_bs(0.85 * 0.85)
+        locked = self.sample(seed=1)
+        self.assertLess(locked.dp_percentiles[2] - locked.dp_percentiles[0], 2)
+        bs_list = list(self.dom.barracks_spy)
+        refined_home = mc.refined_home_units(bs_list)
+        current_dp = mc.current_dp(refined_home, {}, mc.arrived_training_units(self.bs, 0))
+        self.assertAlmostEqual(current_dp, locked.dp_percentiles[1], delta=2)
+
+    def test_break_probability(self):
+        distribution = self.sample(seed=2)
+        dp_low, dp_median, dp_high = distribution.dp_percentiles
+        self.assertEqual(0, distribution.break_probability(0))
+        self.assertAlmostEqual(0.5, distribution.break_probability(dp_median), delta=0.01)
+        self.assertAlmostEqual(0.9, distribution.break_probability(dp_high), delta=0.01)
+        self.assertEqual(1, distribution.break_probability(dp_high * 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,17 @@
 from datetime import datetime, timedelta
+from pathlib import Path
 import json
+import random
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
 
 from odinfo.domain.models import (Base, Dominion, DominionHistory, ClearSight,
                                   BarracksSpy, CastleSpy, LandSpy, Revelation,
-                                  SurveyDominion, Vision, TownCrier)
+                                  SurveyDominion, Vision, TownCrier, QueueTick)
+from odinfo.config import REF_DATA_DIR
+from odinfo.domain.domainhelper import LAND_TYPES
+from odinfo.domain.refdata import TechTree
 
 
 def create_db_session() -> Session:
@@ -165,3 +170,54 @@ def init_db(session: Session) -> None:
         ))
 
         session.commit()
+
+
+def add_queue_ticks(session: Session) -> None:
+    """(Re)write the QueueTick rows of all BarracksSpy, LandSpy and SurveyDominion ops, as ingest does."""
+    session.query(QueueTick).delete()
+    for op_type in (BarracksSpy, LandSpy, SurveyDominion):
+        for op in session.query(op_type):
+            session.add_all(QueueTick.from_op(op))
+    session.commit()
+
+
+def synthetic_round(session: Session, size: int, seed: int = 1) -> list[Dominion]:
+    """Add size dominions of random races with random CS, BS, CastleSpy, Survey, LandSpy and Vision."""
+    rng = random.Random(seed)
+    races = [path.stem.capitalize() for path in sorted(Path(REF_DATA_DIR, 'races').glob('*.yml'))]
+    techs = sorted({tech for perk_techs in TechTree().techs.values() for tech in perk_techs})
+    # Half past, so that the hours since the ops don't change while a test runs
+    timestamp = datetime.now() + timedelta(hours=-2, minutes=-30)
+    doms = []
+    for code in range(1000, 1000 + size):
+        land = rng.randint(250, 6000)
+        land_types = {land_type: rng.randint(0, land // 4) for land_type in LAND_TYPES}
+        dom = Dominion(code=code, name=f"Synthetic {code}", realm=rng.randint(1, 40), race=rng.choice(races))
+        dom.history.append(DominionHistory(land=land, networth=land * rng.randint(20, 60), timestamp=timestamp))
+        dom.clear_sight.append(ClearSight(
+            land=land, peasants=land * 20, networth=land * 40, prestige=rng.randint(250, 900),
+            resource_platinum=0, resource_boats=rng.randint(0, 2000),
+            military_draftees=rng.randint(0, 20000),
+            military_unit1=rng.randint(0, 30000), military_unit2=rng.randint(0, 30000),
+            military_unit3=rng.randint(0, 30000), military_unit4=rng.randint(0, 30000),
+            wpa=rng.uniform(0, 1.5), timestamp=timestamp))
+        dom.barracks_spy.append(BarracksSpy(
+            draftees=0, home_unit1=0, home_unit2=0, home_unit3=0, home_unit4=0,
+            training={}, returning={}, timestamp=timestamp - timedelta(hours=1)))
+        dom.castle_spy.append(CastleSpy(forges_rating=rng.uniform(0, 0.3), walls_rating=rng.uniform(0, 0.3),
+                                        timestamp=timestamp))
+        dom.survey_dominion.append(SurveyDominion(
+            home=land // 10, gryphon_nest=rng.randint(0, land // 5), guard_tower=rng.randint(0, land // 5),
+            temple=rng.randint(0, land // 6), dock=rng.randint(0, 200), barren_land=0, total_land=land,
+            constructing={'temple': {'3': rng.randint(0, 50)}} if rng.random() < 0.3 else {},
+            timestamp=timestamp))
+        dom.land_spy.append(LandSpy(total=land, barren=0, constructed=land,
+                                    incoming={'plain': {'5': rng.randint(0, 100)}} if rng.random() < 0.3 else {},
+                                    timestamp=timestamp, **land_types,
+                                    **{f'{land_type}_constructed': amount for land_type, amount in land_types.items()}))
+        dom.vision.append(Vision(techs={tech: tech for tech in rng.sample(techs, rng.randint(0, 12))},
+                                 timestamp=timestamp))
+        session.add(dom)
+        doms.append(dom)
+    session.commit()
+    return doms
@@ -0,0 +1,219 @@
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from odinfo.facade.cache import (CacheEntry, CacheStats, FacadeCache, InvalidationLog, LocalInvalidationLog,
+                                 SharedCacheStore)
+
+
+class FacadeCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_file = Path(self.tmp_dir.name) / 'facade_cache.sqlite'
+        # Workers see each other's invalidations right away
+        patcher = mock.patch('odinfo.facade.cache.INVALIDATION_CHECK_INTERVAL', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def worker(self, shared=False, **kwargs) -> FacadeCache:
+        return FacadeCache(shared=SharedCacheStore(self.cache_file) if shared else None,
+                           log=InvalidationLog(self.cache_file), **kwargs)
+
+    def test_lru_eviction(self):
+        cache = self.worker(max_entries=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(1, cache['a'])
+        cache['c'] = 3
+        self.assertEqual(['a', 'c'], cache.keys())
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(CacheStats(hits=1, misses=1, evictions=1, entries=2), cache.stats())
+
+    def test_ttl(self):
+        cache = self.worker(ttl=0.01)
+        cache['a'] = 1
+        time.sleep(0.02)
+        self.assertNotIn('a', cache)
+        self.assertEqual(1, cache.stats().expirations)
+
+    def test_get_or_compute(self):
+        cache = self.worker()
+        computed = []
+        for _ in range(3):
+            self.assertEqual(42, cache.get_or_compute('answer', lambda: computed.append(1) or 42))
+        self.assertEqual(1, len(computed))
+        self.assertEqual((2, 1), (cache.stats().hits, cache.stats().misses))
+
+    def test_single_flight(self):
+        cache = self.worker()
+        started, release, computed = threading.Event(), threading.Event(), []
+
+        def compute():
+            computed.append(1)
+            started.set()
+            release.wait(5)
+            return 42
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('answer', compute)))
+                   for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(([42] * 4, [1]), (results, computed))
+        self.assertEqual(3, cache.stats().waits)
+
+    def test_single_flight_across_workers(self):
+        worker1, worker2 = self.worker(shared=True), self.worker(shared=True)
+        started, release = threading.Event(), threading.Event()
+
+        def slow_compute():
+            started.set()
+            release.wait(5)
+            return 'slow'
+
+        thread = threading.Thread(target=worker1.get_or_compute, args=('military', slow_compute))
+        thread.start()
+        started.wait(5)
+        threading.Timer(0.2, release.set).start()
+        self.assertEqual('slow', worker2.get_or_compute('military', lambda: 'duplicate'))
+        thread.join()
+        self.assertEqual((1, 0), (worker2.stats().waits, worker2.stats().wait_timeouts))
+
+    def test_single_flight_timeout(self):
+        worker1, worker2 = self.worker(shared=True), self.worker(shared=True, compute_timeout=0.1)
+        started, release = threading.Event(), threading.Event()
+
+        def stuck_compute():
+            started.set()
+            release.wait(5)
+            return 'stuck'
+
+        thread = threading.Thread(target=worker1.get_or_compute, args=('military', stuck_compute))
+        thread.start()
+        started.wait(5)
+        with self.assertLogs('od-info.cache', 'WARNING'):
+            self.assertEqual('fallback', worker2.get_or_compute('military', lambda: 'fallback'))
+        release.set()
+        thread.join()
+        self.assertEqual(1, worker2.stats().wait_timeouts)
+
+    def test_failed_computation_not_shared(self):
+        cache = self.worker(shared=True)
+
+        def fail():
+            raise ValueError()
+
+        self.assertRaises(ValueError, cache.get_or_compute, 'answer', fail)
+        # The lock of the failed computation is released
+        self.assertEqual(42, cache.get_or_compute('answer', lambda: 42))
+
+    def test_invalidate_dependents_only(self):
+        cache = self.worker()
+        cache.put('ops_list', 1, depends_on=['ops'])
+        cache.put('search_list', 2, depends_on=['search'])
+        cache.put('everything', 3)
+        generation = cache.invalidate('ops', [1000])
+        self.assertGreater(generation, 0)
+        self.assertEqual((False, True, False), ('ops_list' in cache, 'search_list' in cache, 'everything' in cache))
+
+    def test_patch(self):
+        cache = self.worker()
+        patches = []
+
+        def patch(ages, dom_codes):
+            patches.append(dom_codes)
+            return ages | {code: 0 for code in dom_codes}
+
+        def ages():
+            return cache.get_or_compute('ages', lambda: {1: 5, 2: 5, 3: 5}, ['ops'], patch)
+
+        ages()
+        cache.invalidate('ops', [2, 3])
+        cache.invalidate('search')
+        self.assertEqual({1: 5, 2: 0, 3: 0}, ages())
+        self.assertEqual({1: 5, 2: 0, 3: 0}, ages())
+        self.assertEqual([{2, 3}], patches)
+        # An invalidation of all dominions can't be patched
+        cache.invalidate('ops')
+        self.assertEqual({1: 5, 2: 5, 3: 5}, ages())
+        self.assertEqual(1, cache.stats().patches)
+
+    def test_invalidation_across_workers(self):
+        worker1, worker2 = self.worker(), self.worker()
+        worker2.put('ops_list', 1, depends_on=['ops'])
+        worker1.invalidate('ops', [7])
+        self.assertNotIn('ops_list', worker2)
+        worker2.put('ops_list', 2, depends_on=['ops'])
+        worker1.clear()
+        self.assertNotIn('ops_list', worker2)
+
+    def test_local_log_across_workers(self):
+        signal_file = Path(self.tmp_dir.name) / 'cache_invalidated_at'
+        worker1 = FacadeCache(log=LocalInvalidationLog(signal_file))
+        worker2 = FacadeCache(log=LocalInvalidationLog(signal_file))
+        worker2.put('ops_list', 1, depends_on=['ops'])
+        worker2.put('search_list', 2, depends_on=['search'])
+        # Another worker's invalidation invalidates everything
+        worker1.invalidate('ops', [7])
+        self.assertEqual((False, False), ('ops_list' in worker2, 'search_list' in worker2))
+        worker2.put('ops_list', 3, depends_on=['ops'])
+        worker1.clear()
+        self.assertNotIn('ops_list', worker2)
+        self.assertFalse(self.cache_file.exists())
+
+    def test_shared_between_workers(self):
+        worker1, worker2 = self.worker(shared=True), self.worker(shared=True)
+        worker1['military_table_1000_False'] = {'rows': [1, 2, 3]}
+        self.assertEqual({'rows': [1, 2, 3]}, worker2['military_table_1000_False'])
+        self.assertEqual(1, worker2.stats().shared_hits)
+
+        # A worker started later patches the shared entry for the invalidations since it was stored
+        worker1.get_or_compute('ages', lambda: {1: 5, 2: 5}, ['ops'], lambda ages, codes: ages | {2: 0})
+        worker1.invalidate('ops', [2])
+        worker3 = self.worker(shared=True)
+        self.assertEqual({1: 5, 2: 0}, worker3.get_or_compute('ages', dict, ['ops'], lambda ages, codes: ages | {2: 0}))
+        self.assertNotIn('military_table_1000_False', worker3)
+
+    def test_shared_store_bounded(self):
+        store = SharedCacheStore(self.cache_file, max_entries=3)
+        for nr in range(5):
+            store.set(f'key{nr}', CacheEntry(nr, time.time(), 0, None))
+        store.get('key2')
+        store.set('key5', CacheEntry(5, time.time(), 0, frozenset(['ops'])))
+        self.assertEqual(3, len(store))
+        self.assertEqual((2, 5), (store.get('key2').value, store.get('key5').value))
+        self.assertEqual(frozenset(['ops']), store.get('key5').depends_on)
+        self.assertRaises(KeyError, store.get, 'key3')
+
+    def test_shared_store_batches_last_used(self):
+        store = SharedCacheStore(self.cache_file)
+        store.set('key', CacheEntry(1, time.time(), 0, None))
+        last_used = store.conn.execute('SELECT last_used FROM CacheEntry').fetchone()[0]
+        time.sleep(0.01)
+        store.get('key')
+        self.assertEqual(last_used, store.conn.execute('SELECT last_used FROM CacheEntry').fetchone()[0])
+        with mock.patch('odinfo.facade.cache.LAST_USED_FLUSH_INTERVAL', 0):
+            store.get('key')
+        self.assertLess(last_used, store.conn.execute('SELECT last_used FROM CacheEntry').fetchone()[0])
+
+    def test_unpicklable_stays_local(self):
+        cache = self.worker(shared=True)
+        with self.assertLogs('od-info.cache', 'WARNING'):
+            cache['lambda'] = lambda: 1
+        self.assertEqual(1, cache['lambda']())
+
+
+if __name__ == '__main__':
+    unittest.main()
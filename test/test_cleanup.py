@@ -0,0 +1,61 @@
+import unittest
+from datetime import datetime, timedelta
+
+from odinfo.domain.models import BarracksSpy, ClearSight, Dominion, QueueTick
+from odinfo.repositories.game import GameRepository
+from odinfo.services.cleanup_service import CleanupService
+from test.fixtures import create_db_session, init_db
+
+
+class CleanupTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.session = create_db_session()
+        init_db(self.session)
+        self.repo = GameRepository(self.session)
+        now = datetime.now()
+        for hours in range(1, 26):
+            self.session.add(ClearSight(dominion_id=1, timestamp=now - timedelta(hours=100 + hours),
+                                        land=100, networth=1000, peasants=0, prestige=250,
+                                        resource_platinum=0))
+        self.session.commit()
+        self.cutoff = now - timedelta(hours=48)
+
+    def test_chunked_cleanup(self):
+        reported = []
+        deleted = self.repo.cleanup_old_ops(self.cutoff, chunk_size=10,
+                                            progress=lambda table, count: reported.append((table, count)))
+        self.assertEqual(25, deleted['ClearSight'])
+        self.assertEqual([10, 20, 25], [count for table, count in reported if table == 'ClearSight'])
+        # The fixture's ops are only ten hours old.
+        self.assertEqual(1, self.session.query(ClearSight).count())
+        self.assertEqual(1, self.session.query(BarracksSpy).count())
+        self.assertEqual(0, deleted[QueueTick.__tablename__])
+
+    def test_service_run(self):
+        cleared = []
+        progress = CleanupService(chunk_size=7, pause=0).run(self.repo, self.cutoff, on_done=cleared.append)
+        self.assertEqual('done', progress.status)
+        self.assertEqual(25, progress.total_deleted)
+        # Dominion 1 keeps a newer ClearSight
+        self.assertEqual([set()], cleared)
+        self.assertIn('freed_pages', progress.reclaimed)
+
+    def test_dominions_losing_latest_ops(self):
+        self.session.add(Dominion(code=2, name="Old News", realm=11, race="Human"))
+        self.session.add(ClearSight(dominion_id=2, timestamp=self.cutoff - timedelta(hours=5), land=100,
+                                    networth=1000, peasants=0, prestige=250, resource_platinum=0))
+        self.session.commit()
+        self.assertEqual({2}, self.repo.dominions_losing_latest_ops(self.cutoff))
+
+    def test_nothing_to_delete(self):
+        cleared = []
+        service = CleanupService(pause=0)
+        service.run(self.repo, self.cutoff)
+        progress = service.run(self.repo, self.cutoff, on_done=cleared.append)
+        self.assertEqual('done', progress.status)
+        self.assertEqual(0, progress.total_deleted)
+        self.assertEqual([], cleared)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from dataclasses import fields
+
+from odinfoweb.viewmodels.datatables import TableQuery, row_data
+from odinfoweb.viewmodels.military import MilitaryRowVM
+from odinfoweb.viewmodels.ratios import RatioRowVM
+
+
+def ratio_row(code: int, realm: int, land: int, race: str, spa: float | None, ops_age: float = 0) -> RatioRowVM:
+    return RatioRowVM(code=code, name=f'Dom {code}', realm=realm, land=land, race=race, networth=land * 100,
+                      wpa=None, spa=spa, ops_age=ops_age)
+
+
+ROWS = [ratio_row(1, 2, 1000, 'Dwarf', 0.5), ratio_row(2, 3, 1500, 'Nomad', None, ops_age=20),
+        ratio_row(3, 2, 800, 'Dwarf', 0.9), ratio_row(4, 4, 2000, 'Firewalker', 0.1, ops_age=5)]
+
+
+# DataTables request arguments for the columns name, land and (rendered by the page) spa
+COLUMNS = {'columns[0][data]': 'name', 'columns[1][data]': 'land', 'columns[2][data]': '', 'columns[2][name]': 'spa'}
+
+
+class TableQueryTest(unittest.TestCase):
+    def test_from_args(self):
+        query = TableQuery.from_args({**COLUMNS, 'draw': '3', 'order[0][column]': '2', 'order[0][dir]': 'desc',
+                                      'order[1][column]': '1', 'order[1][dir]': 'asc', 'order[2][column]': '9',
+                                      'start': '10', 'length': '25', 'search[value]': ' dwarf ',
+                                      'realm': '2', 'min_land': '', 'max_ops_age': 'x'})
+        self.assertEqual(TableQuery(draw=3, start=10, length=25, search='dwarf', order=[('spa', True), ('land', False)],
+                                    realm=2), query)
+
+    def test_filters(self):
+        codes = lambda query, **kwargs: [row.code for row in query.filtered(ROWS, **kwargs)]
+        self.assertEqual([1, 3], codes(TableQuery(realm=2)))
+        self.assertEqual([1, 3], codes(TableQuery(race='dwarf')))
+        self.assertEqual([1, 2], codes(TableQuery(min_land=900, max_land=1500)))
+        self.assertEqual([1, 3, 4], codes(TableQuery(max_ops_age=12)))
+        self.assertEqual([4], codes(TableQuery(search='fire'), search_fields=('name', 'race')))
+        self.assertEqual([], codes(TableQuery(search='fire')))
+
+    def test_sorting(self):
+        codes = lambda query: [row.code for row in query.sorted(ROWS)]
+        # Rows without a value go last both ways
+        self.assertEqual([3, 1, 4, 2], codes(TableQuery(order=[('spa', True)])))
+        self.assertEqual([4, 1, 3, 2], codes(TableQuery(order=[('spa', False)])))
+        self.assertEqual([3, 1, 4, 2], codes(TableQuery(order=[('race', False), ('land', False)])))
+        self.assertEqual([1, 2, 3, 4], codes(TableQuery(order=[('unknown', True)])))
+
+    def test_response(self):
+        response = TableQuery(draw=7, start=1, length=2, order=[('land', True)], max_ops_age=12).response(ROWS)
+        self.assertEqual({'draw': 7, 'recordsTotal': 4, 'recordsFiltered': 3}, {key: response[key] for key in
+                                                                              ('draw', 'recordsTotal', 'recordsFiltered')})
+        self.assertEqual([1, 3], [row['code'] for row in response['data']])
+        self.assertEqual(4, len(TableQuery().response(ROWS)['data']))
+
+    def test_row_data_properties(self):
+        row = MilitaryRowVM(**{field.name: 0 for field in fields(MilitaryRowVM)} | {'land': 1000, 'temples': 0.125})
+        self.assertEqual((1000, 12.5), (row_data(row)['land'], row_data(row)['temples_percent']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,10 @@
 import unittest
+from datetime import timedelta
 
 from test.fixtures import create_db_session, init_db
-from odinfo.domain.models import Dominion
+from odinfo.domain.models import BarracksSpy, Dominion, QueueTick
+from odinfo.repositories.game import GameRepository
+from odinfo.timeutils import current_od_time
 
 
 class DominionTest(unittest.TestCase):
@@ -14,6 +17,45 @@ class DominionTest(unittest.TestCase):
         self.assertEqual(dom.code, 1)  # add assertion here
         self.assertEqual(dom.last_cs.military_unit1, 10)
 
+    def test_training_queue(self):
+        bs = self.session.get(Dominion, 1).last_barracks
+        self.assertEqual({'spies': [0, 0, 0, 0, 10], 'unit3': [0, 0, 0, 0, 100, 0, 99]}, bs.tick_arrays('training'))
+        self.assertEqual(199, bs.amount_training(3))
+        self.assertEqual(0, bs.amount_returning(3))
+        # The fixture BS is 10 hours old: everything has arrived
+        self.assertEqual(0, bs.aged_amount_training_for_unit(3))
+        self.assertEqual(99, bs.aged_amount_training_for_unit_at_time(3, bs.timestamp + timedelta(hours=5)))
+        bs.training = {'unit3': {'12': 5}}
+        self.assertEqual(5, bs.aged_amount_training_for_unit(3))
+        self.assertEqual(12, bs.max_training_tick(3))
+
+    def test_queue_ticks(self):
+        dom = self.session.get(Dominion, 1)
+        repo = GameRepository(self.session)
+        with repo.transaction():
+            for op in (dom.last_barracks, dom.last_land, dom.last_survey):
+                self.session.add_all(QueueTick.from_op(op))
+        bs = dom.last_barracks
+        self.assertEqual(bs.tick_arrays('training'), repo.queue_arrays(1, bs.timestamp, 'training'))
+        self.assertEqual({'spies': 10, 'unit3': 100}, repo.arrived_amounts(1, bs.timestamp, 'training', 5))
+        self.assertEqual({'hill': 10, 'plain': 10}, repo.arrived_amounts(1, bs.timestamp, 'incoming', 12))
+        self.assertEqual({1: 0}, repo.paid_until_by_dominion())
+        self.assertEqual({}, repo.paid_until_by_dominion([2]))
+
+    def test_queue_ticks_keep_zero_amounts(self):
+        dom = self.session.get(Dominion, 1)
+        repo = GameRepository(self.session)
+        bs = BarracksSpy(dominion_id=1, timestamp=current_od_time() - timedelta(hours=2, minutes=10),
+                         training={'unit3': {'4': 100, '12': 0}}, returning={})
+        with repo.transaction():
+            self.session.add(bs)
+            self.session.add_all(QueueTick.from_op(bs))
+        self.session.refresh(dom)
+        self.assertIs(bs, dom.last_barracks)
+        self.assertEqual(bs.tick_arrays('training'), repo.queue_arrays(1, bs.timestamp, 'training'))
+        self.assertEqual(10, bs.paid_until)
+        self.assertEqual({1: bs.paid_until}, repo.paid_until_by_dominion([1]))
+
 
 if __name__ == '__main__':
     unittest.main()
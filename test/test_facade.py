@@ -0,0 +1,44 @@
+import tempfile
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+from odinfo.config import Config
+from odinfo.facade.cache import FacadeCache, LocalInvalidationLog
+from odinfo.facade.odinfo import ODInfoFacade
+from odinfo.repositories.game import GameRepository
+from odinfo.services.cleanup_service import CleanupService
+from odinfo.timeutils import current_od_time
+from test.fixtures import create_db_session, init_db
+
+
+class FacadeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.session = create_db_session()
+        init_db(self.session)
+        repo = GameRepository(self.session)
+        repo.get_dominion(1).last_op = current_od_time() - timedelta(hours=5)
+        self.session.commit()
+        config = Config(username='', password='', current_player_id=1, database_name='')
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache = FacadeCache(log=LocalInvalidationLog(Path(tmp_dir.name) / 'cache_invalidated_at'))
+        self.facade = ODInfoFacade(config, repo, self.cache)
+
+    def test_ops_ages_follow_the_clock(self):
+        ages = self.facade.all_doms_ops_age()
+        self.assertEqual({1: 5}, ages)
+        later = current_od_time() + timedelta(hours=3)
+        with mock.patch('odinfo.timeutils.current_od_time', return_value=later):
+            self.assertEqual({code: age + 3 for code, age in ages.items()}, self.facade.all_doms_ops_age())
+
+    def test_cleanup_keeps_the_cache(self):
+        self.facade.all_doms_ops_age()
+        progress = self.facade.cleanup_old_ops(CleanupService(pause=0))
+        self.assertEqual('done', progress.status)
+        self.assertIn('all_doms_last_op', self.cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from odinfo.domain.models import DominionHistory
+from odinfo.facade.graphs import GraphCache, GraphRenderer, history_graph_svg
+
+
+class GraphCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.rendered = []
+        self.graphs = GraphCache(Path(self.tmp_dir.name), GraphRenderer(self.render, '.png'))
+
+    def render(self, history, metric) -> bytes:
+        self.rendered.append((len(history), metric))
+        return f'{metric} {len(history)}'.encode()
+
+    def test_rendered_once_per_latest_history(self):
+        latest = datetime(2026, 10, 1, 12)
+        first = self.graphs.graph(1000, 'land', latest, lambda: [1, 2])
+        self.assertEqual(first, self.graphs.graph(1000, 'land', latest, lambda: [1, 2]))
+        self.assertEqual([(2, 'land')], self.rendered)
+        self.assertEqual(b'land 2', first.read_bytes())
+
+        newer = self.graphs.graph(1000, 'land', datetime(2026, 10, 1, 13), lambda: [1, 2, 3])
+        self.assertEqual(b'land 3', newer.read_bytes())
+        # The graph of older history is removed, the graphs of other metrics and dominions are kept
+        self.graphs.graph(1000, 'networth', latest, list)
+        self.graphs.graph(1001, 'land', latest, list)
+        self.assertFalse(first.exists())
+        self.assertEqual(3, len(list(Path(self.tmp_dir.name).iterdir())))
+
+    def test_no_history(self):
+        path = self.graphs.graph(1000, 'networth', None, list)
+        self.assertEqual('1000_networth_empty.png', path.name)
+
+    def test_unknown_metric(self):
+        self.assertRaises(ValueError, self.graphs.graph, 1000, 'peasants', None, list)
+
+
+class HistoryGraphTest(unittest.TestCase):
+    def test_svg(self):
+        start = datetime(2026, 10, 1)
+        # Newest first, as returned by GameRepository.get_history
+        history = [DominionHistory(dominion_id=1000, timestamp=start + timedelta(hours=hour), land=1000 + hour,
+                                   networth=100_000 + 500 * hour) for hour in reversed(range(48))]
+        svg = history_graph_svg(history, 'networth').decode()
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertIn('Networth over Time', svg)
+        points = svg.split('<polyline points="')[1].split('"')[0].split()
+        self.assertEqual(48, len(points))
+        # Rising networth goes up the chart, from left to right
+        first, last = [tuple(map(float, point.split(','))) for point in (points[0], points[-1])]
+        self.assertLess(first[0], last[0])
+        self.assertGreater(first[1], last[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
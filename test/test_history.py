@@ -0,0 +1,136 @@
+import unittest
+from datetime import datetime, timedelta
+
+from odinfo.calculators.networthcalculator import get_networth_deltas
+from odinfo.domain.models import Dominion, DominionHistory, DominionHistoryRollup
+from odinfo.repositories.game import GameRepository, history_resolution_for_span
+from odinfo.timeutils import truncate_to_bucket, current_od_time
+from test.fixtures import create_db_session, init_db
+
+
+class HistoryRollupTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.session = create_db_session()
+        init_db(self.session)
+        self.repo = GameRepository(self.session)
+
+    def _add_samples(self, start: datetime, values: list[tuple[int, int]]):
+        self.repo.add_history([
+            DominionHistory(dominion_id=1, timestamp=start + timedelta(hours=i), land=land, networth=nw)
+            for i, (land, nw) in enumerate(values)
+        ])
+
+    def test_truncate_to_bucket(self):
+        ts = datetime(2025, 1, 1, 13, 42, 10)
+        self.assertEqual(datetime(2025, 1, 1, 12), truncate_to_bucket(ts, 6))
+        self.assertEqual(datetime(2025, 1, 1, 0), truncate_to_bucket(ts, 24))
+
+    def test_rollups_min_max_last(self):
+        start = datetime(2025, 1, 1, 0, 5)
+        self._add_samples(start, [(100, 1000), (120, 900), (110, 1500), (105, 1100)])
+        self._add_samples(start + timedelta(hours=6), [(200, 2000)])
+
+        six_hour = self.session.get(DominionHistoryRollup, [1, 6, datetime(2025, 1, 1, 0)])
+        self.assertEqual((100, 120, 105), (six_hour.land_min, six_hour.land_max, six_hour.land))
+        self.assertEqual((900, 1500, 1100), (six_hour.networth_min, six_hour.networth_max, six_hour.networth))
+        self.assertEqual(4, six_hour.samples)
+
+        daily = self.session.get(DominionHistoryRollup, [1, 24, datetime(2025, 1, 1, 0)])
+        self.assertEqual((100, 200, 200), (daily.land_min, daily.land_max, daily.land))
+        self.assertEqual(5, daily.samples)
+
+    def test_rebuild_matches_incremental(self):
+        start = datetime(2025, 1, 1, 3, 0)
+        self._add_samples(start, [(100 + i, 1000 + 7 * i) for i in range(50)])
+        before = {(r.resolution, r.timestamp): (r.land_min, r.land_max, r.land, r.networth, r.samples)
+                  for r in self.session.query(DominionHistoryRollup).filter_by(dominion_id=1)}
+        self.repo.rebuild_history_rollups(batch_size=7)
+        after = {(r.resolution, r.timestamp): (r.land_min, r.land_max, r.land, r.networth, r.samples)
+                 for r in self.session.query(DominionHistoryRollup).filter_by(dominion_id=1)}
+        # The fixture's own history row only ends up in the rebuilt rollups.
+        fixture_bucket = before.keys() ^ after.keys()
+        self.assertTrue(all(after[k][4] == 1 for k in fixture_bucket))
+        for key in before.keys() & after.keys():
+            self.assertEqual(before[key][:4], after[key][:4])
+
+    def test_resolution_for_span(self):
+        self.assertEqual(1, history_resolution_for_span(48))
+        self.assertEqual(6, history_resolution_for_span(30 * 24))
+        self.assertEqual(24, history_resolution_for_span(90 * 24))
+
+
+class CompressedHistoryTest(unittest.TestCase):
+    # Hourly (land, networth) samples for three dominions over 30 hours
+    SAMPLES = {
+        11: [(500, 5000)] * 30,
+        12: [(600, 6000)] * 10 + [(610, 6100)] * 5 + [(610, 6050)] * 15,
+        13: [(700, 7000)] * 20 + [(690, 6900)] * 10,
+    }
+
+    def setUp(self) -> None:
+        # Shared by both repositories of a test, so their samples have identical timestamps.
+        self.start = current_od_time() - timedelta(hours=29, minutes=30)
+
+    def _repo_with_samples(self, compress: bool) -> GameRepository:
+        session = create_db_session()
+        repo = GameRepository(session)
+        repo.add_dominions([Dominion(code=code, name=f'Dom {code}', realm=1, race='Dwarf') for code in self.SAMPLES])
+        start = self.start
+        for hour in range(30):
+            repo.add_history([
+                DominionHistory(dominion_id=code, timestamp=start + timedelta(hours=hour), land=land, networth=nw)
+                for code, values in self.SAMPLES.items()
+                for land, nw in [values[hour]]
+            ], compress=compress)
+        return repo
+
+    def test_compression_stores_only_changes(self):
+        repo = self._repo_with_samples(compress=True)
+        self.assertEqual(6, repo.session.query(DominionHistory).count())
+
+    def test_networth_deltas_identical(self):
+        plain = self._repo_with_samples(compress=False)
+        compressed = self._repo_with_samples(compress=True)
+        for since in (5, 12, 24, 48):
+            self.assertEqual(get_networth_deltas(plain, since=since), get_networth_deltas(compressed, since=since))
+
+    def test_history_identical(self):
+        plain = self._repo_with_samples(compress=False)
+        compressed = self._repo_with_samples(compress=True)
+        for hours in (12, None):
+            for code in self.SAMPLES:
+                plain_points = [(h.timestamp, h.land, h.networth) for h in plain.get_history(code, hours)]
+                compressed_points = [(h.timestamp, h.land, h.networth) for h in compressed.get_history(code, hours)]
+                # Compressed history keeps the start, end and every change of a run.
+                self.assertTrue(set(compressed_points) <= set(plain_points))
+                self.assertEqual(plain_points[0], compressed_points[0])
+                self.assertEqual(plain_points[-1], compressed_points[-1])
+
+    def test_latest_history_timestamp(self):
+        plain = self._repo_with_samples(compress=False)
+        compressed = self._repo_with_samples(compress=True)
+        for code in self.SAMPLES:
+            self.assertEqual(self.start + timedelta(hours=29), plain.latest_history_timestamp(code))
+            self.assertEqual(plain.latest_history_timestamp(code), compressed.latest_history_timestamp(code))
+        self.assertIsNone(plain.latest_history_timestamp(99))
+
+    def test_current_values_identical(self):
+        plain = self._repo_with_samples(compress=False)
+        compressed = self._repo_with_samples(compress=True)
+        for code in self.SAMPLES:
+            self.assertEqual(plain.get_dominion(code).current_networth, compressed.get_dominion(code).current_networth)
+
+    def test_rebuild_in_chunks(self):
+        def rollups(repo):
+            return {(r.dominion_id, r.resolution, r.timestamp): (r.land_min, r.land_max, r.land, r.networth, r.samples)
+                    for r in repo.session.query(DominionHistoryRollup)}
+
+        plain = self._repo_with_samples(compress=False)
+        compressed = self._repo_with_samples(compress=True)
+        # Chunks smaller than a dominion's history, that also span two dominions
+        compressed.rebuild_history_rollups(batch_size=4)
+        self.assertEqual(rollups(plain), rollups(compressed))
+
+
+if __name__ == '__main__':
+    unittest.main()
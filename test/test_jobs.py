@@ -0,0 +1,86 @@
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from odinfo.domain.models import Base, Job
+from odinfo.services.job_service import JobService, JOB_TIMEOUT
+
+
+class JobServiceTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # A database file, as the worker thread needs a connection of its own
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{Path(self.tmp.name) / 'jobs.db'}")
+        Base.metadata.create_all(self.engine)
+        self.executed = []
+        self.jobs = JobService(lambda: Session(self.engine), self.execute, poll_interval=0.05, autostart=False)
+
+    def tearDown(self) -> None:
+        self.jobs.stop(timeout=5)
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def execute(self, job, report):
+        report(f"Running {job.kind}")
+        self.executed.append((job.kind, job.argument, self.jobs.status(job.id).progress))
+        if job.kind == 'fail':
+            raise ValueError("Site is down")
+
+    def test_duplicate_jobs_are_coalesced(self):
+        first = self.jobs.enqueue('update_dominion', 12)
+        self.assertEqual('queued', first.status)
+        self.assertEqual(first.id, self.jobs.enqueue('update_dominion', '12').id)
+        self.assertNotEqual(first.id, self.jobs.enqueue('update_dominion', 13).id)
+        self.assertNotEqual(first.id, self.jobs.enqueue('update_overview').id)
+
+        self.assertEqual(3, self.jobs.run_pending())
+        self.assertEqual([('update_dominion', '12', "Running update_dominion"),
+                          ('update_dominion', '13', "Running update_dominion"),
+                          ('update_overview', '', "Running update_overview")], self.executed)
+        done = self.jobs.status(first.id)
+        self.assertEqual('done', done.status)
+        self.assertTrue(done.finished)
+        self.assertGreaterEqual(done.duration, 0)
+        # Once it is done, the same job can be queued again
+        self.assertNotEqual(first.id, self.jobs.enqueue('update_dominion', 12).id)
+
+    def test_failed_job(self):
+        job = self.jobs.enqueue('fail')
+        self.jobs.run_pending()
+        failed = self.jobs.status(job.id)
+        self.assertEqual('failed', failed.status)
+        self.assertEqual("Site is down", failed.error)
+        self.assertEqual('failed', failed.as_dict()['status'])
+        self.assertIsNone(self.jobs.status(job.id + 1))
+
+    def test_abandoned_job_is_expired(self):
+        with Session(self.engine) as session:
+            session.add(Job(kind='update_overview', argument='', status='running', worker='pid 1',
+                            enqueued_at=datetime.now() - JOB_TIMEOUT * 2,
+                            started_at=datetime.now() - JOB_TIMEOUT * 2))
+            session.commit()
+        job = self.jobs.enqueue('update_overview')
+        self.assertEqual('queued', job.status)
+        self.assertEqual('failed', self.jobs.status(job.id - 1).status)
+
+    def test_worker_thread(self):
+        finished = threading.Event()
+        jobs = JobService(lambda: Session(self.engine), lambda job, report: finished.set(), poll_interval=0.05)
+        job = jobs.enqueue('update_town_crier')
+        try:
+            self.assertTrue(finished.wait(5))
+            deadline = datetime.now() + timedelta(seconds=5)
+            while not jobs.status(job.id).finished and datetime.now() < deadline:
+                finished.wait(0.01)
+            self.assertEqual('done', jobs.status(job.id).status)
+        finally:
+            jobs.stop(timeout=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from odinfo.domain.models import BarracksSpy, Dominion
+from odinfo.repositories.game import GameRepository
+from odinfo.services.military_service import MilitaryService
+from odinfo.timeutils import current_od_time
+from test.fixtures import add_queue_ticks, create_db_session, init_db, synthetic_round
+
+
+def random_queue(rng: random.Random) -> dict:
+    return {f'unit{i}': {str(tick): rng.randint(1, 2000) for tick in rng.sample(range(1, 13), rng.randint(1, 5))}
+            for i in range(1, 5) if rng.random() < 0.5}
+
+
+def fuzzed(rng: random.Random, amount: int) -> int:
+    """A BS observation of amount."""
+    return round(amount * rng.uniform(0.85, 1 / 0.85))
+
+
+class MilitaryServiceTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.session = create_db_session()
+        init_db(self.session)
+        rng = random.Random(37)
+        for dom in synthetic_round(self.session, 120, seed=37):
+            # The synthetic BS and up to three more in its tick (a few hours ago), all fuzzed observations
+            latest = dom.last_barracks
+            home = {'draftees': rng.randint(0, 5000), **{f'home_unit{i}': rng.randint(0, 20000) for i in range(1, 5)}}
+            training, returning = random_queue(rng), random_queue(rng)
+            for nr in range(rng.randint(0, 3) + 1):
+                bs = latest if nr == 0 else BarracksSpy(
+                    timestamp=latest.timestamp.replace(microsecond=(latest.timestamp.microsecond + nr) % 1_000_000))
+                for name, amount in home.items():
+                    setattr(bs, name, fuzzed(rng, amount))
+                bs.training = training
+                bs.returning = {unit: {tick: fuzzed(rng, amount) for tick, amount in ticks.items()}
+                                for unit, ticks in returning.items()}
+                if bs is not latest:
+                    dom.barracks_spy.append(bs)
+        add_queue_ticks(self.session)
+        self.repo = GameRepository(self.session)
+
+    def test_latest_tick_query(self):
+        spies = self.repo.barracks_spies_in_latest_tick()
+        service = MilitaryService(self.repo)
+        for dom in self.session.query(Dominion).all():
+            expected = service.get_barracks_spies_in_tick(dom, dom.last_barracks.timestamp)
+            self.assertEqual(expected, spies[dom.code])
+
+    def add_older_spies(self):
+        """A BS two ticks before the latest one for every other dominion, observing the same home units."""
+        rng = random.Random(39)
+        for dom in self.session.query(Dominion).filter(Dominion.code % 2 == 0):
+            latest = dom.last_barracks
+            older = BarracksSpy(timestamp=latest.timestamp - timedelta(hours=2), training={}, returning={})
+            for name in ('draftees', 'home_unit1', 'home_unit2', 'home_unit3', 'home_unit4'):
+                setattr(older, name, fuzzed(rng, getattr(latest, name)))
+            dom.barracks_spy.append(older)
+        add_queue_ticks(self.session)
+
+    def test_latest_tick_query_window(self):
+        self.add_older_spies()
+        latest = self.repo.barracks_spies_in_latest_tick()
+        window = self.repo.barracks_spies_in_latest_tick(window_ticks=2)
+        for dom in self.session.query(Dominion).all():
+            expected = latest[dom.code] + ([dom.barracks_spy[-1]] if dom.code % 2 == 0 else [])
+            self.assertEqual(expected, window[dom.code])
+
+    def test_batch_refined_strength(self):
+        self.add_older_spies()
+        rows = MilitaryService(self.repo).military_table(current_day=10, top=1000, include_current_strength=True).rows
+        self.assertEqual(121, len(rows))
+        reference = MilitaryService(self.repo)
+        for row in rows:
+            dom = self.session.get(Dominion, row.code)
+            with self.subTest(dom=dom.code, race=dom.race):
+                paid_op, paid_dp, confidence = reference.refine_paid_strength(dom)
+                current_op, current_dp, _ = reference.calculate_current_strength(dom)
+                self.assertEqual((paid_op, paid_dp, confidence), (row.paid_op, row.paid_dp, row.confidence))
+                self.assertEqual((current_op, current_dp), (row.current_op, row.current_dp))
+
+    def test_strength_distribution_brackets_current(self):
+        self.add_older_spies()
+        service = MilitaryService(self.repo)
+        for dom in self.session.query(Dominion).filter(Dominion.code % 2 == 0):
+            distribution = service.strength_distribution(dom, samples=4000, seed=dom.code)
+            current_op, current_dp, _ = service.calculate_current_strength(dom)
+            if distribution is None:
+                continue
+            with self.subTest(dom=dom.code, race=dom.race):
+                # Sampled within the same cross-tick bounds as the current strength is calculated from
+                self.assertLessEqual(distribution.op_percentiles[0] - 1, current_op)
+                self.assertGreaterEqual(distribution.op_percentiles[2] + 1, current_op)
+                self.assertLessEqual(distribution.dp_percentiles[0] - 1, current_dp)
+                self.assertGreaterEqual(distribution.dp_percentiles[2] + 1, current_dp)
+
+    def test_stored_results(self):
+        # A fixed clock, so that the test doesn't cross a tick
+        with mock.patch('odinfo.services.military_service.current_od_time', return_value=current_od_time()):
+            MilitaryService(self.repo).military_table(current_day=10, top=1000)
+            self.assertEqual(121, len(self.repo.military_results(range(2000))))
+
+            # Another worker uses the stored figures, even though the BS changed without a new op
+            dom = self.session.get(Dominion, 1000)
+            paid_op = self.row(MilitaryService(self.repo).military_table(current_day=10, top=1000), 1000).paid_op
+            dom.last_barracks.home_unit1 *= 3
+            self.session.commit()
+            self.assertEqual(paid_op, self.row(MilitaryService(self.repo).military_table(current_day=10, top=1000),
+                                               1000).paid_op)
+
+            # Only the dominion with a newer op is recomputed
+            dom.add_last_op(datetime.now())
+            self.session.commit()
+            table, computed = self.military_table_computing(current_day=10)
+            self.assertNotEqual(paid_op, self.row(table, 1000).paid_op)
+            self.assertEqual([1000], computed)
+
+            # A new day recomputes everything, for the boat protection
+            MilitaryService(self.repo).military_table(current_day=11, top=1000)
+            self.assertTrue(all(result.current_day == 11
+                                for result in self.repo.military_results(range(2000)).values()))
+
+    def test_new_tick_keeps_results(self):
+        now = current_od_time()
+        with mock.patch('odinfo.services.military_service.current_od_time', return_value=now):
+            before = MilitaryService(self.repo).military_table(current_day=10, top=1000,
+                                                               include_current_strength=True).rows
+
+        # An hour later nothing is recomputed, but paid_until and the current strength moved on a tick
+        later = now + timedelta(hours=1)
+        with (mock.patch('odinfo.services.military_service.current_od_time', return_value=later),
+              mock.patch('odinfo.timeutils.current_od_time', return_value=later)):
+            service = MilitaryService(self.repo)
+            with mock.patch.object(service, '_compute_military_results',
+                                   wraps=service._compute_military_results) as compute:
+                rows = service.military_table(current_day=10, top=1000, include_current_strength=True).rows
+            compute.assert_not_called()
+            reference = MilitaryService(self.repo)
+            counted_down = [row for row in before if isinstance(row.paid_until, int) and row.paid_until > 0]
+            self.assertTrue(counted_down)
+            for row in counted_down:
+                self.assertEqual(row.paid_until - 1, self.row_of(rows, row.code).paid_until)
+            for row in rows:
+                dom = self.session.get(Dominion, row.code)
+                with self.subTest(dom=dom.code):
+                    self.assertEqual(reference.calculate_current_strength(dom)[:2], (row.current_op, row.current_dp))
+                    self.assertEqual(reference.refine_paid_strength(dom),
+                                     (row.paid_op, row.paid_dp, row.confidence) if row.confidence else
+                                     (None, None, None))
+
+    def military_table_computing(self, current_day: int):
+        """The rows of the military table, and the codes of the dominions whose results were computed for it."""
+        service = MilitaryService(self.repo)
+        with mock.patch.object(service, '_compute_military_results',
+                               wraps=service._compute_military_results) as compute:
+            table = service.military_table(current_day=current_day, top=1000)
+        return table, sorted(dom.code for call in compute.call_args_list for dom in call.args[0])
+
+    def test_patch_military_table(self):
+        service = MilitaryService(self.repo)
+        table = service.military_table(current_day=10, top=1000, include_current_strength=True)
+        dom = self.session.get(Dominion, 1000)
+        dom.last_barracks.home_unit1 *= 3
+        dom.add_last_op(datetime.now())
+        self.session.commit()
+        patched = service.patch_military_table(table, [dom])
+        expected = service.military_table(current_day=10, top=1000, include_current_strength=True)
+        self.assertEqual(expected.rows, patched.rows)
+        self.assertNotEqual(table.rows, patched.rows)
+
+    @staticmethod
+    def row(table, code: int):
+        return MilitaryServiceTest.row_of(table.rows, code)
+
+    @staticmethod
+    def row_of(rows, code: int):
+        return next(row for row in rows if row.code == code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from odinfo.domain.models import Dominion
+from odinfo.repositories.game import GameRepository
+from odinfo.repositories.querystats import QueryRecorder, fingerprint
+from test.fixtures import create_db_session
+
+
+class QueryStatsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.session = create_db_session()
+        self.repo = GameRepository(self.session)
+        self.repo.add_dominions([Dominion(code=code, name=f'Dom {code}', realm=1, race='Dwarf') for code in range(1, 9)])
+        self.session.expunge_all()
+        self.recorder = QueryRecorder(n_plus_one_threshold=5)
+        self.recorder.install(self.session.get_bind())
+
+    def test_fingerprint(self):
+        self.assertEqual("SELECT * FROM t WHERE a = ? AND b IN (?) AND c = ?",
+                         fingerprint("SELECT *  FROM t\n WHERE a = 'x' AND b IN (?, ?, ?) AND c = 12"))
+
+    def test_n_plus_one_detected(self):
+        with self.recorder.recording('lazy loop') as stats:
+            for dom in self.repo.all_dominions():
+                list(dom.barracks_spy)
+        self.assertEqual(9, stats.count)
+        self.assertEqual(1, len(stats.repeated(self.recorder.n_plus_one_threshold)))
+        self.assertEqual(8, stats.repeated(self.recorder.n_plus_one_threshold)[0][1])
+        self.assertEqual('lazy loop', self.recorder.recent()[0]['label'])
+
+    def test_suspend_and_resume(self):
+        token = self.recorder.start('streamed')
+        list(self.repo.all_dominions())
+        stats = self.recorder.suspend(token)
+        list(self.repo.all_dominions())
+        self.assertEqual([], self.recorder.recent())
+        with self.recorder.resumed(stats):
+            list(self.repo.all_dominions())
+        self.assertEqual(2, stats.count)
+        self.assertEqual('streamed', self.recorder.recent()[0]['label'])
+
+    def test_outside_recording_ignored(self):
+        list(self.repo.all_dominions())
+        self.assertEqual([], self.recorder.recent())
+
+
+if __name__ == '__main__':
+    unittest.main()
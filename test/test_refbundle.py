@@ -0,0 +1,47 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from odinfo.config import REF_DATA_DIR
+from odinfo.domain import refbundle
+
+
+class RefBundleTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.ref_data_dir = self.tmp_dir / 'ref-data'
+        shutil.copytree(REF_DATA_DIR, self.ref_data_dir)
+        self.bundle_file = self.tmp_dir / 'instance' / 'ref-data.pickle'
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def load(self) -> refbundle.RefDataBundle:
+        return refbundle.load_bundle(str(self.ref_data_dir), self.bundle_file)
+
+    def test_contents(self):
+        bundle = self.load()
+        self.assertEqual('Dwarf', bundle.races['dwarf']['name'])
+        self.assertIn('GT_DEFENSE_FACTOR', bundle.config)
+        self.assertIn('offense', bundle.spells)
+        self.assertIn('offense', bundle.techs)
+
+    def test_bundle_reused_until_sources_change(self):
+        first = self.load()
+        self.assertTrue(self.bundle_file.exists())
+        with mock.patch.object(refbundle, 'compile_ref_data', wraps=refbundle.compile_ref_data) as compile_:
+            self.assertEqual(first, self.load())
+            compile_.assert_not_called()
+
+            with open(self.ref_data_dir / 'config.json') as f:
+                config = f.read()
+            with open(self.ref_data_dir / 'config.json', 'w') as f:
+                f.write(config.replace('{', '{"EXTRA": 1, ', 1))
+            self.assertEqual(1, self.load().config['EXTRA'])
+            compile_.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
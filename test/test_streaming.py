@@ -0,0 +1,52 @@
+import gzip
+import unittest
+import zlib
+
+from flask import Flask, Response, request
+
+from odinfoweb.streaming import buffered, compress, gzip_stream
+
+
+class StreamingTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.app = Flask(__name__)
+
+    def test_buffered(self):
+        self.assertEqual(['abcd', 'efg'], list(buffered(['ab', 'cd', 'ef', 'g'], size=3)))
+        self.assertEqual(['abcdefg'], list(buffered(['ab', 'cd', 'ef', 'g'], size=100)))
+        self.assertEqual([], list(buffered([])))
+        # Everything up to the marker is sent at once, the rest is buffered again
+        self.assertEqual(['ab<!>', 'cdef', 'g'], list(buffered(['a', 'b<!>', 'cd', 'ef', 'g'], size=3, flush_after='<!>')))
+        self.assertEqual(['abcd', 'e<!>', 'fgh'], list(buffered(['ab', 'cd', 'e<!>', 'fgh'], size=3, flush_after='<!>')))
+
+    def test_gzip_stream_flushes_every_chunk(self):
+        decompressor = zlib.decompressobj(31)
+        received = []
+        for data in gzip_stream(['<html>', 'row ' * 100, '</html>']):
+            received.append(decompressor.decompress(data).decode())
+        # Every chunk can be decompressed as soon as it arrives
+        self.assertEqual(['<html>', 'row ' * 100, '</html>'], received[:3])
+        self.assertEqual('<html>' + 'row ' * 100 + '</html>', ''.join(received))
+        self.assertTrue(decompressor.eof)
+
+    def test_compress(self):
+        page = '<tr><td>row</td></tr>' * 100
+        with self.app.test_request_context(headers={'Accept-Encoding': 'gzip, deflate'}):
+            response = compress(request, Response(page))
+            self.assertEqual('gzip', response.headers['Content-Encoding'])
+            self.assertEqual(page, gzip.decompress(response.get_data()).decode())
+            self.assertIn('Accept-Encoding', response.vary)
+
+            streamed = compress(request, Response(iter([page, page])))
+            self.assertEqual(page * 2, gzip.decompress(b''.join(streamed.response)).decode())
+
+            # Too small, or not compressible
+            self.assertNotIn('Content-Encoding', compress(request, Response('<p>hi</p>')).headers)
+            self.assertNotIn('Content-Encoding', compress(request, Response(page, mimetype='image/png')).headers)
+
+        with self.app.test_request_context():
+            self.assertNotIn('Content-Encoding', compress(request, Response(page)).headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
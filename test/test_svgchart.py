@@ -0,0 +1,47 @@
+import unittest
+from datetime import datetime, timedelta
+
+from odinfo.facade.svgchart import Series, downsample, line_chart, nice_ticks, time_ticks
+
+START = datetime(2026, 10, 1, 5, 30)
+
+
+class SvgChartTest(unittest.TestCase):
+    def test_nice_ticks(self):
+        self.assertEqual([0, 20, 40, 60, 80, 100], nice_ticks(3, 97))
+        self.assertEqual([1_000_000, 1_250_000, 1_500_000, 1_750_000, 2_000_000, 2_250_000],
+                         nice_ticks(1_010_000, 2_200_000))
+        self.assertEqual([4, 4.5, 5, 5.5, 6], nice_ticks(5, 5))
+
+    def test_time_ticks(self):
+        ticks, fmt = time_ticks(START, START + timedelta(hours=17))
+        self.assertEqual([datetime(2026, 10, 1, hour) for hour in (6, 9, 12, 15, 18, 21)], ticks)
+        self.assertEqual('%m-%d %H:%M', fmt)
+        ticks, fmt = time_ticks(START, START + timedelta(days=40))
+        self.assertEqual(timedelta(days=7), ticks[1] - ticks[0])
+        self.assertTrue(all(tick.hour == 0 for tick in ticks))
+        self.assertEqual('%Y-%m-%d', fmt)
+
+    def test_downsample_keeps_extremes(self):
+        points = [(START + timedelta(hours=hour), hour % 7) for hour in range(1000)]
+        sampled = downsample(points, 100)
+        self.assertLessEqual(len(sampled), 100)
+        self.assertEqual(sorted(sampled), sampled)
+        self.assertEqual((0, 6), (min(v for _, v in sampled), max(v for _, v in sampled)))
+        self.assertIs(points, downsample(points, 1000))
+
+    def test_multiple_series(self):
+        land = Series('Land', [(START + timedelta(hours=hour), 1000 + hour) for hour in range(24)])
+        other = Series('Other <dom>', [(START + timedelta(hours=hour), 900 + 2 * hour) for hour in range(24)])
+        svg = line_chart([land, other], 'Land & more')
+        self.assertEqual(2, svg.count('<polyline'))
+        self.assertIn('Land &amp; more', svg)
+        self.assertIn('Other &lt;dom&gt;', svg)
+
+    def test_single_point_and_empty(self):
+        self.assertEqual(1, line_chart([Series('Land', [(START, 1000)])]).count('<polyline'))
+        self.assertIn('No data', line_chart([Series('Land', [])]))
+
+
+if __name__ == '__main__':
+    unittest.main()